@@ -4,6 +4,11 @@ import pandas as pd
 import numpy as np
 import sys
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from emapper_reader import read_annotations
+from eggnog_counts import annotation_counts, CountCubeBuilder, COUNTS_NAME
 
 mode = "debug"
 
@@ -30,37 +35,45 @@ def read_prokka_file(faa_file):
     df["source_file"] = os.path.basename(faa_file)
     return df
 
-def read_annotation_file(annotation_file):
-    """Read EggNOG annotation file."""
+def read_annotation_file(annotation_file, nrows=None):
+    """Read EggNOG annotation file (only the first ``nrows`` rows if given)."""
     try:
-        with open(annotation_file) as file:
-                for i, line in enumerate(file):
-                    if line.startswith("#query"):
-                        header_line = i
-                        break
-                else:
-                    raise ValueError("No header line starting with '#query' found")
-
-            # Read the file starting from the header line
-        df = pd.read_csv(annotation_file, sep="\t", header=header_line, low_memory=False)
-
-        if "#query" not in df.columns:
-            # Try to find the query column if renamed
-            df.columns = [col.strip() for col in df.columns]
-            possible = [c for c in df.columns if "query" in c.lower()]
-            if possible:
-                df = df.rename(columns={possible[0]: "#query"})
-            else:
-                raise ValueError("No #query column found.")
+        df = read_annotations(annotation_file, nrows=nrows)
         df["source_file"] = os.path.basename(annotation_file)
         return df
     except Exception as e:
         print(f"Error reading {annotation_file}: {e}")
         return pd.DataFrame()
 
+def annotation_key(annotation_file):
+    """Genome base name of an annotation file: GCA_x.emapper.emapper.annotations -> GCA_x."""
+    key = os.path.basename(annotation_file)
+    if key.endswith(".annotations"):
+        key = key[:-len(".annotations")]
+    while key.endswith(".emapper"):
+        key = key[:-len(".emapper")]
+    return key
+
+
+def faa_key(faa_file):
+    return os.path.splitext(os.path.basename(faa_file))[0]
+
+
+def index_annotations(annotations):
+    """Basename index of the annotation files; the first file found wins for a duplicated genome."""
+    index = {}
+    for ann in annotations:
+        key = annotation_key(ann)
+        if key in index:
+            print(f"Duplicate annotation for {key}: using {index[key]}, ignoring {ann}")
+            continue
+        index[key] = ann
+    return index
+
+
 def compare_files(annotations, prokka_outputs):
-    anno_bases = [os.path.basename(f).replace('.emapper.emapper.annotations', "") for f in annotations]
-    faa_bases = [os.path.basename(f).replace('.faa', "") for f in prokka_outputs]
+    anno_bases = [annotation_key(f) for f in annotations]
+    faa_bases = [faa_key(f) for f in prokka_outputs]
 
     common = set(anno_bases) & set(faa_bases)
     missing_in_ann = set(faa_bases) - set(anno_bases)
@@ -78,19 +91,57 @@ def merge_annotation_with_prokka(prokka_df, ann_df):
     merged = pd.merge(prokka_df, ann_df, on="#query", how="left")
     for col in merged.select_dtypes(include="object").columns:
         merged[col] = merged[col].fillna("-")
+    for col in merged.select_dtypes(include="category").columns:
+        if "-" not in merged[col].cat.categories:
+            merged[col] = merged[col].cat.add_categories("-")
+        merged[col] = merged[col].fillna("-")
 
     return merged
 
 
 def process_pair(faa_file, ann_file):
-    """Process one Prokka–EggNOG pair."""
+    """Process one Prokka–EggNOG pair; without an annotation file the genome is marked unannotated."""
+    if ann_file is None:
+        df = read_prokka_file(faa_file)
+        df["annotation_found"] = False
+        df["COG_category"] = "-"
+        df["Description"] = "-"
+        return df
     prokka_df = read_prokka_file(faa_file)
     ann_df = read_annotation_file(ann_file)
     return merge_annotation_with_prokka(prokka_df, ann_df)
 
 
+def pair_columns(ann_file):
+    """Columns process_pair() produces for a genome, from the annotation header and first row only."""
+    prokka_df = pd.DataFrame({"#query": [], "source_file": []})
+    if ann_file is None:
+        return list(prokka_df.columns) + ["annotation_found", "COG_category", "Description"]
+    return list(merge_annotation_with_prokka(prokka_df, read_annotation_file(ann_file, nrows=1)).columns)
+
+
+def process_pair_counts(faa_file, ann_file):
+    """process_pair() plus the genome's COG/KEGG/OG counts (eggnog_counts.py)."""
+    df = process_pair(faa_file, ann_file)
+    return df, annotation_counts(df)
+
 
-def main(annotation_dir, prokka_dir):
+def iter_pairs(pairs, workers=None):
+    """Run process_pair_counts() over (faa, annotation) pairs on a process pool, yielding results in order."""
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for faa, ann in pairs:
+            pending.append(pool.submit(process_pair_counts, faa, ann))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def main(annotation_dir, prokka_dir, output="/home/anirudh/genomes/prokka_eggnog_combined.csv",
+         workers=None, chunk_rows=200000,
+         metadata_tsv="/home/anirudh/genomes/Asgard_genomes/ncbi_dataset/ncbi_dataset.tsv"):
 
     # Get all .annotation files from the results dir
     anns = get_files(annotation_dir, ".annotations")
@@ -100,25 +151,43 @@ def main(annotation_dir, prokka_dir):
     with open("missing_faas.txt", "w") as out:
         out.write("\n".join(missing))
 
-    combined = []
-    for faa in faas:
-        base = os.path.splitext(os.path.basename(faa))[0]
-        # Try to find corresponding annotation file
-        ann = next((f for f in anns if base in os.path.basename(f)), None)
-        if ann:
-            df = process_pair(faa, ann)
-        else:
-            df = read_prokka_file(faa)
-            df["annotation_found"] = False
-            df["COG_category"] = "-"
-            df["Description"] = "-"
-        combined.append(df)
-
-    all_merged = pd.concat(combined, ignore_index=True)
-    output = "/home/anirudh/genomes/prokka_eggnog_combined.csv"
-    all_merged.to_csv(output, index=False)
+    # exact basename pairing; genomes without annotation are kept as unannotated
+    ann_index = index_annotations(anns)
+    pairs = [(faa, ann_index.get(faa_key(faa))) for faa in faas]
+
+    # the output columns are the union over all pairs, in the order pd.concat would give them
+    columns = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for cols in pool.map(pair_columns, [ann for _, ann in pairs], chunksize=16):
+            columns.extend(c for c in cols if c not in columns)
+
+    total, buffer, buffered = 0, [], 0
+    cube = CountCubeBuilder()
+
+    def flush():
+        nonlocal total, buffer, buffered
+        chunk = pd.concat(buffer, ignore_index=True).reindex(columns=columns)
+        chunk.to_csv(output, index=False, mode="w" if total == 0 else "a", header=total == 0)
+        total += len(chunk)
+        buffer, buffered = [], 0
+
+    for (faa, _), (df, counts) in zip(pairs, iter_pairs(pairs, workers)):
+        cube.add(faa_key(faa), counts)
+        buffer.append(df)
+        buffered += len(df)
+        if buffered >= chunk_rows:
+            flush()
+    if buffer:
+        flush()
+    if total == 0:
+        pd.DataFrame(columns=columns).to_csv(output, index=False)
+
     print(f"✅ Combined file saved: {output}")
-    print(f"📊 Total entries: {len(all_merged)}")
+    print(f"📊 Total entries: {total}")
+
+    counts_file = os.path.join(os.path.dirname(os.path.abspath(output)), COUNTS_NAME)
+    cube.save(counts_file, metadata_tsv if os.path.exists(metadata_tsv) else None)
+    print(f"🧮 Genome x COG/KEGG/OG counts saved: {counts_file}")
 
 
 
@@ -132,5 +201,8 @@ if __name__=="__main__":
     defaultdir_prokka = "/home/anirudh/genomes/selected_genomes/prokka_results"
     rootdir_annotation = sys.argv[1] if len(sys.argv) > 1 else defaultdir_annotation
     rootdir_prokka = sys.argv[2] if len(sys.argv) > 2 else defaultdir_prokka
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    output = sys.argv[4] if len(sys.argv) > 4 else "/home/anirudh/genomes/prokka_eggnog_combined.csv"
+    metadata_tsv = sys.argv[5] if len(sys.argv) > 5 else "/home/anirudh/genomes/Asgard_genomes/ncbi_dataset/ncbi_dataset.tsv"
 
-    main(rootdir_annotation, rootdir_prokka)
\ No newline at end of file
+    main(rootdir_annotation, rootdir_prokka, output=output, workers=workers, metadata_tsv=metadata_tsv)
\ No newline at end of file
@@ -8,20 +8,31 @@ set +e -uo pipefail
 #   1. Query proteins FASTA file
 #   2. Reference MMseqs2 DB (asgard_db)
 #   3. Output directory
+#   4. Threads for the mmseqs steps (default: all cores)
+# Steps keep going after an error (debug mode) unless PIPELINE_STRICT=1, as the
+# Snakemake workflow sets it, so a failed step fails the whole run.
 # Usage:
-#   ./asgard_cluster_pipeline.sh query_proteins.faa /path/to/asgard_db output_dir
+#   ./asgard_cluster_pipeline.sh query_proteins.faa /path/to/asgard_db output_dir [threads]
+#   PIPELINE_STRICT=1 ./asgard_cluster_pipeline.sh query_proteins.faa /path/to/asgard_db output_dir 32
 # ================================
 
 # --- Input Arguments ---
 query_faa="${1:-/home/anirudh/genomes/selected_genomes/combined_proteins.faa}"
 asgard_db="${2:-/home/anirudh/genomes/asCOGs/asgard_db}"
 outdir="${3:-/home/anirudh/genomes/asCOGs/results}"
+threads="${4:-$(nproc)}"
+if [[ "${PIPELINE_STRICT:-0}" == 1 ]]; then
+  set -e
+fi
+# Helper scripts live next to this one
+scripts_dir="$(dirname "$(realpath "$0")")"
 
 echo "========================================"
 echo "[DEBUG] Starting Asgard Clustering Pipeline"
 echo "[DEBUG] Query FASTA: $query_faa"
 echo "[DEBUG] Asgard DB: $asgard_db"
 echo "[DEBUG] Output directory: $outdir"
+echo "[DEBUG] Threads: $threads"
 echo "========================================"
 
 # --- Directory Setup ---
@@ -45,52 +56,28 @@ echo "[DEBUG] Query DB created at: $outdir/searches/query_db"
 
 # --- Step 2: Assign query proteins to reference Asgard clusters ---
 echo "[1] Assigning query proteins to Asgard reference clusters..."
-echo "[DEBUG] Command: mmseqs search \"$outdir/searches/query_db\" \"$asgard_db\" \"$outdir/searches/ref_search\" \"$outdir/tmp\" -e 0.001 -s 9 --cov-mode 0 -c 0.8"
-mmseqs search "$outdir/searches/query_db" "$asgard_db" "$outdir/searches/ref_search" "$outdir/tmp" -e 0.001 -s 9 --cov-mode 0 -c 0.8
+echo "[DEBUG] Command: mmseqs search \"$outdir/searches/query_db\" \"$asgard_db\" \"$outdir/searches/ref_search\" \"$outdir/tmp\" -e 0.001 -s 9 --cov-mode 0 -c 0.8 --threads $threads"
+mmseqs search "$outdir/searches/query_db" "$asgard_db" "$outdir/searches/ref_search" "$outdir/tmp" -e 0.001 -s 9 --cov-mode 0 -c 0.8 --threads "$threads"
 
-# --- Step 3: Identify unassigned proteins using seqkit ---
+# --- Step 3-4: Split assigned / unassigned and filter unassigned proteins (≥60 aa) ---
+# One pass over the query FASTA: assigned IDs are read from the search result DB,
+# duplicate IDs are renamed (unassigned/header_renames.tsv) and all counts are
+# written to unassigned/partition_counts.tsv.
 echo "[2] Extracting unassigned proteins..."
-
-Extract assigned IDs (first column only - query IDs)
-mmseqs convertalis "$outdir/searches/query_db" "$asgard_db" "$outdir/searches/ref_search" "$outdir/assigned/assigned.tsv" --format-output query
-cut -f1 "$outdir/assigned/assigned.tsv" | sort -u > "$outdir/assigned/assigned_ids.txt"
-
-echo "[DEBUG] Assigned proteins: $(wc -l < "$outdir/assigned/assigned_ids.txt")"
-
-# Use seqkit to extract unassigned sequences directly from original FASTA
-echo "[DEBUG] Extracting unassigned sequences using seqkit..."
-seqkit grep -v -f "$outdir/assigned/assigned_ids.txt" \
-    "$query_faa" \
-    > "$outdir/unassigned/unassigned.faa"
-
-echo "[DEBUG] Unassigned proteins: $(grep -c '^>' "$outdir/unassigned/unassigned.faa")"
-
-# Verify headers are unique
-echo "[DEBUG] Verifying unique headers..."
-unique_headers=$(grep '^>' "$outdir/unassigned/unassigned.faa" | sort -u | wc -l)
-total_headers=$(grep -c '^>' "$outdir/unassigned/unassigned.faa")
-if [[ "$unique_headers" -ne "$total_headers" ]]; then
-    echo "[WARNING] Duplicate headers found! Creating unique headers..."
-    awk 'BEGIN{counter=1} /^>/ {print ">unassigned_seq_" counter++; next} {print}' \
-        "$outdir/unassigned/unassigned.faa" > "$outdir/unassigned/unassigned_fixed.faa"
-    mv "$outdir/unassigned/unassigned_fixed.faa" "$outdir/unassigned/unassigned.faa"
-    echo "[DEBUG] Fixed headers - now unique: $(grep -c '^>' "$outdir/unassigned/unassigned.faa")"
-fi
-
-# --- Step 4: Filter unassigned proteins (≥60 aa) ---
 echo "[3] Filtering unassigned proteins (≥60 aa)..."
-seqkit seq -m 60 --remove-gaps "$outdir/unassigned/unassigned.faa" > "$outdir/unassigned/unassigned_60aa.faa"
+python3 "$scripts_dir/fasta_partition.py" "$query_faa" "$outdir" \
+    --ref-search "$outdir/searches/ref_search" \
+    --query-db "$outdir/searches/query_db" \
+    --min-length 60 || exit 1
 
-echo "[DEBUG] Filtered unassigned sequences: $(grep -c '^>' "$outdir/unassigned/unassigned_60aa.faa")"
 echo "[DEBUG] Sample of filtered headers:"
-grep "^>" "$outdir/unassigned/unassigned_60aa.faa" | head -5
+grep -m 5 "^>" "$outdir/unassigned/unassigned_60aa.faa" || true
 
 # --- Step 5: Cluster unassigned proteins de novo ---
 echo "[4] Clustering unassigned proteins de novo..."
 if [[ ! -s "$outdir/unassigned/unassigned_60aa.faa" ]]; then
     echo "[WARNING] No unassigned proteins to cluster. Creating empty files."
     touch "$outdir/denovo/denovo_clu.tsv"
-    touch "$outdir/denovo/denovo_reps.faa"
 else
     mmseqs createdb "$outdir/unassigned/unassigned_60aa.faa" "$outdir/unassigned/unassigned_60aa_db"
     
@@ -101,23 +88,25 @@ else
         "$outdir/tmp" \
         --min-seq-id 0.2 \
         -c 0.5 \
-        --cov-mode 1
+        --cov-mode 1 \
+        --threads "$threads"
     
+    # membership TSV: still read by cluster_index.py, protein_atlas.py and the workflow;
+    # representatives and cluster selection are read from the databases (mmseqs_db.py)
     mmseqs createtsv "$outdir/unassigned/unassigned_60aa_db" \
         "$outdir/unassigned/unassigned_60aa_db" \
         "$outdir/denovo/denovo_clu" \
-        "$outdir/denovo/denovo_clu.tsv"
-
-    mmseqs result2repseq "$outdir/unassigned/unassigned_60aa_db" \
-        "$outdir/denovo/denovo_clu" \
-        "$outdir/denovo/denovo_reps"
+        "$outdir/denovo/denovo_clu.tsv" \
+        --threads "$threads"
 
-    mmseqs convert2fasta "$outdir/denovo/denovo_reps" \
-        "$outdir/denovo/denovo_reps.faa"
+    # Integer-coded membership index (cluster sizes, cluster of a protein, size cutoffs)
+    python3 "$scripts_dir/cluster_index.py" build \
+        "$outdir/denovo/denovo_clu.tsv" \
+        "$outdir/denovo/denovo_clu.cidx"
 
     echo "[DEBUG] De novo clustering complete."
-    num_denovo_clusters=$(grep -c '^>' "$outdir/denovo/denovo_reps.faa" 2>/dev/null || echo 0)
-    num_input_seqs=$(grep -c '^>' "$outdir/unassigned/unassigned_60aa.faa")
+    num_denovo_clusters=$(wc -l < "$outdir/denovo/denovo_clu.index" 2>/dev/null || echo 0)
+    num_input_seqs=$(awk -F'\t' '$1 == "filtered" {print $2}' "$outdir/unassigned/partition_counts.tsv")
     num_clustered_seqs=$(wc -l < "$outdir/denovo/denovo_clu.tsv" 2>/dev/null || echo 0)
     
     echo "[DEBUG] Input sequences: $num_input_seqs"
@@ -125,9 +114,9 @@ else
     echo "[DEBUG] Sequences assigned to clusters: $num_clustered_seqs"
     
     # Check cluster distribution
-    if [[ -f "$outdir/denovo/denovo_clu.tsv" ]]; then
+    if [[ -d "$outdir/denovo/denovo_clu.cidx" ]]; then
         echo "[DEBUG] Cluster size distribution:"
-        cut -f2 "$outdir/denovo/denovo_clu.tsv" | sort | uniq -c | sort -nr | head -5
+        python3 "$scripts_dir/cluster_index.py" info "$outdir/denovo/denovo_clu.cidx"
     fi
 fi
 
@@ -146,10 +135,12 @@ else
   echo "[WARNING] No Asgard representative FASTA files found"
 fi
 
-# Add de novo representatives if they exist
-if [[ -s "$outdir/denovo/denovo_reps.faa" ]]; then
-  cat "$outdir/denovo/denovo_reps.faa" >> "$outdir/assigned/all_cluster_representatives.faa"
-  echo "[DEBUG] Added de novo representatives: $(grep -c '^>' "$outdir/denovo/denovo_reps.faa")"
+# Add de novo representatives if they exist, straight from the cluster DB
+# (no result2repseq / convert2fasta round trip)
+if [[ -s "$outdir/denovo/denovo_clu.index" ]]; then
+  echo "[DEBUG] Added de novo representatives: $(python3 "$scripts_dir/mmseqs_db.py" reps \
+      "$outdir/unassigned/unassigned_60aa_db" "$outdir/denovo/denovo_clu" \
+      "$outdir/assigned/all_cluster_representatives.faa" --append)"
 fi
 
 echo "[DEBUG] Total representatives: $(grep -c '^>' "$outdir/assigned/all_cluster_representatives.faa" 2>/dev/null || echo 0)"
@@ -161,4 +152,4 @@ echo "✅ Done! All results saved in: $outdir"
 
 # The Python script runs automatically, no need to call it here
 echo "[INFO] Pipeline completed. Genearting Summary."
-python3 "/home/anirudh/genomes/scripts/mmseqs_clustering_summary.py" $outdir
\ No newline at end of file
+python3 "$scripts_dir/mmseqs_clustering_summary.py" $outdir
\ No newline at end of file
@@ -0,0 +1,319 @@
+# Full-text search index over the compiled proteomes (SQLite FTS5)
+#
+# search_cds.ipynb used to scan every header and organism name of the 1 GB
+# Proteins_genomes_cpNN.csv with str.contains for each query. This index is built
+# once (by compile_cds_info.py --search-index, or `build` below) and answers the same
+# questions in milliseconds: Prokka product names, CDS IDs and organism names are
+# tokenised into an FTS5 table with prefix indexes, "hypothetical protein" rows are
+# flagged at build time, and protein counts per organism and per product are stored
+# for the pie charts.
+#
+# Query syntax: words match as prefixes and must all occur ("cell div" finds
+# "cell division protein"), "double quotes" match a phrase, and an exact CDS ID
+# always matches itself.
+#
+# Usage:
+#   python cds_search.py build Proteins_genomes_cp50.csv Proteins_genomes_cp50.search.sqlite
+#   python cds_search.py query Proteins_genomes_cp50.search.sqlite ftsz [--organism umbra] [--limit 20]
+
+import os
+import re
+import sys
+import time
+import sqlite3
+import argparse
+
+import pandas as pd
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS proteins (
+    rowid INTEGER PRIMARY KEY,
+    cds_id TEXT NOT NULL,
+    genome_file TEXT,
+    organism_name TEXT,
+    product TEXT,
+    length INTEGER,
+    hypothetical INTEGER NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS proteins_fts USING fts5(
+    product, cds_id, organism_name,
+    content='proteins', content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+);
+CREATE TABLE IF NOT EXISTS organism_facets (organism_name TEXT, proteins INTEGER, annotated INTEGER);
+CREATE TABLE IF NOT EXISTS product_facets (product TEXT, proteins INTEGER);
+"""
+
+# lookup indexes; the genome and facet ones let an update touch only the changed rows
+UPDATE_INDEXES = """
+CREATE INDEX IF NOT EXISTS proteins_cds_id ON proteins (cds_id);
+CREATE INDEX IF NOT EXISTS proteins_organism ON proteins (organism_name);
+CREATE INDEX IF NOT EXISTS proteins_genome ON proteins (genome_file);
+CREATE INDEX IF NOT EXISTS organism_facets_name ON organism_facets (organism_name);
+CREATE INDEX IF NOT EXISTS product_facets_product ON product_facets (product);
+"""
+
+RESULT_COLUMNS = ['organism_name', 'cds_id', 'product', 'genome_file', 'length']
+
+
+def is_hypothetical(products):
+    return products.str.contains('hypothetical protein', case=False, na=False)
+
+
+class SearchIndexWriter:
+    """
+    Streams proteome tables (compile_cds_info.py columns) into a fresh index, or with
+    ``drop_genomes`` into an existing one: the rows of those genomes are removed first,
+    and the full-text index and the facets are updated for the changed rows only.
+
+    Parameters:
+        path (str): Index file; without ``drop_genomes`` an existing one is replaced.
+        drop_genomes (collection, optional): genome_file values to remove before adding.
+    """
+
+    def __init__(self, path, drop_genomes=None):
+        self.update = drop_genomes is not None
+        if os.path.exists(path) and not self.update:
+            os.remove(path)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        if not self.update:
+            self.conn.execute("PRAGMA journal_mode=OFF")
+            self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.executescript(SCHEMA)
+        self.rows = 0
+        # new rows are numbered explicitly: after deletions SQLite could reuse lower rowids
+        self.first_rowid = self.conn.execute("SELECT COALESCE(MAX(rowid), 0) + 1 FROM proteins").fetchone()[0]
+        if self.update:
+            self.conn.executescript(UPDATE_INDEXES)
+            # an update is one transaction: an interrupted run leaves the index as it was
+            self.conn.execute("BEGIN")
+            self._remove(list(drop_genomes))
+
+    def _remove(self, genomes):
+        for i in range(0, len(genomes), 500):
+            batch = genomes[i:i + 500]
+            where = f"genome_file IN ({', '.join('?' * len(batch))})"
+            self._facet_delta(where, batch, -1)
+            self.conn.execute(
+                "INSERT INTO proteins_fts(proteins_fts, rowid, product, cds_id, organism_name) "
+                f"SELECT 'delete', rowid, product, cds_id, organism_name FROM proteins WHERE {where}", batch)
+            self.conn.execute(f"DELETE FROM proteins WHERE {where}", batch)
+
+    def _facet_delta(self, where, params, sign):
+        """Add (sign=1) or subtract (sign=-1) the facet counts of the rows matching ``where``."""
+        organisms = self.conn.execute(
+            f"SELECT organism_name, COUNT(*), SUM(hypothetical = 0) FROM proteins WHERE {where} "
+            "GROUP BY organism_name", params).fetchall()
+        for organism, proteins, annotated in organisms:
+            updated = self.conn.execute(
+                "UPDATE organism_facets SET proteins = proteins + ?, annotated = annotated + ? "
+                "WHERE organism_name IS ?", (sign * proteins, sign * annotated, organism)).rowcount
+            if not updated:
+                self.conn.execute("INSERT INTO organism_facets VALUES (?, ?, ?)", (organism, proteins, annotated))
+        products = self.conn.execute(
+            f"SELECT product, COUNT(*) FROM proteins WHERE {where} GROUP BY product", params).fetchall()
+        for product, proteins in products:
+            updated = self.conn.execute("UPDATE product_facets SET proteins = proteins + ? WHERE product IS ?",
+                                        (sign * proteins, product)).rowcount
+            if not updated:
+                self.conn.execute("INSERT INTO product_facets VALUES (?, ?)", (product, proteins))
+        self.conn.execute("DELETE FROM organism_facets WHERE proteins <= 0")
+        self.conn.execute("DELETE FROM product_facets WHERE proteins <= 0")
+
+    def add(self, table):
+        products = (table['product'] if 'product' in table
+                    else table['header'].str.split(n=1).str[1].fillna("").str.strip())
+        lengths = table['length'] if 'length' in table else table['sequence'].str.len()
+        start = self.first_rowid + self.rows
+        rows = pd.DataFrame({
+            'rowid': range(start, start + len(table)),
+            'cds_id': table['cds_id'].astype(str).values,
+            'genome_file': table['genome_file'].values,
+            'organism_name': table['organism_name'].values,
+            'product': products.values,
+            'length': lengths.values,
+            'hypothetical': is_hypothetical(products).astype(int).values,
+        })
+        rows = rows.astype(object).where(rows.notna(), None)
+        self.conn.executemany(
+            "INSERT INTO proteins (rowid, cds_id, genome_file, organism_name, product, length, hypothetical) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", rows.itertuples(index=False, name=None))
+        self.rows += len(rows)
+
+    def close(self):
+        """Build (or, for an update, extend) the full-text index, the lookup indexes and the facet tables."""
+        if self.update:
+            new = "rowid >= ?"
+            self.conn.execute(
+                "INSERT INTO proteins_fts(rowid, product, cds_id, organism_name) "
+                f"SELECT rowid, product, cds_id, organism_name FROM proteins WHERE {new}", (self.first_rowid,))
+            self._facet_delta(new, (self.first_rowid,), 1)
+            # bounded merge of the new FTS segments instead of a full 'optimize'
+            self.conn.execute("INSERT INTO proteins_fts(proteins_fts, rank) VALUES ('merge', 16)")
+            self.conn.commit()
+            self.conn.close()
+            return self.rows
+        self.conn.execute("INSERT INTO proteins_fts(proteins_fts) VALUES ('rebuild')")
+        self.conn.executescript(UPDATE_INDEXES)
+        self.conn.execute(
+            "INSERT INTO organism_facets SELECT organism_name, COUNT(*), SUM(hypothetical = 0) "
+            "FROM proteins GROUP BY organism_name")
+        self.conn.execute(
+            "INSERT INTO product_facets SELECT product, COUNT(*) FROM proteins GROUP BY product")
+        self.conn.execute("INSERT INTO proteins_fts(proteins_fts) VALUES ('optimize')")
+        self.conn.commit()
+        self.conn.execute("VACUUM")
+        self.conn.close()
+        return self.rows
+
+
+def build_index(tables, path):
+    """Build an index from an iterable of proteome DataFrames; returns the number of proteins."""
+    writer = SearchIndexWriter(path)
+    for table in tables:
+        writer.add(table)
+    return writer.close()
+
+
+# =====================
+# Queries
+# =====================
+
+def fts_terms(text):
+    """
+    Turn free text into an FTS5 expression: "quoted phrases" stay phrases, other
+    words become prefix terms, all combined with AND.
+    """
+    terms = []
+    for phrase, words in re.findall(r'"([^"]*)"|(\S+)', text):
+        if phrase:
+            tokens = re.findall(r"\w+", phrase)
+            if tokens:
+                terms.append('"' + " ".join(tokens) + '"')
+        else:
+            terms.extend(f'"{token}"*' for token in re.findall(r"\w+", words))
+    return " AND ".join(terms)
+
+
+class CDSIndex:
+    """
+    Read-only handle on a search index.
+
+    Parameters:
+        path (str): Index built by SearchIndexWriter.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+    def _where(self, term=None, organism=None, include_hypothetical=False):
+        clauses, params = [], []
+        match = []
+        if term and fts_terms(term):
+            match.append("{product cds_id}: (" + fts_terms(term) + ")")
+        if organism and fts_terms(organism):
+            match.append("organism_name: (" + fts_terms(organism) + ")")
+        if match:
+            clauses.append("rowid IN (SELECT rowid FROM proteins_fts WHERE proteins_fts MATCH ?)")
+            params.append(" AND ".join(match))
+        if term and not organism:
+            # an exact CDS ID always finds itself
+            clauses = ["(" + " OR ".join(clauses + ["cds_id = ?"]) + ")"] if clauses else ["cds_id = ?"]
+            params.append(term.strip())
+        if not include_hypothetical:
+            clauses.append("hypothetical = 0")
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def search(self, term=None, organism=None, include_hypothetical=False, limit=None):
+        """
+        Proteins whose product or CDS ID matches ``term`` and whose organism matches
+        ``organism``; hypothetical proteins are left out unless asked for.
+
+        Returns:
+            pd.DataFrame: RESULT_COLUMNS of the matches.
+        """
+        where, params = self._where(term, organism, include_hypothetical)
+        query = f"SELECT {', '.join(RESULT_COLUMNS)} FROM proteins{where} ORDER BY rowid"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        return pd.read_sql_query(query, self.conn, params=params)
+
+    def count(self, term=None, organism=None, include_hypothetical=False):
+        where, params = self._where(term, organism, include_hypothetical)
+        return self.conn.execute(f"SELECT COUNT(*) FROM proteins{where}", params).fetchone()[0]
+
+    def facets(self, column, term=None, organism=None, include_hypothetical=False, top=10):
+        """
+        Protein counts per ``column`` ('organism_name' or 'product') for a query, largest
+        first. Without a query the counts come from the precomputed facet tables.
+
+        Returns:
+            pd.Series: count by value.
+        """
+        if column not in ("organism_name", "product"):
+            raise ValueError(f"No facet for column {column}")
+        if not term and not organism:
+            if column == "organism_name":
+                count = "proteins" if include_hypothetical else "annotated"
+                query = f"SELECT organism_name, {count} FROM organism_facets ORDER BY {count} DESC LIMIT ?"
+            else:
+                having = "" if include_hypothetical else " WHERE product NOT LIKE '%hypothetical protein%'"
+                query = f"SELECT product, proteins FROM product_facets{having} ORDER BY proteins DESC LIMIT ?"
+            rows = self.conn.execute(query, (top,)).fetchall()
+        else:
+            where, params = self._where(term, organism, include_hypothetical)
+            rows = self.conn.execute(
+                f"SELECT {column}, COUNT(*) AS n FROM proteins{where} GROUP BY {column} ORDER BY n DESC LIMIT ?",
+                params + [top]).fetchall()
+        return pd.Series({value: n for value, n in rows}, dtype="int64")
+
+    def stats(self):
+        proteins = self.conn.execute("SELECT COUNT(*) FROM proteins").fetchone()[0]
+        organisms = self.conn.execute("SELECT COUNT(*) FROM organism_facets WHERE organism_name IS NOT NULL").fetchone()[0]
+        return proteins, organisms
+
+    def close(self):
+        self.conn.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Build or query the CDS search index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build")
+    build.add_argument("source", help="Proteins_genomes_cpNN.csv or its Parquet store")
+    build.add_argument("index")
+    query = sub.add_parser("query")
+    query.add_argument("index")
+    query.add_argument("term", nargs="?", default=None)
+    query.add_argument("--organism", default=None)
+    query.add_argument("--hypothetical", action="store_true", help="Keep hypothetical proteins")
+    query.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args(argv[1:])
+
+    if args.command == "build":
+        if args.source.endswith(".csv"):
+            tables = pd.read_csv(args.source, index_col=0, chunksize=200000)
+        else:
+            from proteome_store import load_proteome, genomes
+            tables = (load_proteome(args.source, genomes=[g]) for g in genomes(args.source))
+        start = time.time()
+        print(f"Indexed {build_index(tables, args.index)} proteins into {args.index} in {time.time() - start:.0f} s")
+        return
+
+    index = CDSIndex(args.index)
+    start = time.time()
+    total = index.count(args.term, args.organism, args.hypothetical)
+    results = index.search(args.term, args.organism, args.hypothetical, args.limit)
+    elapsed = (time.time() - start) * 1000
+    print(f"Found {total} results in {elapsed:.1f} ms (showing {len(results)})")
+    print(results.to_string(index=False))
+    print("\nTop organisms:")
+    print(index.facets("organism_name", args.term, args.organism, args.hypothetical).to_string())
+    index.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,286 @@
+# Cluster membership index over denovo_clu.tsv
+#
+# mmseqs createtsv writes one "representative<TAB>member" line per protein, so cluster
+# sizes, the cluster of a protein or the members of a cluster all need a full scan of
+# the TSV (awk | sort | uniq -c). This index codes every protein as an integer once and
+# keeps the clusters as flat arrays that are memory-mapped at query time:
+#
+#   names.bin / names_offsets.npy   protein names (protein i = i-th member line of the TSV)
+#   name_hashes.npy                 sorted 64-bit name hashes, and name_order.npy the protein of each
+#   protein_cluster.npy             cluster of every protein
+#   cluster_rep.npy                 representative protein of every cluster
+#   cluster_ptr.npy                 CSR index: members of cluster c are
+#   cluster_members.npy               cluster_members[cluster_ptr[c]:cluster_ptr[c + 1]]
+#
+# Name -> protein is a binary search in the hashes, protein -> cluster and cluster ->
+# size are array lookups, and size histograms and size cutoffs are computed on the
+# cluster_ptr differences without touching the names.
+#
+# Usage:
+#   python cluster_index.py build denovo_clu.tsv denovo_clu.cidx
+#   python cluster_index.py info denovo_clu.cidx
+#   python cluster_index.py cluster-of denovo_clu.cidx <protein> [<protein> ...]
+#   python cluster_index.py members denovo_clu.cidx <protein>
+#   python cluster_index.py histogram denovo_clu.cidx
+#   python cluster_index.py select denovo_clu.cidx [--min-size 5] [--max-size N] [--out-dir selected]
+
+import os
+import sys
+import json
+import mmap
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+
+INDEX_INFO = "index.json"
+CHUNK_ROWS = 2_000_000
+
+
+def name_hashes(names):
+    """64-bit hashes of protein names (pandas' fixed-key SipHash, stable across runs)."""
+    return pd.util.hash_array(np.asarray(names, dtype=object))
+
+
+# =====================
+# Building
+# =====================
+
+def build_index(cluster_tsv, path, chunk_rows=CHUNK_ROWS, log=print):
+    """
+    Write the index of a representative / member TSV to ``path``.
+
+    Returns:
+        (int, int): number of proteins, number of clusters.
+    """
+    os.makedirs(path, exist_ok=True)
+    rep_hashes, member_hashes, offsets, total = [], [], [np.zeros(1, dtype=np.int64)], 0
+    with open(os.path.join(path, "names.bin"), "wb") as names:
+        if os.path.getsize(cluster_tsv):
+            for chunk in pd.read_csv(cluster_tsv, sep="\t", header=None, usecols=[0, 1], dtype=str,
+                                     chunksize=chunk_rows, quoting=3, na_filter=False):
+                members = chunk[1].to_numpy(dtype=object)
+                rep_hashes.append(name_hashes(chunk[0].to_numpy(dtype=object)))
+                member_hashes.append(name_hashes(members))
+                data = ("\n".join(members) + "\n").encode()
+                lengths = np.fromiter((len(m.encode()) + 1 for m in members), dtype=np.int64, count=len(members))
+                offsets.append(total + np.cumsum(lengths))
+                total = int(offsets[-1][-1]) if len(lengths) else total
+                names.write(data)
+    offsets = np.concatenate(offsets).astype(np.int64)
+    rep_hashes = np.concatenate(rep_hashes) if rep_hashes else np.zeros(0, dtype=np.uint64)
+    member_hashes = np.concatenate(member_hashes) if member_hashes else np.zeros(0, dtype=np.uint64)
+    n = len(member_hashes)
+
+    order = np.argsort(member_hashes, kind="stable")
+    hashes = member_hashes[order]
+    if n and (hashes[1:] == hashes[:-1]).any():
+        raise ValueError(f"{cluster_tsv}: a protein is listed as a member more than once")
+    pos = np.searchsorted(hashes, rep_hashes)
+    if n and ((pos >= n) | (hashes[np.minimum(pos, n - 1)] != rep_hashes)).any():
+        raise ValueError(f"{cluster_tsv}: a representative is not listed as a member of its cluster")
+    rep_protein = order[pos] if n else np.zeros(0, dtype=np.int64)
+
+    # clusters numbered by their representative's protein number
+    reps, protein_cluster = np.unique(rep_protein, return_inverse=True)
+    members = np.argsort(protein_cluster, kind="stable")
+    ptr = np.zeros(len(reps) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(protein_cluster, minlength=len(reps)), out=ptr[1:])
+
+    np.save(os.path.join(path, "names_offsets.npy"), offsets)
+    np.save(os.path.join(path, "name_hashes.npy"), hashes)
+    np.save(os.path.join(path, "name_order.npy"), order.astype(np.int32))
+    np.save(os.path.join(path, "protein_cluster.npy"), protein_cluster.astype(np.int32))
+    np.save(os.path.join(path, "cluster_rep.npy"), reps.astype(np.int32))
+    np.save(os.path.join(path, "cluster_ptr.npy"), ptr)
+    np.save(os.path.join(path, "cluster_members.npy"), members.astype(np.int32))
+    with open(os.path.join(path, INDEX_INFO), "w") as f:
+        json.dump({"proteins": n, "clusters": len(reps), "source": os.path.abspath(cluster_tsv)}, f, indent=1)
+    log(f"Indexed {n} proteins in {len(reps)} clusters")
+    return n, len(reps)
+
+
+# =====================
+# Querying
+# =====================
+
+class ClusterIndex:
+    """
+    Memory-mapped handle on an index written by build_index().
+
+    Parameters:
+        path (str): Index folder.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_INFO)) as f:
+            info = json.load(f)
+        self.n = info["proteins"]
+        self.n_clusters = info["clusters"]
+
+        def load(name):
+            return np.load(os.path.join(path, name), mmap_mode="r")
+
+        self.name_offsets = load("names_offsets.npy")
+        self.hashes = load("name_hashes.npy")
+        self.order = load("name_order.npy")
+        self.protein_cluster = load("protein_cluster.npy")
+        self.cluster_rep = load("cluster_rep.npy")
+        self.cluster_ptr = load("cluster_ptr.npy")
+        self.cluster_members = load("cluster_members.npy")
+        self._file = open(os.path.join(path, "names.bin"), "rb")
+        self.names = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) \
+            if os.path.getsize(self._file.name) else b""
+
+    def name(self, i):
+        return self.names[int(self.name_offsets[i]):int(self.name_offsets[i + 1]) - 1].decode()
+
+    def protein(self, name):
+        """Protein number of ``name``; KeyError if it is in no cluster."""
+        h = name_hashes([name])[0]
+        lo = int(np.searchsorted(self.hashes, h, side="left"))
+        hi = int(np.searchsorted(self.hashes, h, side="right"))
+        for i in self.order[lo:hi]:
+            if self.name(int(i)) == name:
+                return int(i)
+        raise KeyError(name)
+
+    def __contains__(self, name):
+        try:
+            self.protein(name)
+        except KeyError:
+            return False
+        return True
+
+    def cluster(self, name):
+        """Cluster number of a protein."""
+        return int(self.protein_cluster[self.protein(name)])
+
+    def cluster_of(self, name):
+        """Representative of the cluster a protein is in."""
+        return self.name(int(self.cluster_rep[self.cluster(name)]))
+
+    def members(self, name):
+        """Members of the cluster a protein is in, in TSV order."""
+        c = self.cluster(name)
+        ids = self.cluster_members[self.cluster_ptr[c]:self.cluster_ptr[c + 1]]
+        return [self.name(int(i)) for i in ids]
+
+    def size(self, name):
+        c = self.cluster(name)
+        return int(self.cluster_ptr[c + 1] - self.cluster_ptr[c])
+
+    def sizes(self):
+        """Size of every cluster (cluster number order)."""
+        return np.diff(self.cluster_ptr)
+
+    def histogram(self):
+        """
+        Cluster size distribution.
+
+        Returns:
+            pd.Series: cluster size -> number of clusters, for the sizes that occur.
+        """
+        counts = np.bincount(self.sizes())
+        sizes = np.flatnonzero(counts)
+        return pd.Series(counts[sizes], index=pd.Index(sizes, name="size"), name="clusters")
+
+    def select(self, min_size=1, max_size=None):
+        """Cluster numbers with ``min_size`` <= size (<= ``max_size``)."""
+        sizes = self.sizes()
+        keep = sizes >= min_size
+        if max_size is not None:
+            keep &= sizes <= max_size
+        return np.flatnonzero(keep)
+
+    def representatives(self, clusters=None):
+        """Representative names of ``clusters`` (all by default)."""
+        reps = self.cluster_rep if clusters is None else self.cluster_rep[clusters]
+        return [self.name(int(i)) for i in reps]
+
+    def write_sizes(self, path):
+        """cluster_sizes.txt: "<size> <representative>" per cluster, sorted by representative."""
+        sizes = self.sizes()
+        reps = np.array(self.representatives(), dtype=object)
+        order = np.argsort(reps, kind="stable")
+        with open(path, "w") as f:
+            for c in order:
+                f.write(f"{sizes[c]} {reps[c]}\n")
+        return reps, order
+
+    def close(self):
+        if isinstance(self.names, mmap.mmap):
+            self.names.close()
+        self._file.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Build or query the cluster membership index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build")
+    build.add_argument("cluster_tsv", help="representative<TAB>member TSV (mmseqs createtsv)")
+    build.add_argument("index")
+    for name in ("info", "histogram"):
+        sub.add_parser(name).add_argument("index")
+    cluster_of = sub.add_parser("cluster-of")
+    cluster_of.add_argument("index")
+    cluster_of.add_argument("proteins", nargs="+")
+    members = sub.add_parser("members")
+    members.add_argument("index")
+    members.add_argument("protein")
+    select = sub.add_parser("select")
+    select.add_argument("index")
+    select.add_argument("--min-size", type=int, default=5)
+    select.add_argument("--max-size", type=int, default=None)
+    select.add_argument("--out-dir", default=None,
+                        help="Write cluster_sizes.txt and large_clusters.txt here instead of printing")
+    args = parser.parse_args(argv[1:])
+
+    start = time.time()
+    if args.command == "build":
+        build_index(args.cluster_tsv, args.index)
+        print(f"Built {args.index} in {time.time() - start:.1f} s")
+        return
+
+    index = ClusterIndex(args.index)
+    if args.command == "info":
+        sizes = index.sizes()
+        print(f"{args.index}: {index.n} proteins in {index.n_clusters} clusters")
+        if len(sizes):
+            print(f"  singletons: {int((sizes == 1).sum())}, median size: {np.median(sizes):g}, "
+                  f"largest: {int(sizes.max())}")
+            for c in np.argsort(-sizes, kind="stable")[:5]:
+                print(f"  {sizes[c]:>8} {index.name(int(index.cluster_rep[c]))}")
+    elif args.command == "histogram":
+        print(index.histogram().to_string())
+    elif args.command == "cluster-of":
+        for name in args.proteins:
+            try:
+                print(f"{name}\t{index.cluster_of(name)}\t{index.size(name)}")
+            except KeyError:
+                print(f"{name}\tnot found")
+    elif args.command == "members":
+        print("\n".join(index.members(args.protein)))
+    elif args.command == "select":
+        clusters = index.select(args.min_size, args.max_size)
+        proteins = int(index.sizes()[clusters].sum())
+        if args.out_dir is None:
+            print("\n".join(index.representatives(clusters)))
+        else:
+            os.makedirs(args.out_dir, exist_ok=True)
+            reps, order = index.write_sizes(os.path.join(args.out_dir, "cluster_sizes.txt"))
+            selected = np.zeros(index.n_clusters, dtype=bool)
+            selected[clusters] = True
+            with open(os.path.join(args.out_dir, "large_clusters.txt"), "w") as f:
+                for c in order[selected[order]]:
+                    f.write(f"{reps[c]}\n")
+        print(f"{len(clusters)} of {index.n_clusters} clusters selected ({proteins} proteins) "
+              f"in {time.time() - start:.2f} s", file=sys.stderr)
+    index.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
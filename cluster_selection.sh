@@ -4,6 +4,8 @@
 in_dir="${1:-/home/anirudh/genomes/asCOGs/results}"
 # Set output directory for selected clusters
 out_dir="$in_dir/selected"
+# Clusters with at least this many members are kept
+min_size="${2:-5}"
 
 echo "Input directory: $in_dir"
 echo "Output directory: $out_dir"
@@ -13,31 +15,47 @@ mkdir -p $out_dir
 
 # Path to de novo clustering results
 cluster_tsv="$in_dir/denovo/denovo_clu.tsv"
+# The same clusters as MMseqs2 databases (read directly, no createtsv/convert2fasta needed)
+seq_db="$in_dir/unassigned/unassigned_60aa_db"
+cluster_db="$in_dir/denovo/denovo_clu"
+scripts_dir="$(dirname "$(realpath "$0")")"
 
-# Check if input files exist before proceeding
-if [[ ! -f "$cluster_tsv" ]]; then
-    echo "Error: Cluster file not found: $cluster_tsv"
-    exit 1
-fi
+if [[ -f "$cluster_db.index" && -f "$seq_db.index" ]]; then
+    echo "Reading cluster sizes and representatives from the MMseqs2 databases..."
+    python3 "$scripts_dir/mmseqs_db.py" select-clusters "$seq_db" "$cluster_db" "$out_dir" --min-size "$min_size" || exit 1
+    if [[ ! -s "$out_dir/large_clusters.txt" ]]; then
+        echo "Warning: No large clusters found with ≥$min_size members"
+    fi
+else
 
-# Output format: <count> <cluster_id>
-echo "Counting cluster sizes..."
-awk '{print $1}' "$cluster_tsv" | sort | uniq -c | awk '{print $1, $2}' > "$out_dir/cluster_sizes.txt"
+    # Check if input files exist before proceeding
+    if [[ ! -f "$cluster_tsv" ]]; then
+        echo "Error: Cluster file not found: $cluster_tsv"
+        exit 1
+    fi
 
-# Filter clusters with 5 or more members and extract cluster IDs
-echo "Filtering large clusters (≥5 members)..."
-awk '$1 >= 5 {print $2}' "$out_dir/cluster_sizes.txt" > "$out_dir/large_clusters.txt"
+    # Cluster membership index, built once per clustering (asgard_cluster_pipeline.sh builds it too)
+    cluster_idx="$in_dir/denovo/denovo_clu.cidx"
+    if [[ ! -f "$cluster_idx/index.json" || "$cluster_tsv" -nt "$cluster_idx/index.json" ]]; then
+        echo "Indexing clusters..."
+        python3 "$scripts_dir/cluster_index.py" build "$cluster_tsv" "$cluster_idx" || exit 1
+    fi
 
-# Check if we have large clusters before proceeding
-if [[ ! -s "$out_dir/large_clusters.txt" ]]; then
-    echo "Warning: No large clusters found with ≥5 members"
-    touch "$out_dir/denovo_reps_large.faa"  # Create empty file
-else
-    # Extract representative sequences for large clusters only
-    # Using seqkit to grep sequences based on cluster IDs from large_clusters.txt
-    echo "Extracting representatives for large clusters..."
-    seqkit grep -f <(awk '{print $1}' "$out_dir/large_clusters.txt") \
-        "$in_dir/denovo/denovo_reps.faa" > "$out_dir/denovo_reps_large.faa"
+    # Output format: <count> <cluster_id>; large_clusters.txt holds clusters with min_size or more members
+    echo "Counting cluster sizes and filtering large clusters (≥$min_size members)..."
+    python3 "$scripts_dir/cluster_index.py" select "$cluster_idx" --min-size "$min_size" --out-dir "$out_dir" || exit 1
+
+    # Check if we have large clusters before proceeding
+    if [[ ! -s "$out_dir/large_clusters.txt" ]]; then
+        echo "Warning: No large clusters found with ≥$min_size members"
+        touch "$out_dir/denovo_reps_large.faa"  # Create empty file
+    else
+        # Extract representative sequences for large clusters only
+        # Using seqkit to grep sequences based on cluster IDs from large_clusters.txt
+        echo "Extracting representatives for large clusters..."
+        seqkit grep -f <(awk '{print $1}' "$out_dir/large_clusters.txt") \
+            "$in_dir/denovo/denovo_reps.faa" > "$out_dir/denovo_reps_large.faa"
+    fi
 fi
 
 # Combine reference cluster representatives with large de novo cluster representatives
@@ -71,6 +89,6 @@ if [[ -s "$out_dir/cluster_sizes.txt" ]]; then
     large_clusters=$(wc -l < "$out_dir/large_clusters.txt")
     echo "Cluster statistics:"
     echo "  Total clusters: $total_clusters"
-    echo "  Large clusters (≥5 members): $large_clusters"
+    echo "  Large clusters (≥$min_size members): $large_clusters"
     echo "  Percentage large: $(echo "scale=2; $large_clusters * 100 / $total_clusters" | bc)%"
 fi
\ No newline at end of file
@@ -1,8 +1,19 @@
 # Check the actual cluster size distribution
 in_dir="/home/anirudh/genomes/asCOGs/results"
 out_dir="$in_dir/selected"
+cluster_idx="$in_dir/denovo/denovo_clu.cidx"
+scripts_dir="$(dirname "$(realpath "$0")")"
 
 echo "=== CLUSTER SIZE ANALYSIS ==="
+if [[ -f "$cluster_idx/index.json" ]]; then
+    # From the cluster membership index (cluster_index.py), no re-scan of the TSV
+    python3 "$scripts_dir/cluster_index.py" info "$cluster_idx"
+    echo ""
+    echo "Cluster size distribution (size, clusters):"
+    python3 "$scripts_dir/cluster_index.py" histogram "$cluster_idx" | head -21
+    exit 0
+fi
+
 echo "Total clusters: $(wc -l < $out_dir/cluster_sizes.txt)"
 echo ""
 
@@ -13,4 +24,4 @@ echo ""
 
 # Check the largest clusters
 echo "Largest clusters:"
-sort -nr "$out_dir/cluster_sizes.txt" | head -10
\ No newline at end of file
+sort -nr "$out_dir/cluster_sizes.txt" | head -10
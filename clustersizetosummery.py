@@ -7,9 +7,18 @@ clustersdir = os.path.join(inputdir, "selected")
 
 
 
-countdb = pd.read_csv(os.path.join(clustersdir, "cluster_sizes.txt"), sep=" ", header=None, names=[ "size", "cluster"])
+cluster_idx = os.path.join(inputdir, "denovo", "denovo_clu.cidx")
 summary_file = os.path.join(inputdir, "asgard_clustering_summary.tsv")
 
+if os.path.exists(os.path.join(cluster_idx, "index.json")):
+    # sizes straight from the cluster membership index (cluster_index.py)
+    from cluster_index import ClusterIndex
+    index = ClusterIndex(cluster_idx)
+    countdb = pd.DataFrame({"size": index.sizes(), "cluster": index.representatives()})
+    index.close()
+else:
+    countdb = pd.read_csv(os.path.join(clustersdir, "cluster_sizes.txt"), sep=" ", header=None, names=[ "size", "cluster"])
+
 countdb['size'] = pd.to_numeric(countdb['size'], errors='coerce')
 
 print(countdb.head())
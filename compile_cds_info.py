@@ -1,11 +1,13 @@
 import pandas as pd
 import os
-from collections import defaultdict as ddict
-import sys
+from collections import defaultdict as ddict, deque
+from concurrent.futures import ProcessPoolExecutor
+import argparse
 import shutil
 
-# Takes input of the folder containing faa files having cds of all genomes filtered to a specific completion level 
+# Takes input of the folder containing faa files having cds of all genomes filtered to a specific completion level
 
+COLUMNS = ['organism_name', 'breed', 'strain', 'cds_id', 'header', 'genome_file', 'sequence']
 
 
 def get_proteins(filepath):
@@ -21,98 +23,366 @@ def get_proteins(filepath):
 
     proteins = ddict(list)
     with open(filepath, "r") as f:
-        header, cds_id, seq = None, None, ""
+        header, cds_id, seq = None, None, []
         for line in f:
             line = line.strip()
             if line.startswith(">"):
                 if header is not None:
                     proteins['header'].append(header)
                     proteins['cds_ids'].append(cds_id)
-                    proteins['sequence'].append(seq)  
+                    proteins['sequence'].append("".join(seq))
 
                 header = line[1:]
                 cds_id = line[1:].split()[0]
-                seq = ""
+                seq = []
             else:
-                seq += line
+                seq.append(line)
 
         if header is not None:
             proteins['header'].append(header)
             proteins['cds_ids'].append(cds_id)
-            proteins['sequence'].append(seq) 
-    
+            proteins['sequence'].append("".join(seq))
+
     return proteins
 
 
+def load_metadata(metadata_csv):
+    """
+    Read the NCBI dataset table once into a lookup dict.
 
-def build_protein_table(faabasepath, metadata_csv):
-    # Read metadata table
+    Returns:
+        dict: 'Assembly Accession_Assembly Name' -> (organism name, strain, breed);
+        the first row wins for duplicated assemblies.
+    """
     meta = pd.read_csv(metadata_csv, sep="\t")
     meta['full_name'] = meta['Assembly Accession'] + '_' + meta['Assembly Name']
+    meta = meta.drop_duplicates('full_name')
+    return {
+        row[0]: (row[1], row[2], row[3])
+        for row in meta[['full_name', 'Organism Name', 'Organism Infraspecific Names Strain',
+                         'Organism Infraspecific Names Breed']].itertuples(index=False)
+    }
 
-    faa_files = os.listdir(faabasepath)
-
-    records = []
-    for faa in faa_files:
-        print(f"Processing {faa} ...")
-        proteins = get_proteins(os.path.join(faabasepath, faa))
-        filename = os.path.basename(faa).split('_genomic')[0]
-
-        # find organism name for this file
-        organism_info = meta.loc[meta['full_name'] == filename]
-        if organism_info.empty:
-            org_name = None
-            org_strain = None
-            org_breed = None
-            print(f"Couldnt find organism info for {filename}")
-        else:
-            org_name = organism_info.iloc[0]['Organism Name']
-            org_strain = organism_info.iloc[0]['Organism Infraspecific Names Strain']
-            org_breed = organism_info.iloc[0]['Organism Infraspecific Names Breed']
-
-        for cds, header, seq in zip(proteins['cds_ids'], proteins['header'], proteins['sequence']):
-            records.append({
-                'organism_name': org_name,
-                'breed': org_breed,
-                'strain': org_strain,
-                'cds_id': cds,
-                'header': header,
-                'genome_file': filename,              
-                'sequence': seq,
-            })
-        
-        print(f"found {len(records)} proteins")
-
-    df = pd.DataFrame(records)
-    return df
 
+def genome_table(faa_path, organism_info):
+    """
+    Protein rows of one genome.
 
-def main():
-        
-    # define the input dirs
-    completeness = sys.argv[1]  if len(sys.argv)>1 else 50
-    genome_cds_folder = f"/home/anirudh/genomes/complete{completeness}/"
-    genome_cds_paths = f"{genome_cds_folder}/prokka/"
-    genomes_data = "/home/anirudh/genomes/Asgard_genomes/ncbi_dataset/ncbi_dataset.tsv"
-    scripts_data = "/home/anirudh/genomes/scripts/data/"
+    Parameters:
+        faa_path (str): Prokka .faa file.
+        organism_info (tuple or None): (organism name, strain, breed) from load_metadata().
 
-    output = build_protein_table(genome_cds_paths, genomes_data)
+    Returns:
+        pd.DataFrame: One row per CDS with the COLUMNS of the proteome table.
+    """
+    proteins = get_proteins(faa_path)
+    filename = os.path.basename(faa_path).split('_genomic')[0]
+    org_name, org_strain, org_breed = organism_info if organism_info is not None else (None, None, None)
+
+    return pd.DataFrame({
+        'organism_name': org_name,
+        'breed': org_breed,
+        'strain': org_strain,
+        'cds_id': proteins['cds_ids'],
+        'header': proteins['header'],
+        'genome_file': filename,
+        'sequence': proteins['sequence'],
+    }, columns=COLUMNS)
+
+
+def iter_genome_tables(faabasepath, metadata_csv, workers=None, faa_files=None):
+    """
+    Parse every .faa file in ``faabasepath`` (or only ``faa_files``) on a process pool
+    and yield (filename, DataFrame) per genome, in sorted file order.
 
-    outfilename = os.path.join(genome_cds_folder, f"Proteins_genomes_cp{completeness}.csv")
-    scripts_file = os.path.join(scripts_data, f"Proteins_genomes_cp{completeness}.csv")
-    output.to_csv(outfilename)
-    shutil.copy2(outfilename, scripts_file)
+    At most two files per worker are in flight, so memory is bounded by the
+    largest genomes rather than by the whole proteome.
+    """
+    meta = load_metadata(metadata_csv)
+    faa_files = sorted(os.listdir(faabasepath) if faa_files is None else faa_files)
+    workers = workers or os.cpu_count()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for faa in faa_files:
+            filename = os.path.basename(faa).split('_genomic')[0]
+            if filename not in meta:
+                print(f"Couldnt find organism info for {filename}")
+            pending.append((faa, pool.submit(genome_table, os.path.join(faabasepath, faa), meta.get(filename))))
+            if len(pending) >= 2 * workers:
+                faa, future = pending.popleft()
+                yield faa, future.result()
+        while pending:
+            faa, future = pending.popleft()
+            yield faa, future.result()
+
+
+def build_protein_table(faabasepath, metadata_csv, workers=None):
+    """Whole proteome table in memory; write_protein_table() streams it to disk instead."""
+    tables = [table for _, table in iter_genome_tables(faabasepath, metadata_csv, workers)]
+    return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=COLUMNS)
+
+
+def write_protein_table(faabasepath, metadata_csv, outfilename, workers=None, chunk_rows=200000, store=None,
+                        search_index=None):
+    """
+    Stream the proteome table to ``outfilename`` in chunks of about ``chunk_rows`` rows.
+
+    The CSV keeps the running integer index of the in-memory table. With ``store``,
+    each genome is also written as a partition of the Parquet store (proteome_store.py);
+    pass ``outfilename=None`` to write only the store. With ``search_index``, the
+    full-text index used by search_cds.ipynb (cds_search.py) is built in the same pass.
 
-    print(f"Full Proteins file for completeness {completeness} has been saved to {outfilename}")
+    Returns:
+        int: Number of proteins written.
+    """
+    return write_tables(iter_genome_tables(faabasepath, metadata_csv, workers), outfilename,
+                        chunk_rows, store, search_index)
 
 
-if __name__ == "__main__":
-    main()
+def write_tables(tables, outfilename, chunk_rows=200000, store=None, search_index=None, start=0, append=False,
+                 on_table=None):
+    """
+    Write (filename, DataFrame) pairs to the CSV, store and search index sinks of
+    write_protein_table(). With ``append``, rows are added to an existing CSV, numbered
+    from ``start``. ``search_index`` is an index path (built fresh) or an open
+    cds_search.SearchIndexWriter. ``on_table(faa, table)`` is called for each genome.
+
+    Returns:
+        int: Number of proteins written.
+    """
+    if store is not None:
+        from proteome_store import write_genome_partition
+    index = search_index
+    if isinstance(search_index, str):
+        from cds_search import SearchIndexWriter
+        index = SearchIndexWriter(search_index)
+    written, buffer, buffered = start, [], 0
+
+    def flush():
+        nonlocal written, buffer, buffered
+        chunk = pd.concat(buffer, ignore_index=True)
+        chunk.index = range(written, written + len(chunk))
+        if outfilename is not None:
+            first = written == start and not append
+            chunk.to_csv(outfilename, mode='w' if first else 'a', header=first)
+        written += len(chunk)
+        buffer, buffered = [], 0
+
+    for faa, table in tables:
+        print(f"Processed {faa}: found {len(table)} proteins")
+        if store is not None and len(table):
+            write_genome_partition(store, table['genome_file'].iloc[0], table)
+        if index is not None:
+            index.add(table)
+        buffer.append(table)
+        buffered += len(table)
+        if buffered >= chunk_rows:
+            flush()
+        if on_table is not None:
+            on_table(faa, table)
+    if buffer:
+        flush()
+    if written == start and not append and outfilename is not None:
+        pd.DataFrame(columns=COLUMNS).to_csv(outfilename)
+    if index is not None:
+        index.close()
+
+    return written - start
+
+
+# =====================
+# Incremental updates
+# =====================
+
+def copy_without_genomes(csv_file, outfilename, genomes, chunksize=200000):
+    """
+    Copy the proteome CSV without the rows of ``genomes``, renumbering the index.
+
+    Returns:
+        int: Number of rows kept.
+    """
+    pd.DataFrame(columns=COLUMNS).to_csv(outfilename)
+    kept = 0
+    for chunk in pd.read_csv(csv_file, index_col=0, chunksize=chunksize):
+        chunk = chunk[~chunk['genome_file'].isin(genomes)]
+        chunk.index = range(kept, kept + len(chunk))
+        chunk.to_csv(outfilename, mode='a', header=False)
+        kept += len(chunk)
+    return kept
+
+
+def update_protein_table(faabasepath, metadata_csv, manifest_path, outfilename, workers=None, chunk_rows=200000,
+                         store=None, search_index=None):
+    """
+    Bring the proteome CSV and/or store up to date with ``faabasepath``, parsing only the
+    .faa files that are new or changed since the last run (proteome_manifest.py).
 
+    Store partitions of changed and removed genomes are replaced or deleted. New genomes
+    are appended to the end of the CSV; the CSV is only rewritten (streamed, without
+    loading it) when a genome has to be replaced or dropped. An existing ``search_index``
+    is updated in place for the parsed and dropped genomes only.
 
+    Returns:
+        dict: counts of 'parsed', 'removed' and 'unchanged' files and 'proteins' in the table.
+    """
+    from proteome_manifest import ProteomeManifest, genome_name
+
+    meta = load_metadata(metadata_csv)
+    manifest = ProteomeManifest(manifest_path)
+
+    csv_state = manifest.get_state("csv") if outfilename is not None else None
+    csv_ok = True
+    if outfilename is not None:
+        st = os.stat(outfilename) if os.path.exists(outfilename) else None
+        csv_ok = (st is not None and csv_state is not None and st.st_ino == csv_state["inode"]
+                  and st.st_size >= csv_state["bytes"])
+        if csv_ok and st.st_size > csv_state["bytes"]:
+            print(f"Rolling back an interrupted append to {outfilename}")
+            with open(outfilename, "r+b") as f:
+                f.truncate(csv_state["bytes"])
+        elif st is None and len(manifest):
+            print(f"{outfilename} is missing; compiling every genome again")
+            manifest.clear()
+
+    plan = manifest.plan(faabasepath, meta)
+    parse = {os.path.basename(path): (path, size, mtime, sha) for path, size, mtime, sha in plan['parse']}
+    dropped = {row['genome_file'] for row in plan['changed'] + plan['removed']}
+    print(f"{len(parse)} new or changed, {len(plan['removed'])} removed, {plan['unchanged']} unchanged .faa files")
+
+    if store is not None:
+        for genome in dropped:
+            shutil.rmtree(os.path.join(store, f"genome_file={genome}"), ignore_errors=True)
+
+    def recorded(faa, table):
+        path, size, mtime, sha = parse[faa]
+        manifest.record(path, size, mtime, sha, meta.get(genome_name(faa)), len(table))
+
+    index = None
+    if search_index is not None:
+        from cds_search import SearchIndexWriter
+        # genomes parsed again may already be in the index after an interrupted run
+        index = SearchIndexWriter(search_index, drop_genomes=dropped | {genome_name(faa) for faa in parse})
+
+    tables = iter_genome_tables(faabasepath, metadata_csv, workers, list(parse))
+    target, start = outfilename, manifest.proteins() - sum(row['proteins'] for row in plan['changed'] + plan['removed'])
+    if outfilename is not None and (dropped or not csv_ok):
+        # replace or drop genomes: stream the rows we keep into a new file
+        target = outfilename + ".tmp"
+        redo = dropped | {genome_name(faa) for faa in parse}
+        start = copy_without_genomes(outfilename, target, redo) if os.path.exists(outfilename) else 0
+        if not os.path.exists(outfilename):
+            pd.DataFrame(columns=COLUMNS).to_csv(target)
+    write_tables(tables, target, chunk_rows, store, index, start=start, append=True, on_table=recorded)
+    if target != outfilename:
+        os.replace(target, outfilename)
+
+    for row in plan['removed']:
+        manifest.remove(row['path'])
+    if outfilename is not None:
+        st = os.stat(outfilename)
+        manifest.set_state("csv", {"bytes": st.st_size, "inode": st.st_ino})
+    manifest.commit()
+    counts = {"parsed": len(parse), "removed": len(plan['removed']), "unchanged": plan['unchanged'],
+              "proteins": manifest.proteins()}
+    manifest.close()
+    return counts
+
+
+def replace_tree(src, dst):
+    """
+    Replace folder ``dst`` by a copy of ``src``, so files deleted from ``src`` disappear
+    from ``dst`` too; readers see either the old or the new copy, never a mix.
+    """
+    tmp, old = dst + ".tmp", dst + ".old"
+    for path in (tmp, old):
+        shutil.rmtree(path, ignore_errors=True)
+    shutil.copytree(src, tmp)
+    if os.path.exists(dst):
+        os.replace(dst, old)
+    os.replace(tmp, dst)
+    shutil.rmtree(old, ignore_errors=True)
 
 
+def main():
+    parser = argparse.ArgumentParser(description="Compile the proteins of all genomes of a completeness level into one table.")
+    parser.add_argument("completeness", nargs="?", default=50)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Parallel .faa parsers")
+    parser.add_argument("--chunk-rows", type=int, default=200000, help="Rows buffered before each write")
+    parser.add_argument("--format", choices=["csv", "parquet", "both"], default="csv",
+                        help="CSV table, Parquet store partitioned by genome (proteome_store.py), or both")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only parse new or changed .faa files and drop removed ones (proteome_manifest.py)")
+    parser.add_argument("--search-index", action="store_true",
+                        help="Also build the CDS search index (cds_search.py); updated in place with --incremental")
+    parser.add_argument("--sequence-index", action="store_true",
+                        help="Also build the exact/substring sequence index (sequence_index.py); always a full "
+                             "rebuild over the whole table, also with --incremental")
+    args = parser.parse_args()
 
+    # define the input dirs
+    completeness = args.completeness
+    genome_cds_folder = f"/home/anirudh/genomes/complete{completeness}/"
+    genome_cds_paths = f"{genome_cds_folder}/prokka/"
+    genomes_data = "/home/anirudh/genomes/Asgard_genomes/ncbi_dataset/ncbi_dataset.tsv"
+    scripts_data = "/home/anirudh/genomes/scripts/data/"
 
+    outfilename = os.path.join(genome_cds_folder, f"Proteins_genomes_cp{completeness}.csv")
+    scripts_file = os.path.join(scripts_data, f"Proteins_genomes_cp{completeness}.csv")
+    store = os.path.join(genome_cds_folder, f"Proteins_genomes_cp{completeness}.parquet")
+    scripts_store = os.path.join(scripts_data, f"Proteins_genomes_cp{completeness}.parquet")
+    write_csv = args.format in ("csv", "both")
+    write_store = args.format in ("parquet", "both")
+    search_index = os.path.join(genome_cds_folder, f"Proteins_genomes_cp{completeness}.search.sqlite")
+    scripts_index = os.path.join(scripts_data, f"Proteins_genomes_cp{completeness}.search.sqlite")
+    sequence_index = os.path.join(genome_cds_folder, f"Proteins_genomes_cp{completeness}.seqidx")
+    scripts_sequence_index = os.path.join(scripts_data, f"Proteins_genomes_cp{completeness}.seqidx")
+
+    manifest = os.path.join(genome_cds_folder, f"Proteins_genomes_cp{completeness}.manifest.sqlite")
+
+    if args.incremental:
+        update_index = args.search_index and os.path.exists(search_index)
+        counts = update_protein_table(genome_cds_paths, genomes_data, manifest, outfilename if write_csv else None,
+                                      args.workers, args.chunk_rows, store if write_store else None,
+                                      search_index if update_index else None)
+        total = counts["proteins"]
+        if args.search_index and not update_index:
+            # no index to update yet: build it from the updated table
+            from cds_search import build_index as build_search_index
+            if write_csv:
+                tables = pd.read_csv(outfilename, index_col=0, chunksize=args.chunk_rows)
+            else:
+                from proteome_store import load_proteome, genomes
+                tables = (load_proteome(store, genomes=[g]) for g in genomes(store))
+            build_search_index(tables, search_index)
+    else:
+        # a full compile invalidates what the manifest recorded, and an index of the old
+        # table that --incremental would otherwise keep patching
+        for path in (manifest, search_index):
+            if os.path.exists(path):
+                os.remove(path)
+        if write_store and os.path.exists(store):
+            # partitions of genomes that are gone would otherwise survive
+            shutil.rmtree(store)
+        total = write_protein_table(genome_cds_paths, genomes_data, outfilename if write_csv else None,
+                                    args.workers, args.chunk_rows, store if write_store else None,
+                                    search_index if args.search_index else None)
+
+    if write_csv:
+        shutil.copy2(outfilename, scripts_file)
+        print(f"Full Proteins file for completeness {completeness} ({total} proteins) has been saved to {outfilename}")
+    if write_store:
+        replace_tree(store, scripts_store)
+        print(f"Proteome store for completeness {completeness} ({total} proteins) has been saved to {store}")
+    if args.search_index:
+        shutil.copy2(search_index, scripts_index)
+        print(f"CDS search index for completeness {completeness} has been saved to {search_index}")
+    if args.sequence_index:
+        from sequence_index import build_index, open_source
+        build_index(open_source(outfilename if write_csv else store), sequence_index)
+        replace_tree(sequence_index, scripts_sequence_index)
+        print(f"Sequence index for completeness {completeness} has been saved to {sequence_index}")
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+# Genome x COG category / KEGG KO / eggNOG OG count matrices
+#
+# Analyse_eggnog.py counts the annotations of every genome while it merges them and
+# saves the three matrices to eggnog_counts.npz, so questions like "COG category
+# distribution per Asgard lineage" are answered from a few small arrays instead of
+# re-reading prokka_eggnog_combined.csv. Each matrix is stored sparse (COO: row,
+# column, count) next to its row labels (genomes, with organism name and lineage from
+# the NCBI dataset table) and column labels (features):
+#
+#   cog   one count per protein per letter of COG_category ("KL" counts for K and L)
+#   kegg  one count per protein per KO in KEGG_ko ("ko:" prefix dropped)
+#   og    one count per protein per OG in eggNOG_OGs ("COG0001@1|root" -> "COG0001@1")
+#
+# The lineage is the genus-level part of the organism name, e.g. "Lokiarchaeum" for
+# "Candidatus Lokiarchaeum sp. GC14_75".
+#
+# Usage:
+#   python eggnog_counts.py summary eggnog_counts.npz
+#   python eggnog_counts.py show eggnog_counts.npz cog --by lineage [--fraction]
+#   python eggnog_counts.py show eggnog_counts.npz kegg --by organism --top 20
+
+import sys
+import argparse
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+
+KINDS = ("cog", "kegg", "og")
+COUNTS_NAME = "eggnog_counts.npz"
+
+
+def annotation_counts(df):
+    """
+    Feature counts of one genome's merged annotation table.
+
+    Returns:
+        dict: kind -> Counter of feature -> proteins.
+    """
+    counts = {kind: Counter() for kind in KINDS}
+    if "COG_category" in df:
+        cog = df["COG_category"].dropna().astype(str)
+        counts["cog"].update("".join(cog[cog != "-"]))
+        counts["cog"].pop("-", None)
+    if "KEGG_ko" in df:
+        kegg = df["KEGG_ko"].dropna().astype(str)
+        kegg = kegg[kegg != "-"].str.split(",").explode().str.replace("ko:", "", regex=False)
+        counts["kegg"].update(kegg.value_counts().to_dict())
+    if "eggNOG_OGs" in df:
+        og = df["eggNOG_OGs"].dropna().astype(str)
+        og = og[og != "-"].str.split(",").explode().str.split("|").str[0]
+        counts["og"].update(og.value_counts().to_dict())
+    return counts
+
+
+def lineage_of(organism):
+    """Genus-level lineage of an NCBI organism name; None if unknown."""
+    if not isinstance(organism, str) or not organism.strip():
+        return None
+    words = organism.split()
+    if words[0] == "Candidatus" and len(words) > 1:
+        return words[1]
+    return words[0]
+
+
+def organism_lookup(metadata_tsv):
+    """
+    Genome name -> organism name from the NCBI dataset table. Genomes are matched by
+    'Accession_Assembly Name', by accession with version and without it.
+    """
+    meta = pd.read_csv(metadata_tsv, sep="\t")
+    lookup = {}
+    for acc, name, organism in meta[["Assembly Accession", "Assembly Name", "Organism Name"]].itertuples(index=False):
+        for key in (f"{acc}_{name}", acc, acc.split(".")[0]):
+            lookup.setdefault(key, organism)
+    return lookup
+
+
+def match_organism(genome, lookup):
+    genome = genome.split("_genomic")[0]
+    parts = genome.split("_")
+    for key in (genome, "_".join(parts[:2]), "_".join(parts[:2]).split(".")[0]):
+        if key in lookup:
+            return lookup[key]
+    return None
+
+
+class CountCubeBuilder:
+    """Accumulates annotation_counts() of each genome into the sparse matrices."""
+
+    def __init__(self):
+        self.genomes = []
+        self.features = {kind: {} for kind in KINDS}
+        self.entries = {kind: ([], [], []) for kind in KINDS}
+
+    def add(self, genome, counts):
+        row = len(self.genomes)
+        self.genomes.append(genome)
+        for kind in KINDS:
+            index = self.features[kind]
+            rows, cols, values = self.entries[kind]
+            for feature, n in counts[kind].items():
+                rows.append(row)
+                cols.append(index.setdefault(feature, len(index)))
+                values.append(n)
+
+    def save(self, path, metadata_tsv=None):
+        lookup = organism_lookup(metadata_tsv) if metadata_tsv is not None else {}
+        organisms = [match_organism(g, lookup) for g in self.genomes]
+        arrays = {
+            "genomes": np.array(self.genomes, dtype=str),
+            "organism": np.array(["" if o is None else o for o in organisms], dtype=str),
+            "lineage": np.array([lineage_of(o) or "" for o in organisms], dtype=str),
+        }
+        for kind in KINDS:
+            rows, cols, values = self.entries[kind]
+            arrays[f"{kind}_features"] = np.array(list(self.features[kind]), dtype=str)
+            arrays[f"{kind}_rows"] = np.array(rows, dtype=np.int32)
+            arrays[f"{kind}_cols"] = np.array(cols, dtype=np.int32)
+            arrays[f"{kind}_counts"] = np.array(values, dtype=np.int32)
+        np.savez_compressed(path, **arrays)
+
+
+class CountCube:
+    """
+    Loaded eggnog_counts.npz.
+
+    Parameters:
+        path (str): File written by CountCubeBuilder.save().
+    """
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            self.arrays = {name: data[name] for name in data.files}
+        self.genomes = pd.DataFrame({
+            "genome": self.arrays["genomes"],
+            "organism": pd.Series(self.arrays["organism"]).replace("", None),
+            "lineage": pd.Series(self.arrays["lineage"]).replace("", None),
+        })
+
+    def features(self, kind):
+        return self.arrays[f"{kind}_features"]
+
+    def nnz(self, kind):
+        return len(self.arrays[f"{kind}_counts"])
+
+    def table(self, kind, by="genome", features=None, top=None, fraction=False):
+        """
+        Dense counts for a (small) selection: rows are genomes, organisms or lineages,
+        columns the given ``features`` or the ``top`` most frequent ones (all if neither).
+
+        Returns:
+            pd.DataFrame
+        """
+        rows, cols, counts = (self.arrays[f"{kind}_{part}"] for part in ("rows", "cols", "counts"))
+        names = self.features(kind)
+        if features is not None:
+            wanted = np.flatnonzero(np.isin(names, list(features)))
+        else:
+            totals = np.bincount(cols, weights=counts, minlength=len(names))
+            wanted = np.argsort(-totals, kind="stable")[:top] if top else np.arange(len(names))
+        column_of = np.full(len(names), -1)
+        column_of[wanted] = np.arange(len(wanted))
+
+        labels = self.genomes[by].fillna("unknown").to_numpy()
+        groups, group_of = np.unique(labels, return_inverse=True)
+        keep = column_of[cols] >= 0
+        matrix = np.zeros((len(groups), len(wanted)), dtype=np.int64)
+        np.add.at(matrix, (group_of[rows[keep]], column_of[cols[keep]]), counts[keep])
+
+        result = pd.DataFrame(matrix, index=pd.Index(groups, name=by), columns=names[wanted])
+        if fraction:
+            result = result.div(result.sum(axis=1).replace(0, 1), axis=0)
+        return result
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Query the genome x COG/KEGG/OG count matrices.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    summary = sub.add_parser("summary")
+    summary.add_argument("counts")
+    show = sub.add_parser("show")
+    show.add_argument("counts")
+    show.add_argument("kind", choices=KINDS)
+    show.add_argument("--by", choices=["genome", "organism", "lineage"], default="lineage")
+    show.add_argument("--top", type=int, default=None, help="Only the most frequent features")
+    show.add_argument("--fraction", action="store_true", help="Fractions per row instead of counts")
+    args = parser.parse_args(argv[1:])
+
+    cube = CountCube(args.counts)
+    if args.command == "summary":
+        print(f"Genomes: {len(cube.genomes)} ({cube.genomes['lineage'].nunique()} lineages)")
+        for kind in KINDS:
+            print(f"  {kind}: {len(cube.features(kind))} features, {cube.nnz(kind)} non-zero counts")
+        return
+
+    top = args.top if args.top is not None or args.kind == "cog" else 20
+    table = cube.table(args.kind, args.by, top=top, fraction=args.fraction)
+    with pd.option_context("display.max_columns", 30, "display.width", 200):
+        print(table.round(3) if args.fraction else table)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
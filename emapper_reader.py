@@ -0,0 +1,97 @@
+# Reader for eggNOG-mapper .emapper.annotations files
+#
+# Finds the "#query" header and parses the table in one pass over the file, reads only
+# the columns asked for and stores the repetitive ones (COG category, preferred name,
+# KEGG/BRITE/CAZy fields) as categoricals, which are a fraction of the size of the
+# object columns pd.read_csv gives by default. The "##" comment lines eggNOG-mapper
+# writes before the header and after the last hit are skipped.
+#
+# Usage:
+#   python emapper_reader.py /home/anirudh/emapper_results [COG_category Preferred_name ...]
+
+import os
+import sys
+import time
+
+import pandas as pd
+
+
+QUERY = "#query"
+
+# eggNOG-mapper 2.1 columns
+EMAPPER_COLUMNS = [
+    "#query", "seed_ortholog", "evalue", "score", "eggNOG_OGs", "max_annot_lvl", "COG_category",
+    "Description", "Preferred_name", "GOs", "EC", "KEGG_ko", "KEGG_Pathway", "KEGG_Module",
+    "KEGG_Reaction", "KEGG_rclass", "BRITE", "KEGG_TC", "CAZy", "BiGG_Reaction", "PFAMs",
+]
+
+CATEGORICAL_COLUMNS = [
+    "max_annot_lvl", "COG_category", "Preferred_name", "EC", "KEGG_ko", "KEGG_Pathway", "KEGG_Module",
+    "KEGG_Reaction", "KEGG_rclass", "BRITE", "KEGG_TC", "CAZy", "BiGG_Reaction",
+]
+
+
+def read_annotations(annotation_file, columns=None, categorical=CATEGORICAL_COLUMNS, nrows=None):
+    """
+    Read one emapper annotations file.
+
+    Parameters:
+        annotation_file (str): .emapper.annotations file.
+        columns (list, optional): Columns to keep besides "#query"; all by default. Columns
+            the file does not have are left out.
+        categorical (list): Columns stored as pandas categoricals.
+        nrows (int, optional): Read only the first rows.
+
+    Returns:
+        pd.DataFrame: One row per query, the query ID in "#query".
+    """
+    with open(annotation_file) as f:
+        # readline(), not iteration, so read_csv continues right after the header
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError("No header line starting with '#query' found")
+            if line.startswith(QUERY):
+                break
+        names = line.rstrip("\n").split("\t")
+        names[0] = QUERY  # "#query_name" in eggNOG-mapper 1.x
+
+        usecols = None
+        if columns is not None:
+            usecols = [QUERY] + [c for c in columns if c in names and c != QUERY]
+        wanted = names if usecols is None else usecols
+        df = pd.read_csv(f, sep="\t", header=None, names=names, usecols=usecols, nrows=nrows,
+                         dtype={c: "category" for c in categorical if c in wanted}, low_memory=False)
+
+    comments = df[QUERY].astype(str).str.startswith("#")
+    if comments.any():
+        df = df[~comments].reset_index(drop=True)
+    return df[wanted]
+
+
+def iter_annotation_files(annotation_dir):
+    for root, _, files in os.walk(annotation_dir):
+        for file in sorted(files):
+            if file.endswith(".annotations"):
+                yield os.path.join(root, file)
+
+
+def main(argv):
+    if len(argv) < 2:
+        print("Usage: python emapper_reader.py <annotations file or folder> [column ...]")
+        sys.exit(1)
+
+    path, columns = argv[1], argv[2:] or None
+    files = [path] if os.path.isfile(path) else list(iter_annotation_files(path))
+    start = time.time()
+    rows, memory = 0, 0
+    for annotation_file in files:
+        df = read_annotations(annotation_file, columns)
+        rows += len(df)
+        memory += df.memory_usage(deep=True).sum()
+    print(f"Read {rows} annotations from {len(files)} files in {time.time() - start:.1f} s "
+          f"({memory / 1e6:.1f} MB in memory)")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
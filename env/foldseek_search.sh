@@ -1,9 +1,12 @@
 #!/bin/bash
 # Foldseek 2500 good PDBs vs uniprot50
 
-INPUT_DIR="/home/anirudh/genomes/predicted"
-TARGET_DB="/home/anirudh/genomes/databases/uniprot50"  # Fixed: databases/ (plural)
-OUTPUT_DIR="/home/anirudh/genomes/foldseek_data"
+# Usage: ./foldseek_search.sh [predicted dir] [target DB] [output dir] [threads]
+
+INPUT_DIR="${1:-/home/anirudh/genomes/predicted}"
+TARGET_DB="${2:-/home/anirudh/genomes/databases/uniprot50}"  # Fixed: databases/ (plural)
+OUTPUT_DIR="${3:-/home/anirudh/genomes/foldseek_data}"
+THREADS="${4:-32}"
 FILTER_FILE="$INPUT_DIR/good_pdbs.txt"  # Paths to .pdb files
 
 PDB_INPUT="$OUTPUT_DIR/foldseek_input"
@@ -43,7 +46,7 @@ foldseek easy-search \
   "$TARGET_DB" \
   "$RESULTS_DIR/result.tsv" \
   "$TMP_DIR" \
-  --threads 32 \
+  --threads "$THREADS" \
   -s 9.5 \
   --sort-by-structure-bits 0 \
   --format-output query,target,evalue,tmscore,qalign,talign,alnlen,qid,tid,alnsize,mismatch,gapopen,raw
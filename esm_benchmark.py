@@ -0,0 +1,272 @@
+# Reproducible throughput benchmark for the ESMFold prediction stage
+#
+# Builds a protein set with a controlled length distribution (or samples one from a
+# prediction_summary.csv), then folds it once per configuration through the same
+# code path as esm_inference.py: run() with the worker process, batching, writer
+# thread and metrics stream. Each configuration is a string of esm_inference.py
+# options (recycles, --batch-tokens, --max-length, --precision, ...). Residues/s,
+# per-sequence latency percentiles and peak memory are saved as JSON, and `compare`
+# checks a result file against an earlier one, e.g. in CI with --stand-in on CPU.
+#
+# Usage:
+#   python esm_benchmark.py run --lengths lognormal:5.5,0.5 -n 200 \
+#       --config "--num-recycles 12" --config "--num-recycles 4 --batch-tokens 4000" --out bench.json
+#   python esm_benchmark.py run --sample-from prediction_summary.csv -n 500 --config "--precision bf16"
+#   python esm_benchmark.py run --stand-in --device cpu --lengths uniform:50,400 -n 100 --out ci.json
+#   python esm_benchmark.py compare baseline.json bench.json [--tolerance 0.1]
+
+import os
+import sys
+import json
+import time
+import shlex
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+from esm_standin import AMINO_ACIDS
+from esm_metrics import read_events, percentile
+
+
+# =====================
+# Workloads
+# =====================
+
+def synthetic_lengths(spec, n, seed=0, min_length=10, max_length=5000):
+    """
+    Draw ``n`` sequence lengths from a distribution spec:
+    "fixed:L", "uniform:LO,HI", "lognormal:MU,SIGMA" (of ln L) or "choice:L1,L2,...".
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",")] if params else []
+    rng = np.random.default_rng(seed)
+    if kind == "fixed":
+        lengths = np.full(n, values[0])
+    elif kind == "uniform":
+        lengths = rng.integers(int(values[0]), int(values[1]) + 1, n)
+    elif kind == "lognormal":
+        lengths = rng.lognormal(values[0], values[1], n)
+    elif kind == "choice":
+        lengths = rng.choice(values, n)
+    else:
+        raise ValueError(f"Unknown length distribution: {spec}")
+    return [int(x) for x in np.clip(np.round(lengths), min_length, max_length)]
+
+
+def synthetic_workload(spec, n, seed=0):
+    """(id, sequence) pairs of random residues with lengths drawn from ``spec``."""
+    rng = random.Random(seed)
+    return [(f"bench_{i:05d}", "".join(rng.choice(AMINO_ACIDS) for _ in range(length)))
+            for i, length in enumerate(synthetic_lengths(spec, n, seed))]
+
+
+def sampled_workload(csv_file, n, seed=0):
+    """(id, sequence) pairs sampled from the IDs/seqs columns of a prediction summary."""
+    import pandas as pd
+
+    df = pd.read_csv(csv_file, usecols=["IDs", "seqs"]).dropna().drop_duplicates("IDs")
+    df = df.sample(n=min(n, len(df)), random_state=seed)
+    return list(df.itertuples(index=False, name=None))
+
+
+def write_fasta(workload, path):
+    with open(path, "w") as f:
+        for acc_id, seq in workload:
+            f.write(f">{acc_id}\n{seq}\n")
+
+
+# =====================
+# Running one configuration
+# =====================
+
+def summarise(metrics_path, wall_s):
+    """Aggregate one configuration's metrics stream into the figures we compare."""
+    latency, peak_mem, recycles, outcomes = [], [], [], {}
+    residues = 0
+    for event in read_events(metrics_path):
+        if event["event"] != "sequence":
+            continue
+        outcomes[event["outcome"]] = outcomes.get(event["outcome"], 0) + 1
+        if event.get("inference_s"):
+            latency.append(event["inference_s"])
+            residues += event["length"]
+            if event.get("peak_mem_mb") is not None:
+                peak_mem.append(event["peak_mem_mb"])
+            if event.get("recycles") is not None:
+                recycles.append(event["recycles"])
+    return {
+        "folded": len(latency),
+        "residues": residues,
+        "wall_s": round(wall_s, 3),
+        "residues_per_s": round(residues / wall_s, 3) if wall_s else None,
+        "structures_per_h": round(len(latency) / wall_s * 3600, 1) if wall_s else None,
+        "latency_s": {f"p{q}": round(percentile(latency, q), 4) for q in (50, 90, 99)},
+        "latency_max_s": round(max(latency, default=float("nan")), 4),
+        "peak_mem_mb": round(max(peak_mem), 1) if peak_mem else None,
+        "mean_recycles": round(sum(recycles) / len(recycles), 2) if recycles else None,
+        "outcomes": outcomes,
+    }
+
+
+def run_config(config, fasta, workdir, common, warmup_fasta=None, log=print):
+    """
+    Fold ``fasta`` with one configuration in a fresh output folder and summarise it.
+    The worker is started (and warmed up) before the clock starts, so model loading
+    is not part of the measurement.
+    """
+    from esm_inference import build_parser, run, recycling_policy, TIMEOUT
+    from esm_worker import PredictionWorker
+
+    args = build_parser().parse_args(shlex.split(common) + shlex.split(config))
+    args.input = fasta
+    args.outdir = workdir
+    args.metrics = os.path.join(workdir, "bench_metrics.jsonl")
+    args.no_cache = True  # every configuration folds every sequence
+    args.snapshot_every = 1e9
+
+    worker = PredictionWorker(args.stand_in, args.device, TIMEOUT, log, recycling_policy(args), args.precision)
+    try:
+        if warmup_fasta is not None:
+            warm = build_parser().parse_args(shlex.split(common) + shlex.split(config))
+            warm.input, warm.outdir, warm.no_cache = warmup_fasta, os.path.join(workdir, "warmup"), True
+            run(warm, worker=worker)
+        start = time.time()
+        run(args, worker=worker)
+        wall_s = time.time() - start
+    finally:
+        worker.close()
+    return summarise(args.metrics, wall_s)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def benchmark(args, log=print):
+    if args.sample_from:
+        workload = sampled_workload(args.sample_from, args.n, args.seed)
+        source = {"sample_from": args.sample_from}
+    else:
+        workload = synthetic_workload(args.lengths, args.n, args.seed)
+        source = {"lengths": args.lengths}
+    lengths = [len(seq) for _, seq in workload]
+
+    common = f"--device {args.device}" + (" --stand-in" if args.stand_in else "")
+    configs = args.config or [""]
+    root = tempfile.mkdtemp(prefix="esm_bench_", dir=args.workdir)
+    fasta = os.path.join(root, "workload.faa")
+    write_fasta(workload, fasta)
+    warmup_fasta = None
+    if args.warmup:
+        warmup_fasta = os.path.join(root, "warmup.faa")
+        write_fasta(synthetic_workload("fixed:100", args.warmup, args.seed + 1), warmup_fasta)
+
+    results = []
+    try:
+        for i, config in enumerate(configs):
+            log(f"=== Benchmark configuration {i + 1}/{len(configs)}: '{config}' ===")
+            summary = run_config(config, fasta, os.path.join(root, f"config_{i}"), common, warmup_fasta, log)
+            summary["config"] = config
+            results.append(summary)
+            log(f"'{config}': {summary['residues_per_s']} residues/s, p50 {summary['latency_s']['p50']} s, "
+                f"peak {summary['peak_mem_mb']} MB")
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    return {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "host": socket.gethostname(),
+        "device": args.device,
+        "stand_in": args.stand_in,
+        "workload": dict(source, n=len(workload), seed=args.seed, mean_length=round(float(np.mean(lengths)), 1),
+                         max_length=max(lengths), residues=sum(lengths)),
+        "results": results,
+    }
+
+
+def print_results(report):
+    print(f"Commit {report['commit']} on {report['host']} ({report['device']}), "
+          f"{report['workload']['n']} sequences, mean length {report['workload']['mean_length']}")
+    print(f"{'configuration':<44}{'res/s':>10}{'struct/h':>10}{'p50 s':>9}{'p90 s':>9}{'p99 s':>9}{'peak MB':>10}")
+    print("-" * 101)
+    for r in report["results"]:
+        print(f"{(r['config'] or '(defaults)')[:43]:<44}{r['residues_per_s']:>10.1f}{r['structures_per_h']:>10.0f}"
+              f"{r['latency_s']['p50']:>9.3f}{r['latency_s']['p90']:>9.3f}{r['latency_s']['p99']:>9.3f}"
+              f"{r['peak_mem_mb'] or float('nan'):>10.0f}")
+
+
+def compare(baseline_path, current_path, tolerance=0.1):
+    """
+    Compare two result files configuration by configuration.
+
+    Returns:
+        int: Number of configurations whose residues/s dropped by more than ``tolerance``.
+    """
+    with open(baseline_path) as f:
+        baseline = {r["config"]: r for r in json.load(f)["results"]}
+    with open(current_path) as f:
+        current = json.load(f)
+
+    regressions = 0
+    print(f"{'configuration':<44}{'base res/s':>12}{'res/s':>10}{'change':>9}{'p90 change':>12}")
+    for r in current["results"]:
+        base = baseline.get(r["config"])
+        if base is None:
+            print(f"{(r['config'] or '(defaults)')[:43]:<44}{'-':>12}{r['residues_per_s']:>10.1f}  (no baseline)")
+            continue
+        change = r["residues_per_s"] / base["residues_per_s"] - 1 if base["residues_per_s"] else 0.0
+        p90_change = r["latency_s"]["p90"] / base["latency_s"]["p90"] - 1 if base["latency_s"]["p90"] else 0.0
+        flag = "  REGRESSION" if change < -tolerance else ""
+        regressions += bool(flag)
+        print(f"{(r['config'] or '(defaults)')[:43]:<44}{base['residues_per_s']:>12.1f}{r['residues_per_s']:>10.1f}"
+              f"{change:>+9.1%}{p90_change:>+12.1%}{flag}")
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the ESMFold prediction stage.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    bench = sub.add_parser("run")
+    bench.add_argument("--lengths", default="lognormal:5.5,0.5", help="Synthetic length distribution (see synthetic_lengths)")
+    bench.add_argument("--sample-from", default=None, help="prediction_summary.csv to sample real sequences from")
+    bench.add_argument("-n", type=int, default=200, help="Sequences in the workload")
+    bench.add_argument("--seed", type=int, default=0)
+    bench.add_argument("--config", action="append", help="esm_inference.py options for one configuration; repeatable")
+    bench.add_argument("--device", default="cuda")
+    bench.add_argument("--stand-in", action="store_true")
+    bench.add_argument("--warmup", type=int, default=2, help="Short sequences folded before timing each configuration")
+    bench.add_argument("--workdir", default=None, help="Where the scratch output folders go (default: system temp)")
+    bench.add_argument("--keep", action="store_true", help="Keep the scratch output folders")
+    bench.add_argument("--out", default=None, help="Result JSON (default: esm_benchmark_<timestamp>.json)")
+
+    comp = sub.add_parser("compare")
+    comp.add_argument("baseline")
+    comp.add_argument("current")
+    comp.add_argument("--tolerance", type=float, default=0.1, help="Allowed fractional drop in residues/s")
+
+    args = parser.parse_args(argv[1:])
+    if args.command == "compare":
+        sys.exit(1 if compare(args.baseline, args.current, args.tolerance) else 0)
+
+    report = benchmark(args)
+    out = args.out or f"esm_benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(out, "w") as f:
+        json.dump(report, f, indent=1)
+    print_results(report)
+    print(f"Results written to {out}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,132 @@
+# Content-addressed structure cache for the ESMFold stage
+#
+# Structures are stored once per (sequence, model, recycles) key, so the same protein
+# under another ID — duplicates across genomes, reference vs de novo representatives,
+# renamed unassigned_seq_N headers — is written out from the cache instead of folded.
+#
+# Usage:
+#   python esm_cache.py stats structure_cache.sqlite
+#   python esm_cache.py evict structure_cache.sqlite <max_mb>
+
+import sys
+import time
+import zlib
+import sqlite3
+import threading
+import hashlib
+
+from esm_manifest import sequence_hash
+
+
+CACHE_NAME = "structure_cache.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS structures (
+    key TEXT PRIMARY KEY,
+    seq_hash TEXT NOT NULL,
+    canonical_id TEXT NOT NULL,
+    plddt REAL,
+    pdb BLOB NOT NULL,
+    nbytes INTEGER NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS structures_plddt ON structures (plddt);
+"""
+
+
+def cache_key(seq, model_name, num_recycles):
+    """Key a structure by sequence hash plus the settings that change the prediction."""
+    return hashlib.sha256(f"{model_name}|{num_recycles}|{sequence_hash(seq)}".encode()).hexdigest()
+
+
+class StructureCache:
+    """
+    SQLite-backed store of zlib-compressed PDB text and mean pLDDT.
+
+    Parameters:
+        path (str): Cache file, created if missing.
+        max_bytes (int, optional): Size bound for the stored structures. When exceeded,
+            the lowest-pLDDT entries are evicted first.
+    """
+
+    def __init__(self, path, max_bytes=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        # shared by the prediction loop and its writer thread, serialised by self.lock
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM structures").fetchone()[0]
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM structures").fetchone()[0]
+
+    def get(self, key):
+        """Return (pdb, plddt, canonical_id) for ``key``, or None on a miss."""
+        with self.lock:
+            row = self.conn.execute("SELECT pdb, plddt, canonical_id FROM structures WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE structures SET hits = hits + 1 WHERE key = ?", (key,))
+            self.conn.commit()
+        return zlib.decompress(row[0]).decode(), row[1], row[2]
+
+    def put(self, key, seq, acc_id, pdb, plddt):
+        blob = zlib.compress(pdb.encode(), 6)
+        with self.lock:
+            old = self.conn.execute("SELECT nbytes FROM structures WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO structures (key, seq_hash, canonical_id, plddt, pdb, nbytes, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, sequence_hash(seq), acc_id, None if plddt is None else float(plddt), blob, len(blob), time.time()),
+            )
+            self.conn.commit()
+            self.total_bytes += len(blob) - (old[0] if old else 0)
+            if self.max_bytes is not None and self.total_bytes > self.max_bytes:
+                self.evict(self.max_bytes)
+
+    def evict(self, max_bytes):
+        """Drop the lowest-pLDDT structures (unscored ones first) until the cache fits ``max_bytes``."""
+        with self.lock:
+            cur = self.conn.execute("SELECT key, nbytes FROM structures ORDER BY plddt IS NOT NULL, plddt ASC")
+            doomed = []
+            for key, nbytes in cur:
+                if self.total_bytes <= max_bytes:
+                    break
+                doomed.append((key,))
+                self.total_bytes -= nbytes
+            self.conn.executemany("DELETE FROM structures WHERE key = ?", doomed)
+            self.conn.commit()
+        return len(doomed)
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+def main(argv):
+    if len(argv) < 3 or argv[1] not in ("stats", "evict"):
+        print("Usage: python esm_cache.py stats <structure_cache.sqlite>")
+        print("       python esm_cache.py evict <structure_cache.sqlite> <max_mb>")
+        sys.exit(1)
+
+    cache = StructureCache(argv[2])
+    if argv[1] == "evict":
+        max_mb = float(argv[3])
+        print(f"Evicted {cache.evict(int(max_mb * 1024**2))} structures to fit {max_mb} MB")
+
+    hits = cache.conn.execute("SELECT COALESCE(SUM(hits), 0) FROM structures").fetchone()[0]
+    print(f"Cached structures: {len(cache)}")
+    print(f"Stored size: {cache.total_bytes / 1024**2:.1f} MB")
+    print(f"Cache hits served: {hits}")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
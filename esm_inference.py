@@ -1,35 +1,66 @@
 from Bio import SeqIO
-import torch
-import biotite.structure.io as bsio
 import pandas as pd
 import os
-from tqdm import tqdm 
-import esm
+from tqdm import tqdm
 from datetime import datetime
-import signal 
-import gc
 import sys
-import os
+import gzip
+import time
+import queue
+import argparse
+import threading
+from collections import Counter, namedtuple, defaultdict as ddict
+
+from esm_worker import PredictionWorker, WorkerCrashed, OutOfMemory, structure_to_pdbs, PRECISIONS
+from esm_manifest import open_manifest, needs_prediction, STATUS_OK, STATUS_FAILED, STATUS_TIMEOUT, STATUS_TOO_LONG, STATUS_OOM
+from esm_cache import StructureCache, cache_key, CACHE_NAME
+from esm_metrics import MetricsLogger, METRICS_NAME
+from esm_recycling import RecyclingPolicy, policy_label
+from esm_memory import MemoryModel, open_memory_model, MEMORY_MODEL_NAME
 
 
 # define timeout for structure prediction (in seconds)
 TIMEOUT = 420  # 7 minutes
+# deadline for a sequence offloaded to the CPU after running out of GPU memory
+OFFLOAD_TIMEOUT = 3600
+
+# sequences longer than this are not folded, unless --long-mode has a measured memory model
+MAX_LENGTH = 800
+NUM_RECYCLES = 12
 
 
 
 # =====================
 # Logging setup
 # =====================
-LOG_DIR = "/home/anirudh/genomes/predicted/logs/"
-os.makedirs(LOG_DIR, exist_ok=True)
-LOG_FILE = os.path.join(LOG_DIR, "esm_inference.log")
+LOG_NAME = "esm_inference.log"
+# <outdir>/logs/esm_inference.log, set by set_log_dir() once the arguments are known;
+# until then (and when only imported by esm_shards.py / esm_benchmark.py) log() only prints
+LOG_FILE = None
+
+_log_handle = None
+_log_lock = threading.Lock()
+
+def set_log_dir(log_dir):
+    global LOG_FILE, _log_handle
+    os.makedirs(log_dir, exist_ok=True)
+    path = os.path.join(log_dir, LOG_NAME)
+    with _log_lock:
+        if path != LOG_FILE and _log_handle is not None:
+            _log_handle.close()
+            _log_handle = None
+        LOG_FILE = path
 
 def log(message):
+    global _log_handle
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     line = f"[{timestamp}] {message}"
-    # Write to log file
-    with open(LOG_FILE, "a") as f:
-        f.write(line + "\n")
+    # Write to log file (kept open, line-buffered; the writer thread logs too)
+    with _log_lock:
+        if LOG_FILE is not None:
+            if _log_handle is None:
+                _log_handle = open(LOG_FILE, "a", buffering=1)
+            _log_handle.write(line + "\n")
     # Print above tqdm bar
     tqdm.write(line)
 
@@ -39,161 +70,627 @@ def log(message):
 # =====================
 # Setting up model run and timeout
 # =====================
-
-
-def timeout_handler(signum, frame):
-    raise TimeoutError("Took too long!")
-
-signal.signal(signal.SIGALRM, timeout_handler)
-
-
-def gpu_mem_detailed():
-    return (
-        f"GPU mem — allocated: {torch.cuda.memory_allocated()/1024**2:.1f} MB, "
-        f"reserved: {torch.cuda.memory_reserved()/1024**2:.1f} MB, "
-        f"max allocated: {torch.cuda.max_memory_allocated()/1024**2:.1f} MB, "
-        f"max reserved: {torch.cuda.max_memory_reserved()/1024**2:.1f} MB"
-    )
+# The model lives in a separate worker process (esm_worker.py); the deadline is
+# enforced from here and a stuck worker is replaced without reloading this script.
 
 
 
 # =====================
-# Input / Output paths
+# Length-bucketed batching
 # =====================
-input_fasta = "/home/anirudh/genomes/asCOGs/results/selected/denovo_reps_large.faa"
-outfolder = "/home/anirudh/genomes/predicted/"
-pdbfolder = os.path.join(outfolder, "pdbs")
-os.makedirs(outfolder, exist_ok=True)
-os.makedirs(pdbfolder, exist_ok=True)
-pdbcsvfile = os.path.join(outfolder, "prediction_summary.csv")
 
-# =====================
-# Load previous predictions if they exist
-# =====================
-ids, seqs, pdbs, score = [], [], [], []
+def length_batches(records, batch_tokens, max_batch_size=32, bucket_width=50, buffer_size=2000):
+    """
+    Group streamed FASTA records into batches of similar length.
+
+    Records are read ``buffer_size`` at a time and sorted by length. A batch never
+    spans two length buckets (``bucket_width`` residues wide) and is closed once its
+    padded size — members x longest member — would exceed ``batch_tokens``.
+    A record longer than the budget on its own forms a batch of one.
+
+    Parameters:
+        records (iterable): SeqRecord objects, e.g. from SeqIO.parse.
+        batch_tokens (int): Padded-token budget per forward pass.
+        max_batch_size (int): Upper bound on sequences per batch.
+        bucket_width (int): Width of the length buckets in residues.
+        buffer_size (int): Number of records sorted together.
+
+    Yields:
+        list: SeqRecord objects making up one forward pass.
+    """
+
+    def pack(buffer):
+        batch, bucket = [], None
+        for record in sorted(buffer, key=lambda r: len(r.seq)):
+            length = len(record.seq)
+            if batch and (
+                length // bucket_width != bucket
+                or length * (len(batch) + 1) > batch_tokens
+                or len(batch) >= max_batch_size
+            ):
+                yield batch
+                batch = []
+            batch.append(record)
+            bucket = length // bucket_width
+        if batch:
+            yield batch
+
+    buffer = []
+    for record in records:
+        buffer.append(record)
+        if len(buffer) >= buffer_size:
+            yield from pack(buffer)
+            buffer = []
+    yield from pack(buffer)
 
-pdbase = pd.DataFrame({"IDs": ids, "seqs": seqs, "pdb model": pdbs, "confidence": score})
-if os.path.exists(pdbcsvfile):
-    log(f"Loading existing prediction summary from {pdbcsvfile}")
-    pdbase = pd.read_csv(pdbcsvfile)
-    ids = set(pdbase["IDs"].tolist())
-    score = pdbase["confidence"].tolist()
-    log(f"Loaded {len(ids)} existing predictions")
 
 # =====================
-# Counters
+# Output helpers
 # =====================
-processed_count = 0
-skipped_long_count = 0
-failed_count = 0
 
-# =====================
-# Load ESMFold model
-# =====================
-log("Loading ESMFold model...")
-model = esm.pretrained.esmfold_v1()
-model = model.eval().cuda()
-log("ESMFold model loaded.")
+class Tally(Counter):
+    """Session counters shared by the main loop and the background writer thread."""
 
-# =====================
-# Structure prediction loop
-# =====================
-for i, record in enumerate(tqdm(SeqIO.parse(input_fasta, "fasta"), desc="Predicting Structures")):
-    log(gpu_mem_detailed())
-    if record.id in ids:
-        # log(f"Skipping {record.id}, already predicted.")
-        continue
-
-    processed_count += 1
-    seq = str(record.seq)
-    acc_id = record.id
-    ids.add(acc_id)
-
-    if len(seq) > 800:
-        log(f"Skipping {record.id} (sequence too long: {len(seq)} aa)")
-        skipped_long_count += 1
-        # pdbs.append(None)
-        pdb_path = None
-        score.append(None)
-        sc = None
-    else:
-        try:
-            with torch.no_grad():
-                signal.alarm(TIMEOUT)  # Start timeout countdown
-                pdb = model.infer_pdb(sequence = seq, num_recycles = 12)  # Warm-up run
-                
-                
-
-            pdb_path = os.path.join(pdbfolder, f"{record.id}.pdb")
-            with open(pdb_path, "w") as f:
-                f.write(pdb)
-            log(f"{record.id}.pdb written and saved at {pdb_path}")
-            # pdbs.append(pdb_path)
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
 
-            try:
-                struct = bsio.load_structure(pdb_path, extra_fields=["b_factor"])
-                sc = struct.b_factor.mean()
-                score.append(sc)
-            except Exception as e:
-                log(f"Warning: failed to load structure for {record.id}: {e}")
-                sc = None
-                score.append(None)
+    def add(self, key, n=1):
+        with self.lock:
+            self[key] += n
 
-            log(f"pLDDT for {record.id}: {score[-1]}") 
-            gc.collect()
-            del pdb
-            torch.cuda.empty_cache()
+    def set(self, key, value):
+        with self.lock:
+            self[key] = value
 
+    def snapshot(self):
+        with self.lock:
+            return dict(self)
 
-        except TimeoutError:
-            failed_count += 1
-            log(f"Timeout: Prediction for {record.id} exceeded {TIMEOUT} seconds.")
-            pdb_path = None
-            # pdbs.append(None)
-            sc = None
-            score.append(None)
-            gc.collect()
-            torch.cuda.empty_cache()
 
-        except Exception as e:
-            failed_count += 1
-            log(f"Failed for {record.id}: {e}")
-            pdb_path = None
-            # pdbs.append(None)
-            sc = None
-            score.append(None)
-            gc.collect()
-            torch.cuda.empty_cache()
-        
-        finally:
-            signal.alarm(0)  # Disable timeout
-        
+def write_summary_row(pdbcsvfile, acc_id, seq, pdb_path, sc):
     pd.DataFrame([[acc_id, seq, pdb_path, sc]], columns=["IDs", "seqs", "pdb model", "confidence"]).to_csv(pdbcsvfile, mode="a", header=not os.path.exists(pdbcsvfile), index=False)
 
 
-    # Save intermediate results and append summary every 10 predictions
-    if len(ids) % 10 == 0:
-        # pdbase = pd.DataFrame({"IDs": ids, "seqs": seqs, "pdb model": pdbs, "confidence": score})
-        # pdbase.to_csv(pdbcsvfile, index=False)
+def write_pdb(pdbfolder, acc_id, pdb, compress=False):
+    """Write one PDB (gzipped as .pdb.gz if ``compress``) and return its path."""
+    if compress:
+        pdb_path = os.path.join(pdbfolder, f"{acc_id}.pdb.gz")
+        with gzip.open(pdb_path, "wt", compresslevel=6) as f:
+            f.write(pdb)
+    else:
+        pdb_path = os.path.join(pdbfolder, f"{acc_id}.pdb")
+        with open(pdb_path, "w") as f:
+            f.write(pdb)
+    log(f"{acc_id}.pdb written and saved at {pdb_path}")
+    return pdb_path
+
+
+def log_summary(manifest, counts, length_cap=MAX_LENGTH):
+    total = len(manifest)
+    summary = (
+        f"=== ESMFold Summary after {total} runs ===\n"
+        f"Total IDs processed: {counts['processed']}, {total}\n"
+        f"Skipped as too long (over the {length_cap} aa cap) in this session: {counts['skipped_long']}\n"
+        f"Failed runs in this session: {counts['failed']} (timeouts: {counts['timeouts']}, "
+        f"OOM after backoff: {counts['oom']}, worker restarts: {counts['restarts']})\n"
+        f"Folded after an OOM backoff in this session: {counts['oom_recovered']}\n"
+        f"Successful predictions: {counts['processed'] - counts['skipped_long'] - counts['failed']}\n"
+        f"Batched forward passes in this session: {counts['batches']}\n"
+        f"Structure cache hits in this session: {counts['cache_hits']}\n"
+        f"Valid structures (pLDDT > 80): {manifest.count(min_plddt=80)}\n"
+
+        f"============================================"
+    )
+    log(summary)
+
+
+class ResultWriter:
+    """
+    Turns folded batches into PDB files, summary rows, manifest rows and cache entries.
+
+    ``lookup`` runs on the main thread as records are read; ``handle`` runs on the
+    background writer thread (or inline with --no-writer). Both share the alias table
+    of identical sequences still in flight and the summary CSV, guarded by a lock. Every finished ID is
+    also reported to the metrics stream.
+    """
+
+    def __init__(self, pdbfolder, pdbcsvfile, manifest, cache, counts, model_name, recycle_mode,
+                 metrics, stand_in=False, compress=False, snapshot_every=60, on_done=None):
+        self.pdbfolder = pdbfolder
+        self.pdbcsvfile = pdbcsvfile
+        self.manifest = manifest
+        self.cache = cache
+        self.counts = counts
+        self.model_name = model_name
+        self.recycle_mode = recycle_mode  # fixed count or adaptive policy label; part of the cache key
+        self.stand_in = stand_in
+        self.compress = compress
+        self.metrics = metrics
+        self.snapshot_every = snapshot_every
+        self.on_done = on_done  # called with each ID once its manifest row is committed
+        self.last_snapshot = time.time()
+        self.aliases = ddict(list)  # cache key -> records waiting on an identical sequence in flight
+        self.lock = threading.Lock()
+        self.progress = tqdm(desc="Predicting Structures")
+
+    def record_result(self, record, status, pdb_path=None, sc=None, runtime=None, outcome=None, **metrics):
+        """
+        Commit the manifest row that marks the ID as done, append the summary row and
+        report it to the metrics stream (``outcome`` defaults to ``status``). The manifest
+        goes first so a crash in between cannot repeat the summary row on resume.
+        """
+        seq = str(record.seq)
+        self.manifest.record(record.id, seq, status, plddt=sc, runtime=runtime, pdb_path=pdb_path,
+                             recycles=metrics.get("recycles"))
+        with self.lock:  # both threads append; only one may find the CSV missing and write its header
+            write_summary_row(self.pdbcsvfile, record.id, seq, pdb_path, sc)
+        self.metrics.sequence(record.id, len(seq), outcome or status, plddt=sc, **metrics)
+        if self.on_done is not None:
+            self.on_done(record.id)
+
+    def key(self, record):
+        return cache_key(record.seq, self.model_name, self.recycle_mode)
+
+    def lookup(self, record):
+        """Resolve ``record`` from the cache or an in-flight twin; return True if it needs no folding."""
+        if self.cache is None:
+            return False
+        key = self.key(record)
+        with self.lock:
+            if key in self.aliases:
+                self.aliases[key].append(record)
+                return True
+            hit = self.cache.get(key)
+            if hit is None:
+                self.aliases[key] = []
+                return False
+        pdb, sc, canonical_id = hit
+        log(f"Cache hit: {record.id} is identical to {canonical_id}")
+        self.counts.add("cache_hits")
+        self.record_result(record, STATUS_OK, write_pdb(self.pdbfolder, record.id, pdb, self.compress), sc, 0.0, outcome="cache_hit")
+        self.tick(1)
+        return True
+
+    def handle(self, folded):
+        """Serialise and record one folded (sub-)batch."""
+        ok = folded.status == STATUS_OK
+        start = time.time()
+        pdbs = structure_to_pdbs(folded.structure, self.stand_in) if ok else [None] * len(folded.records)
+        residues = sum(len(record.seq) for record in folded.records)
+        to_pdb_s = time.time() - start
+
+        for i, (record, pdb) in enumerate(zip(folded.records, pdbs)):
+            share = len(record.seq) / residues
+            start = time.time()
+            sc = folded.plddts[i] if ok else None
+            pdb_path = None
+            if ok:
+                pdb_path = write_pdb(self.pdbfolder, record.id, pdb, self.compress)
+                log(f"pLDDT for {record.id}: {sc} ({folded.info.get('recycles')} recycles)")
+                self.counts.add("residues", len(record.seq))
+                self.counts.add("recycles", folded.info.get("recycles") or 0)
+            else:
+                self.counts.add("failed")
+            info = folded.info
+            self.record_result(
+                record, folded.status, pdb_path, sc, folded.runtimes[i],
+                queue_wait_s=round(info["started"] - record.annotations["read_at"], 3) if info.get("started") else None,
+                inference_s=round(info["infer_s"] * share, 3) if ok else None,
+                serialization_s=round(to_pdb_s * share + time.time() - start, 4),
+                peak_mem_mb=info.get("peak_mem_mb"),
+                recycles=info.get("recycles"),
+                chunk_size=info.get("chunk_size"),
+                offload=info.get("offload"),
+                batch_size=len(folded.records),
+            )
+            self.tick(1 + self.resolve_aliases(record, folded.status, pdb, sc))
+
+    def resolve_aliases(self, record, status, pdb, sc):
+        # identical sequences that arrived while this one was in flight share its result
+        if self.cache is None:
+            return 0
+        key = self.key(record)
+        with self.lock:
+            if status == STATUS_OK:
+                self.cache.put(key, str(record.seq), record.id, pdb, sc)
+            waiting = self.aliases.pop(key, [])
+        for alias in waiting:
+            if status == STATUS_OK:
+                self.counts.add("cache_hits")
+                self.record_result(alias, status, write_pdb(self.pdbfolder, alias.id, pdb, self.compress), sc, 0.0, outcome="cache_hit")
+            else:
+                self.counts.add("failed")
+                self.record_result(alias, status)
+        return len(waiting)
+
+    def tick(self, n):
+        self.progress.update(n)
+        # aggregate snapshot to the metrics stream every snapshot_every seconds
+        if time.time() - self.last_snapshot >= self.snapshot_every:
+            self.snapshot()
+
+    def snapshot(self):
+        self.last_snapshot = time.time()
+        residues_per_s, structures_per_h = self.metrics.snapshot(
+            counts=self.counts.snapshot(),
+            manifest_total=len(self.manifest),
+            plddt_gt_80=self.manifest.count(min_plddt=80),
+        )
+        log(f"{self.progress.n} IDs this session; rolling throughput {structures_per_h:.0f} structures/h, "
+            f"{residues_per_s:.1f} residues/s")
+
+    def close(self):
+        self.progress.close()
+        self.snapshot()
+
+
+class BackgroundWriter:
+    """
+    Runs ``handle`` on a daemon thread fed by a bounded queue, so the supervisor can hand
+    the next batch to the worker while the previous one is being written.
+    """
+
+    def __init__(self, handle, maxsize=8):
+        self.handle = handle
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue  # drain without writing after a failure
+            try:
+                self.handle(item)
+            except Exception as e:
+                log(f"Writer thread failed: {e}")
+                self.error = e
+
+    def put(self, item):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(item)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
 
-        summary = (
-            f"=== ESMFold Summary after {len(ids)} runs ===\n"
-            f"Total IDs processed: {processed_count}, {len(ids)}\n"
-            f"Skipped due to long sequences in this session: {skipped_long_count}\n"
-            f"Failed runs in this session: {failed_count}\n"
-            f"Successful predictions: {processed_count - skipped_long_count - failed_count}\n"
-            f"Valid structures (pLDDT > 80): {(lambda lst: sum(1 for x in lst if x is not None and x > 80))(score)}\n"
 
-            f"============================================"
-        )
-        log(summary)
 
 # =====================
-# Final save
+# Structure prediction loop
 # =====================
-# pdbase = pd.DataFrame({"IDs": ids, "seqs": seqs, "pdb model": pdbs, "confidence": score})
-# pdbase.to_csv(pdbcsvfile, index=False)
-torch.cuda.empty_cache()
 
-log(f"Prediction summary saved to {pdbcsvfile}")
-log("ESMFold pipeline completed.")
\ No newline at end of file
+# one folded (sub-)batch: structure arrays, per-record pLDDT/runtime and batch stats
+# (start time, inference time, peak memory, recycles), or a failure status
+Folded = namedtuple("Folded", ["records", "status", "structure", "plddts", "runtimes", "info"])
+
+
+def attempt_label(options):
+    if options.get("offload"):
+        return f"CPU offload (chunk size {options.get('chunk_size')})"
+    if options.get("chunk_size"):
+        return f"chunk size {options['chunk_size']}"
+    return "unchunked attention"
+
+
+def fold_batch(worker, batch, counts, num_recycles=NUM_RECYCLES, memory=None):
+    """
+    Fold one batch in the worker and return a list of Folded results. The batch's wall
+    time is shared out between its records in proportion to length.
+
+    A timed-out or failing multi-sequence batch is retried one sequence at a time so a
+    single problematic record cannot take its neighbours down with it. With a memory
+    model (--long-mode), a single sequence that runs out of memory is retried down the
+    model's backoff plan (smaller chunk sizes, then CPU offload) before it counts as OOM.
+    """
+    seqs = [str(record.seq) for record in batch]
+    attempts = memory.attempts(len(seqs[0])) if memory is not None and len(batch) == 1 else [{}]
+    start = time.time()
+    error = None
+    for i, options in enumerate(attempts):
+        try:
+            timeout = OFFLOAD_TIMEOUT if options.get("offload") else None
+            structure, plddts, info = worker.predict(seqs, num_recycles, timeout=timeout, **options)
+            error = None
+            break
+        except OutOfMemory as e:
+            error = e
+            if i + 1 < len(attempts):
+                log(f"Out of memory for {batch[0].id} ({len(seqs[0])} aa) with {attempt_label(options)}; "
+                    f"retrying with {attempt_label(attempts[i + 1])}")
+        except Exception as e:
+            error = e
+            break
+
+    if error is not None:
+        if len(batch) > 1:
+            log(f"Batch of {len(batch)} failed ({error}); retrying its sequences one at a time")
+            results = []
+            for record in batch:
+                results.extend(fold_batch(worker, [record], counts, num_recycles, memory))
+            return results
+        runtime = time.time() - start
+        info = {"started": worker.started_at, "recycles": num_recycles}
+        if isinstance(error, TimeoutError):
+            counts.add("timeouts")
+            log(f"Timeout: Prediction for {batch[0].id} exceeded {OFFLOAD_TIMEOUT if options.get('offload') else worker.timeout} seconds.")
+            return [Folded(batch, STATUS_TIMEOUT, None, None, [runtime], info)]
+        if isinstance(error, OutOfMemory):
+            counts.add("oom")
+            log(f"Out of memory for {batch[0].id} ({len(seqs[0])} aa) after {len(attempts)} attempt(s): {error}")
+            return [Folded(batch, STATUS_OOM, None, None, [runtime], info)]
+        if isinstance(error, WorkerCrashed):
+            log(f"Worker crashed while predicting {batch[0].id}: {error}")
+        else:
+            log(f"Failed for {batch[0].id}: {error}")
+        return [Folded(batch, STATUS_FAILED, None, None, [runtime], info)]
+
+    if i > 0:
+        counts.add("oom_recovered")
+        log(f"{batch[0].id} folded with {attempt_label(options)} after running out of memory")
+    runtime = time.time() - start
+    residues = sum(len(seq) for seq in seqs)
+    info["started"] = worker.started_at
+    return [Folded(batch, STATUS_OK, structure, plddts, [runtime * len(seq) / residues for seq in seqs], info)]
+
+
+def build_parser(description="Predict structures for a FASTA file with ESMFold."):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--input", default="/home/anirudh/genomes/asCOGs/results/selected/denovo_reps_large.faa", help="Input protein FASTA")
+    parser.add_argument("--outdir", default="/home/anirudh/genomes/predicted/", help="Folder for pdbs/, prediction_summary.csv and the resume manifest")
+    parser.add_argument("--summary", default=None, help="Prediction summary CSV (default: <outdir>/prediction_summary.csv)")
+    parser.add_argument("--batch-tokens", type=int, default=0, help="Padded-token budget per forward pass; 0 folds one sequence at a time")
+    parser.add_argument("--max-batch-size", type=int, default=32, help="Maximum sequences per forward pass")
+    parser.add_argument("--bucket-width", type=int, default=50, help="Width of the length buckets (aa)")
+    parser.add_argument("--buffer-size", type=int, default=2000, help="Records read ahead and sorted into buckets")
+    parser.add_argument("--num-recycles", type=int, default=NUM_RECYCLES, help="Fixed recycle count (ignored with --adaptive-recycles)")
+    parser.add_argument("--adaptive-recycles", action="store_true", help="Stop recycling once the structure converges (see esm_recycling.py)")
+    parser.add_argument("--min-recycles", type=int, default=3, help="Adaptive mode: recycles always run")
+    parser.add_argument("--max-recycles", type=int, default=24, help="Adaptive mode: upper bound on recycles")
+    parser.add_argument("--recycle-tol", type=float, default=0.5, help="Adaptive mode: CA RMS shift (A) between recycles counted as converged")
+    parser.add_argument("--plddt-tol", type=float, default=0.5, help="Adaptive mode: mean pLDDT change between recycles counted as converged")
+    parser.add_argument("--device", default="cuda")
+    parser.add_argument("--precision", choices=sorted(PRECISIONS), default="fp32", help="Fold under torch.autocast in fp16 or bf16")
+    parser.add_argument("--stand-in", action="store_true", help="Use the small CPU stand-in model from esm_standin.py")
+    parser.add_argument("--no-cache", action="store_true", help="Fold every ID even if an identical sequence is cached")
+    parser.add_argument("--cache-max-mb", type=float, default=0, help="Evict low-pLDDT cached structures beyond this size; 0 = unbounded")
+    parser.add_argument("--no-writer", action="store_true", help="Write results inline instead of on the background writer thread")
+    parser.add_argument("--writer-queue", type=int, default=8, help="Folded batches the writer may fall behind by")
+    parser.add_argument("--compress", action="store_true", help="Write structures as gzipped .pdb.gz")
+    parser.add_argument("--long-mode", action="store_true", help="Take the length cap from the measured memory model and back off on OOM (see esm_memory.py)")
+    parser.add_argument("--memory-model", default=None, help=f"Memory model JSON (default: <outdir>/{MEMORY_MODEL_NAME})")
+    parser.add_argument("--gpu-mem-mb", type=float, default=0, help="Long mode: usable GPU memory; 0 = 90%% of the profiled device")
+    parser.add_argument("--no-offload", action="store_true", help="Long mode: never fall back to folding on the CPU")
+    parser.add_argument("--max-length", type=int, default=MAX_LENGTH, help="Length cap when no memory model has been measured")
+    parser.add_argument("--metrics", default=None, help=f"JSONL metrics stream (default: <outdir>/{METRICS_NAME})")
+    parser.add_argument("--snapshot-every", type=float, default=60, help="Seconds between aggregate metrics snapshots")
+    return parser
+
+
+def recycling_policy(args):
+    """The adaptive RecyclingPolicy asked for on the command line, or None for a fixed count."""
+    if not args.adaptive_recycles:
+        return None
+    return RecyclingPolicy(args.min_recycles, args.max_recycles, args.recycle_tol, args.plddt_tol)
+
+
+def run(args, targets=None, records=None, worker=None, on_done=None, refold_before=None):
+    """
+    Predict every record of ``args.input`` that the manifest does not list yet, or lists
+    as too long (or out of memory, in long mode) for a cap that now covers it.
+
+    Parameters:
+        args (argparse.Namespace): Options from build_parser().
+        targets (set, optional): Only IDs in this set are predicted (used by esm_reinfer.py).
+        records (iterable, optional): SeqRecords to use instead of reading ``args.input``
+            (used by the work-queue workers in esm_shards.py).
+        worker (PredictionWorker, optional): Already running worker to reuse; it is left
+            running for the caller to close.
+        on_done (callable, optional): Called with every ID once it is recorded, including
+            IDs skipped because the manifest already has them.
+        refold_before (float, optional): Timestamp; IDs (of ``targets``, if given) recorded
+            in the manifest before it are predicted again and their rows overwritten.
+
+    Returns:
+        Tally: The session's tallies.
+    """
+
+    # =====================
+    # Input / Output paths
+    # =====================
+    input_fasta = args.input
+    outfolder = args.outdir
+    pdbfolder = os.path.join(outfolder, "pdbs")
+    os.makedirs(outfolder, exist_ok=True)
+    os.makedirs(pdbfolder, exist_ok=True)
+    set_log_dir(os.path.join(outfolder, "logs"))
+    pdbcsvfile = args.summary or os.path.join(outfolder, "prediction_summary.csv")
+
+    # =====================
+    # Open the resume manifest (imports prediction_summary.csv on first use)
+    # =====================
+    manifest = open_manifest(outfolder, pdbcsvfile, log)
+    log(f"Resuming with {len(manifest)} existing predictions in {manifest.path}")
+
+    # =====================
+    # Structure cache: identical sequences are folded once and aliased afterwards
+    # =====================
+    cache = None
+    if not args.no_cache:
+        max_bytes = int(args.cache_max_mb * 1024**2) if args.cache_max_mb > 0 else None
+        cache = StructureCache(os.path.join(outfolder, CACHE_NAME), max_bytes)
+        log(f"Structure cache {cache.path} holds {len(cache)} structures")
+
+    # =====================
+    # Metrics stream (see esm_metrics.py report)
+    # =====================
+    metrics = MetricsLogger(args.metrics or os.path.join(outfolder, METRICS_NAME))
+    log(f"Writing metrics to {metrics.path}")
+
+    # =====================
+    # Recycling: fixed count, or adaptive early exit within [min, max]
+    # =====================
+    recycling = recycling_policy(args)
+    num_recycles = recycling.max_recycles if recycling else args.num_recycles
+    log(f"Recycling mode: {policy_label(recycling, args.num_recycles)}")
+
+    # =====================
+    # Length cap: measured memory model in long mode, --max-length otherwise
+    # =====================
+    memory = None
+    max_length = args.max_length
+    if args.long_mode:
+        memory = open_memory_model(args.memory_model or os.path.join(outfolder, MEMORY_MODEL_NAME),
+                                   args.gpu_mem_mb or None, not args.no_offload, log)
+        if memory is None:
+            memory = MemoryModel(budget_mb=args.gpu_mem_mb or None, offload=not args.no_offload)
+        elif memory.fits:
+            max_length = memory.length_cap()
+    log(f"Length cap: {max_length} aa" + (" (with OOM backoff)" if memory is not None else ""))
+
+    # reduced-precision structures are cached apart from fp32 ones
+    model_name = "standin" if args.stand_in else "esmfold_v1"
+    if args.precision != "fp32":
+        model_name += f"/{args.precision}"
+
+    counts = Tally()
+    results = ResultWriter(pdbfolder, pdbcsvfile, manifest, cache, counts,
+                           model_name, policy_label(recycling, args.num_recycles),
+                           metrics, args.stand_in, args.compress, args.snapshot_every, on_done)
+
+    # =====================
+    # Load ESMFold model
+    # =====================
+    own_worker = worker is None
+    if own_worker:
+        log("Loading ESMFold model...")
+        worker = PredictionWorker(args.stand_in, args.device, TIMEOUT, log, recycling, args.precision)
+        log("ESMFold model loaded.")
+
+    def pending():
+        # new records within the length limit; too-long ones and cache hits are recorded straight away
+        seen = set()  # IDs queued this session but possibly not folded yet
+        for record in (SeqIO.parse(input_fasta, "fasta") if records is None else records):
+            row = manifest.get(record.id)
+            targeted = targets is None or record.id in targets
+            if record.id in seen or (row is not None and not needs_prediction(
+                    row, max_length, memory is not None, refold_before if targeted else None)):
+                if on_done is not None and row is not None:
+                    on_done(record.id)
+                continue
+            if not targeted:
+                continue
+            if row is not None:
+                log(f"Predicting {record.id} again (recorded as {row['status']}, {row['length']} aa)")
+            seen.add(record.id)
+            record.annotations["read_at"] = time.time()
+            counts.add("processed")
+            if len(record.seq) > max_length:
+                log(f"Skipping {record.id} (sequence too long: {len(record.seq)} aa > {max_length} aa)")
+                counts.add("skipped_long")
+                results.record_result(record, STATUS_TOO_LONG)
+                results.tick(1)
+                continue
+            if results.lookup(record):
+                continue
+            yield record
+
+    if args.batch_tokens > 0:
+        batches = length_batches(pending(), args.batch_tokens, args.max_batch_size, args.bucket_width, args.buffer_size)
+    else:
+        batches = ([record] for record in pending())
+
+    writer = None if args.no_writer else BackgroundWriter(results.handle, args.writer_queue)
+    start = time.time()
+    try:
+        for batch in batches:
+            counts.add("batches")
+            for folded in fold_batch(worker, batch, counts, num_recycles, memory):
+                counts.set("restarts", worker.restarts)
+                if writer is None:
+                    results.handle(folded)
+                else:
+                    writer.put(folded)
+    finally:
+        if writer is not None:
+            writer.close()
+        results.close()
+        if own_worker:
+            worker.close()
+
+    # =====================
+    # Final save
+    # =====================
+    elapsed = time.time() - start
+    counts.set("restarts", worker.restarts)
+    log_summary(manifest, counts, max_length)
+    folded_ok = counts["processed"] - counts["skipped_long"] - counts["failed"] - counts["cache_hits"]
+    log(
+        f"Throughput ({'inline writes' if writer is None else 'background writer'}): "
+        f"{folded_ok / elapsed * 3600:.1f} structures/h, {counts['residues'] / elapsed:.1f} residues/s "
+        f"over {elapsed:.0f} s"
+    )
+    if folded_ok:
+        log(f"Mean recycles per folded structure: {counts['recycles'] / folded_ok:.1f}")
+    metrics.close()
+    manifest.close()
+    if cache is not None:
+        cache.close()
+
+    log(f"Prediction summary saved to {pdbcsvfile}")
+    log("ESMFold pipeline completed.")
+    return counts
+
+
+def selftest():
+    """
+    Resume an output folder from a summary CSV with a 900 aa row skipped as too long, under
+    a 1000 aa cap with the stand-in model; raises AssertionError unless the row gets folded.
+    """
+    import shutil
+    import tempfile
+    from esm_manifest import PredictionManifest, MANIFEST_NAME
+
+    tmp = tempfile.mkdtemp(prefix="esm_inference_")
+    try:
+        seq = "MKTAYIAKQR" * 90
+        fasta = os.path.join(tmp, "input.faa")
+        with open(fasta, "w") as f:
+            f.write(f">long1\n{seq}\n>short1\nMKTAYIAKQR\n")
+        outdir = os.path.join(tmp, "predicted")
+        os.makedirs(outdir)
+        write_summary_row(os.path.join(outdir, "prediction_summary.csv"), "long1", seq, None, None)
+
+        args = build_parser().parse_args(["--input", fasta, "--outdir", outdir, "--stand-in", "--device", "cpu",
+                                          "--max-length", "1000", "--num-recycles", "1"])
+        counts = run(args)
+        assert counts["processed"] == 2 and counts["skipped_long"] == 0, counts
+
+        manifest = PredictionManifest(os.path.join(outdir, MANIFEST_NAME))
+        row = manifest.get("long1")
+        manifest.close()
+        assert row["status"] == STATUS_OK and row["length"] == 900, row
+        assert os.path.exists(row["pdb_path"]), row
+        assert run(args)["processed"] == 0
+    finally:
+        shutil.rmtree(tmp)
+    print("esm_inference selftest passed")
+
+
+def main():
+    if sys.argv[1:] == ["selftest"]:
+        selftest()
+        return
+    run(build_parser().parse_args())
+
+
+if __name__ == "__main__":
+    main()
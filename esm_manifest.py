@@ -0,0 +1,228 @@
+# Indexed resume manifest for the ESMFold prediction scripts
+#
+# One SQLite row per predicted ID (keyed by ID, with the sequence hash indexed) so
+# esm_inference.py and esm_reinfer.py can check "already done?" in O(1) without
+# re-reading prediction_summary.csv. WAL journaling keeps it crash-safe: a row is
+# either committed with its PDB path or not there at all.
+#
+# Usage:
+#   python esm_manifest.py import prediction_summary.csv [prediction_manifest.sqlite]
+#   python esm_manifest.py stats prediction_manifest.sqlite
+
+import os
+import sys
+import time
+import sqlite3
+import threading
+import hashlib
+
+
+MANIFEST_NAME = "prediction_manifest.sqlite"
+
+# outcome of a prediction attempt
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+STATUS_TIMEOUT = "timeout"
+STATUS_TOO_LONG = "too_long"
+STATUS_OOM = "oom"  # out of memory even after the chunk-size / CPU-offload backoff
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id TEXT PRIMARY KEY,
+    seq_hash TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    plddt REAL,
+    runtime REAL,
+    pdb_path TEXT,
+    recycles INTEGER,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS predictions_seq_hash ON predictions (seq_hash);
+CREATE INDEX IF NOT EXISTS predictions_status ON predictions (status);
+"""
+
+
+def sequence_hash(seq):
+    """Stable hash of a protein sequence (case-insensitive, stop codon stripped)."""
+    return hashlib.sha256(str(seq).upper().rstrip("*").encode()).hexdigest()
+
+
+class PredictionManifest:
+    """
+    SQLite-backed record of every prediction attempt.
+
+    Parameters:
+        path (str): Manifest file, created if missing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # shared by the prediction loop and its writer thread, serialised by self.lock
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(predictions)")]
+        if "recycles" not in columns:  # manifests created before adaptive recycling
+            self.conn.execute("ALTER TABLE predictions ADD COLUMN recycles INTEGER")
+        self.conn.commit()
+
+    def __contains__(self, acc_id):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM predictions WHERE id = ?", (acc_id,)).fetchone() is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+
+    def get(self, acc_id):
+        with self.lock:
+            cur = self.conn.execute("SELECT * FROM predictions WHERE id = ?", (acc_id,))
+            row = cur.fetchone()
+        if row is None:
+            return None
+        return dict(zip([c[0] for c in cur.description], row))
+
+    def record(self, acc_id, seq, status, plddt=None, runtime=None, pdb_path=None, recycles=None, commit=True):
+        """Insert or replace the row for one ID; ``recycles`` is the number of recycles the fold used."""
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO predictions (id, seq_hash, length, status, plddt, runtime, pdb_path, recycles, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (acc_id, sequence_hash(seq), len(seq), status,
+                 None if plddt is None else float(plddt),
+                 None if runtime is None else float(runtime),
+                 pdb_path, None if recycles is None else int(recycles), time.time()),
+            )
+            if commit:
+                self.conn.commit()
+
+    def count(self, status=None, min_plddt=None):
+        query, params = "SELECT COUNT(*) FROM predictions WHERE 1", []
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+        if min_plddt is not None:
+            query += " AND plddt > ?"
+            params.append(min_plddt)
+        with self.lock:
+            return self.conn.execute(query, params).fetchone()[0]
+
+    def ids(self, min_plddt=None):
+        """Return recorded IDs, optionally only those with pLDDT >= min_plddt."""
+        with self.lock:
+            if min_plddt is None:
+                rows = self.conn.execute("SELECT id FROM predictions").fetchall()
+            else:
+                rows = self.conn.execute("SELECT id FROM predictions WHERE plddt >= ?", (min_plddt,)).fetchall()
+        return [acc_id for (acc_id,) in rows]
+
+    def recycle_stats(self):
+        """(folds with a recorded recycle count, mean recycles, mean runtime) over successful predictions."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*), AVG(recycles), AVG(runtime) FROM predictions WHERE status = ? AND recycles IS NOT NULL",
+                (STATUS_OK,),
+            ).fetchone()
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+def needs_prediction(row, max_length, retry_oom=False, refold_before=None):
+    """
+    Whether the manifest row of an ID still has to be predicted.
+
+    Skipped-as-too-long rows are retried once the length cap has been raised to cover
+    them, out-of-memory rows too if ``retry_oom`` (long mode, with the backoff). Rows
+    recorded before ``refold_before`` (a timestamp) are predicted again as well.
+    """
+    if refold_before is not None and row["updated"] < refold_before:
+        return True
+    if row["status"] == STATUS_TOO_LONG or (retry_oom and row["status"] == STATUS_OOM):
+        return row["length"] <= max_length
+    return False
+
+
+def import_summary_csv(csv_file, manifest, max_length=800, chunksize=100000):
+    """
+    Import an existing prediction_summary.csv into a manifest.
+
+    The CSV is read in chunks, so memory stays flat however many rows it has. Rows with
+    a PDB path become "ok"; rows without one become "too_long" if the sequence is over
+    ``max_length`` and "failed" otherwise. Later rows for the same ID win, as they did
+    when the CSV was appended to.
+
+    Returns:
+        int: Number of rows imported.
+    """
+    import pandas as pd
+
+    imported = 0
+    for chunk in pd.read_csv(csv_file, chunksize=chunksize):
+        for acc_id, seq, pdb_path, plddt in chunk[["IDs", "seqs", "pdb model", "confidence"]].itertuples(index=False):
+            seq = "" if pd.isna(seq) else str(seq)
+            if isinstance(pdb_path, str) and pdb_path:
+                status = STATUS_OK
+            elif len(seq) > max_length:
+                status = STATUS_TOO_LONG
+            else:
+                status = STATUS_FAILED
+            manifest.record(str(acc_id), seq, status,
+                            plddt=None if pd.isna(plddt) else plddt,
+                            pdb_path=pdb_path if status == STATUS_OK else None,
+                            commit=False)
+            imported += 1
+        manifest.commit()
+    return imported
+
+
+def open_manifest(outfolder, pdbcsvfile=None, log=print):
+    """
+    Open the manifest in ``outfolder``, importing ``pdbcsvfile`` the first time.
+
+    This is the one-off migration path for output folders that predate the manifest.
+    """
+    path = os.path.join(outfolder, MANIFEST_NAME)
+    fresh = not os.path.exists(path)
+    manifest = PredictionManifest(path)
+    if fresh and pdbcsvfile is not None and os.path.exists(pdbcsvfile):
+        log(f"No manifest yet; importing {pdbcsvfile} into {path}")
+        log(f"Imported {import_summary_csv(pdbcsvfile, manifest)} rows")
+    return manifest
+
+
+def main(argv):
+    if len(argv) < 3 or argv[1] not in ("import", "stats"):
+        print("Usage: python esm_manifest.py import <prediction_summary.csv> [manifest.sqlite]")
+        print("       python esm_manifest.py stats <manifest.sqlite>")
+        sys.exit(1)
+
+    if argv[1] == "import":
+        csv_file = argv[2]
+        path = argv[3] if len(argv) > 3 else os.path.join(os.path.dirname(os.path.abspath(csv_file)), MANIFEST_NAME)
+        manifest = PredictionManifest(path)
+        print(f"Imported {import_summary_csv(csv_file, manifest)} rows from {csv_file} into {path}")
+    else:
+        manifest = PredictionManifest(argv[2])
+
+    print(f"Total IDs: {len(manifest)}")
+    for status in (STATUS_OK, STATUS_FAILED, STATUS_TIMEOUT, STATUS_TOO_LONG, STATUS_OOM):
+        print(f"  {status}: {manifest.count(status)}")
+    print(f"  pLDDT > 80: {manifest.count(min_plddt=80)}")
+    folds, mean_recycles, mean_runtime = manifest.recycle_stats()
+    if folds:
+        print(f"  mean recycles used: {mean_recycles:.1f} over {folds} folds ({mean_runtime:.1f} s per structure)")
+    manifest.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,232 @@
+# Measured GPU memory model for ESMFold and the backoff plan for long sequences
+#
+# Peak memory is recorded per sequence length for each trunk chunk size (None = no
+# chunking) and fitted with a quadratic in length, as the pair representation grows
+# with L^2. The fit gives the longest sequence that fits the GPU, which replaces the
+# fixed 800 aa cap, and the order of attempts for a long sequence: the largest chunk
+# size predicted to fit first, then smaller chunks after an OOM, then CPU offload.
+#
+# Usage:
+#   python esm_memory.py profile [--stand-in --device cpu] [--lengths 200,400,...] [--out esm_memory_model.json]
+#   python esm_memory.py fit esm_metrics.jsonl [--out esm_memory_model.json]
+#   python esm_memory.py show esm_memory_model.json
+
+import os
+import sys
+import json
+import random
+import argparse
+from collections import defaultdict as ddict
+
+import numpy as np
+import torch
+
+
+MEMORY_MODEL_NAME = "esm_memory_model.json"
+
+# trunk chunk sizes tried in order after an OOM; None runs the axial attention unchunked
+CHUNK_SIZES = (None, 128, 64, 32, 16)
+
+# longest length considered when solving the fit for a cap
+LENGTH_LIMIT = 10000
+
+
+def chunk_label(chunk_size):
+    return "none" if chunk_size is None else str(chunk_size)
+
+
+def is_oom(error):
+    """True for CUDA (or host) out-of-memory errors."""
+    return isinstance(error, (torch.cuda.OutOfMemoryError, MemoryError)) or "out of memory" in str(error).lower()
+
+
+class MemoryModel:
+    """
+    Peak-memory measurements and the quadratic fit per chunk size.
+
+    Parameters:
+        points (dict): chunk label -> list of [length, peak MB].
+        oom (dict): chunk label -> shortest length seen to run out of memory.
+        total_mb (float): Memory of the device the points were measured on.
+        budget_mb (float, optional): Usable memory; defaults to 90% of ``total_mb``.
+        offload (bool): Fall back to folding on the CPU after the last chunk size fails.
+    """
+
+    def __init__(self, points=None, oom=None, total_mb=None, budget_mb=None, offload=True):
+        self.points = {k: [tuple(p) for p in v] for k, v in (points or {}).items()}
+        self.oom = dict(oom or {})
+        self.total_mb = total_mb
+        self.budget_mb = budget_mb if budget_mb else (0.9 * total_mb if total_mb else None)
+        self.offload = offload
+        self.fits = {}
+        for label, pts in self.points.items():
+            lengths = np.array([p[0] for p in pts], dtype=float)
+            peaks = np.array([p[1] for p in pts], dtype=float)
+            if len(set(lengths)) >= 3:
+                self.fits[label] = np.polyfit(lengths, peaks, 2)
+            elif len(pts):
+                # too few lengths for a curve: scale the largest point by L^2
+                i = int(lengths.argmax())
+                self.fits[label] = np.array([peaks[i] / lengths[i] ** 2, 0.0, 0.0])
+
+    @classmethod
+    def load(cls, path, budget_mb=None, offload=True):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data.get("points"), data.get("oom"), data.get("total_mb"), budget_mb, offload)
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"total_mb": self.total_mb, "points": self.points, "oom": self.oom}, f, indent=1)
+
+    def add(self, chunk_size, length, peak_mb):
+        self.points.setdefault(chunk_label(chunk_size), []).append((int(length), float(peak_mb)))
+
+    def predict(self, length, chunk_size=None):
+        """Predicted peak MB for one sequence of ``length``, or None without a fit."""
+        fit = self.fits.get(chunk_label(chunk_size))
+        return None if fit is None else float(np.polyval(fit, length))
+
+    def fits_in_memory(self, length, chunk_size=None):
+        label = chunk_label(chunk_size)
+        if label in self.oom and length >= self.oom[label]:
+            return False
+        predicted = self.predict(length, chunk_size)
+        if predicted is None or self.budget_mb is None:
+            return True  # unmeasured, or no budget to compare with: only an observed OOM rules it out
+        return predicted <= self.budget_mb
+
+    def max_length(self, chunk_size=None):
+        """Longest length predicted to fit with ``chunk_size`` (0 if none does)."""
+        longest = 0
+        for length in range(10, LENGTH_LIMIT + 1, 10):
+            if not self.fits_in_memory(length, chunk_size):
+                break
+            longest = length
+        return longest
+
+    def length_cap(self):
+        """Longest length that fits with any chunk size; the too-long threshold."""
+        return max(self.max_length(chunk_size) for chunk_size in CHUNK_SIZES)
+
+    def attempts(self, length):
+        """
+        Settings to try in order for one sequence: every chunk size from the largest one
+        predicted to fit downwards, then CPU offload.
+
+        Returns:
+            list: dicts of PredictionWorker.predict() keyword arguments.
+        """
+        plan = [{"chunk_size": c} for c in CHUNK_SIZES if self.fits_in_memory(length, c)]
+        if plan:
+            first = CHUNK_SIZES.index(plan[0]["chunk_size"])
+            plan = [{"chunk_size": c} for c in CHUNK_SIZES[first:]]
+        if self.offload:
+            plan.append({"chunk_size": CHUNK_SIZES[-1], "offload": True})
+        return plan or [{}]
+
+    def describe(self):
+        lines = [f"Device memory: {self.total_mb} MB, budget: {self.budget_mb} MB"]
+        for chunk_size in CHUNK_SIZES:
+            label = chunk_label(chunk_size)
+            if label not in self.fits:
+                continue
+            a, b, c = self.fits[label]
+            lines.append(f"  chunk {label:>4}: peak ~ {a:.3g} L^2 + {b:.3g} L + {c:.3g} MB "
+                         f"({len(self.points[label])} points), fits up to {self.max_length(chunk_size)} aa")
+        lines.append(f"Length cap: {self.length_cap()} aa")
+        return "\n".join(lines)
+
+
+def open_memory_model(path, budget_mb=None, offload=True, log=print):
+    """Load the memory model at ``path``, or return None if it has not been measured yet."""
+    if not os.path.exists(path):
+        log(f"No memory model at {path}; run 'python esm_memory.py profile' to measure one")
+        return None
+    model = MemoryModel.load(path, budget_mb, offload)
+    log(model.describe())
+    return model
+
+
+# =====================
+# Measuring
+# =====================
+
+def profile(model, device, lengths, chunk_sizes=CHUNK_SIZES, log=print):
+    """
+    Fold random sequences of each length with each chunk size and record peak memory.
+    A chunk size stops at the first length that runs out of memory.
+    """
+    from esm_worker import peak_memory_mb, on_cuda, free_memory
+    from esm_standin import AMINO_ACIDS
+
+    total_mb = torch.cuda.get_device_properties(device).total_memory / 1024**2 if on_cuda(device) else None
+    memory = MemoryModel(total_mb=total_mb)
+    rng = random.Random(0)
+    for chunk_size in chunk_sizes:
+        model.set_chunk_size(chunk_size)
+        for length in lengths:
+            seq = "".join(rng.choice(AMINO_ACIDS) for _ in range(length))
+            if on_cuda(device):
+                torch.cuda.reset_peak_memory_stats(device)
+            try:
+                with torch.no_grad():
+                    model.infer([seq], num_recycles=0)
+            except Exception as e:
+                if not is_oom(e):
+                    raise
+                free_memory()
+                memory.oom[chunk_label(chunk_size)] = length
+                log(f"chunk {chunk_label(chunk_size)}: out of memory at {length} aa")
+                break
+            peak = peak_memory_mb(device)
+            memory.add(chunk_size, length, peak)
+            log(f"chunk {chunk_label(chunk_size)}: {length} aa -> {peak:.0f} MB")
+    model.set_chunk_size(None)
+    return MemoryModel(memory.points, memory.oom, total_mb)
+
+
+def fit_from_metrics(path, memory=None):
+    """Add the single-sequence peak-memory readings of an esm_metrics.jsonl stream."""
+    from esm_metrics import read_events
+
+    memory = memory or MemoryModel()
+    points = ddict(list)
+    for event in read_events(path):
+        if event["event"] != "sequence" or event.get("batch_size") != 1 or event.get("offload"):
+            continue
+        if event.get("inference_s") and event.get("peak_mem_mb") is not None:
+            points[chunk_label(event.get("chunk_size"))].append((event["length"], event["peak_mem_mb"]))
+    for label, pts in points.items():
+        memory.points.setdefault(label, []).extend(pts)
+    return MemoryModel(memory.points, memory.oom, memory.total_mb)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Measure and inspect the ESMFold memory model.")
+    parser.add_argument("command", choices=["profile", "fit", "show"])
+    parser.add_argument("path", nargs="?", help="esm_metrics.jsonl for 'fit', the model file for 'show'")
+    parser.add_argument("--out", default=MEMORY_MODEL_NAME)
+    parser.add_argument("--lengths", default="200,400,600,800,1000,1200,1500,2000,2500,3000")
+    parser.add_argument("--device", default="cuda")
+    parser.add_argument("--stand-in", action="store_true")
+    args = parser.parse_args(argv[1:])
+
+    if args.command == "show":
+        print(MemoryModel.load(args.path).describe())
+        return
+
+    existing = MemoryModel.load(args.out) if os.path.exists(args.out) else None
+    if args.command == "profile":
+        from esm_worker import load_model
+        model = load_model(args.stand_in, args.device)
+        memory = profile(model, args.device, [int(x) for x in args.lengths.split(",")])
+    else:
+        memory = fit_from_metrics(args.path, existing)
+    memory.save(args.out)
+    print(memory.describe())
+    print(f"Memory model written to {args.out}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,168 @@
+# Structured performance telemetry for the ESMFold prediction loop
+#
+# esm_inference.py writes one JSON object per line: a "sequence" event per ID
+# (length, queue wait, inference and serialisation time, peak memory, recycles,
+# outcome) and periodic "snapshot" events with rolling throughput and run totals.
+# Lines are buffered and written by a background thread so the loop never blocks
+# on disk.
+#
+# Usage:
+#   python esm_metrics.py report esm_metrics.jsonl [bucket_width]
+
+import sys
+import json
+import time
+import queue
+import threading
+from collections import deque, Counter, defaultdict as ddict
+
+
+METRICS_NAME = "esm_metrics.jsonl"
+
+
+class MetricsLogger:
+    """
+    Buffered, asynchronous JSONL metrics stream.
+
+    Parameters:
+        path (str): JSONL file, appended to.
+        window (float): Seconds covered by the rolling throughput figures.
+        flush_every (float): Maximum seconds a line stays in the buffer.
+    """
+
+    def __init__(self, path, window=300, flush_every=2.0):
+        self.path = path
+        self.window = window
+        self.flush_every = flush_every
+        self.start = time.time()
+        self.recent = deque()  # (time, residues) of structures folded within the window
+        self.outcomes = Counter()
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        with open(self.path, "a") as f:
+            buffer, last_flush, closing = [], time.time(), False
+            while not closing:
+                try:
+                    item = self.queue.get(timeout=self.flush_every)
+                    if item is None:
+                        closing = True
+                    else:
+                        buffer.append(item)
+                except queue.Empty:
+                    pass
+                if buffer and (closing or time.time() - last_flush >= self.flush_every or len(buffer) >= 1000):
+                    f.write("".join(json.dumps(event) + "\n" for event in buffer))
+                    f.flush()
+                    buffer, last_flush = [], time.time()
+
+    def emit(self, event, **fields):
+        fields["event"] = event
+        fields["time"] = round(time.time(), 3)
+        self.queue.put(fields)
+
+    def sequence(self, acc_id, length, outcome, **fields):
+        """Record one finished ID; a folded one also counts toward rolling throughput."""
+        now = time.time()
+        with self.lock:
+            self.outcomes[outcome] += 1
+            if fields.get("inference_s"):
+                self.recent.append((now, length))
+        self.emit("sequence", id=acc_id, length=length, outcome=outcome, **fields)
+
+    def throughput(self):
+        """Rolling (residues/s, structures/h) over the last ``window`` seconds."""
+        now = time.time()
+        with self.lock:
+            while self.recent and self.recent[0][0] < now - self.window:
+                self.recent.popleft()
+            span = min(self.window, now - self.start) or 1e-9
+            residues = sum(length for _, length in self.recent)
+            return residues / span, len(self.recent) / span * 3600
+
+    def snapshot(self, **fields):
+        residues_per_s, structures_per_h = self.throughput()
+        with self.lock:
+            outcomes = dict(self.outcomes)
+        self.emit("snapshot", elapsed_s=round(time.time() - self.start, 1),
+                  residues_per_s=round(residues_per_s, 2), structures_per_h=round(structures_per_h, 1),
+                  outcomes=outcomes, **fields)
+        return residues_per_s, structures_per_h
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+
+# =====================
+# Report
+# =====================
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    k = (len(values) - 1) * q / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def read_events(path):
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def report(path, bucket_width=100):
+    """Print latency-by-length percentiles, outcomes and the last throughput snapshot."""
+    latency = ddict(list)
+    queue_wait = ddict(list)
+    peak_mem = ddict(list)
+    outcomes = ddict(Counter)
+    last_snapshot = None
+
+    for event in read_events(path):
+        if event["event"] == "snapshot":
+            last_snapshot = event
+            continue
+        if event["event"] != "sequence":
+            continue
+        bucket = event["length"] // bucket_width
+        outcomes[bucket][event["outcome"]] += 1
+        if event.get("inference_s"):
+            latency[bucket].append(event["inference_s"])
+            queue_wait[bucket].append(event.get("queue_wait_s") or 0.0)
+            if event.get("peak_mem_mb") is not None:
+                peak_mem[bucket].append(event["peak_mem_mb"])
+
+    print(f"{'Length (aa)':<14}{'n':>7}{'p50 s':>9}{'p90 s':>9}{'p99 s':>9}{'max s':>9}"
+          f"{'wait p50':>10}{'peak MB':>10}  outcomes")
+    print("-" * 100)
+    for bucket in sorted(outcomes):
+        times = latency[bucket]
+        label = f"{bucket * bucket_width}-{(bucket + 1) * bucket_width - 1}"
+        print(f"{label:<14}{len(times):>7}{percentile(times, 50):>9.2f}{percentile(times, 90):>9.2f}"
+              f"{percentile(times, 99):>9.2f}{max(times, default=float('nan')):>9.2f}"
+              f"{percentile(queue_wait[bucket], 50):>10.2f}{max(peak_mem[bucket], default=float('nan')):>10.0f}  "
+              + ", ".join(f"{k}: {v}" for k, v in sorted(outcomes[bucket].items())))
+
+    if last_snapshot is not None:
+        print(f"\nLast snapshot after {last_snapshot['elapsed_s']:.0f} s: "
+              f"{last_snapshot['residues_per_s']:.1f} residues/s, {last_snapshot['structures_per_h']:.1f} structures/h")
+
+
+def main(argv):
+    if len(argv) < 3 or argv[1] != "report":
+        print("Usage: python esm_metrics.py report <esm_metrics.jsonl> [bucket_width]")
+        sys.exit(1)
+    report(argv[2], int(argv[3]) if len(argv) > 3 else 100)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
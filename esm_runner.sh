@@ -1,6 +1,8 @@
 #!/bin/bash
 
 # Script to repeatedly run esm_inference.py until it succeeds
+# Hung or crashed predictions are handled inside esm_inference.py by replacing its
+# worker process; this loop only restarts the run if the supervisor itself exits.
 
 while true; do
     echo "Starting esm_inference.py..."
@@ -0,0 +1,359 @@
+# Sharded multi-worker ESMFold runs coordinated through a SQLite work queue
+#
+# The input FASTA is loaded once into work_queue.sqlite in the output folder. Every ID
+# is assigned to one of N shards by hashing the ID, so the split is the same on every
+# run. Each worker process (one per GPU, or per node sharing the folder) claims its own
+# shard first and steals from the fullest other shard once its own is empty. Claims
+# are leases: a worker renews its leases while it is alive, and the items of a dead
+# worker are handed out again once the lease expires. All workers share the manifest,
+# structure cache and pdbs/; each writes its own summary part, and `merge` combines
+# the parts into prediction_summary.csv with one row per ID.
+#
+# Usage:
+#   python esm_shards.py launch --input denovo_reps_large.faa --outdir predicted/ --devices cuda:0,cuda:1
+#   python esm_shards.py init --input denovo_reps_large.faa --outdir predicted/ --shards 4
+#   python esm_shards.py work --outdir predicted/ --worker-id 0 --shards 4 --device cuda:0 [esm_inference options]
+#   python esm_shards.py merge --outdir predicted/
+#   python esm_shards.py status --outdir predicted/
+
+import os
+import sys
+import glob
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+import subprocess
+
+from Bio import SeqIO
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+
+QUEUE_NAME = "work_queue.sqlite"
+SUMMARY_NAME = "prediction_summary.csv"
+PART_PATTERN = "prediction_summary.worker*.csv"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id TEXT PRIMARY KEY,
+    seq TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner INTEGER,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS items_shard_state ON items (shard, state);
+CREATE INDEX IF NOT EXISTS items_owner ON items (owner, state);
+"""
+
+
+def shard_of(acc_id, shards):
+    """Deterministic shard of an ID, independent of input order."""
+    return int(hashlib.sha256(acc_id.encode()).hexdigest()[:8], 16) % shards
+
+
+class WorkQueue:
+    """
+    SQLite-backed work queue with leases and work stealing.
+
+    Parameters:
+        path (str): Queue file, created if missing.
+        lease (float): Seconds a claim stays valid without being renewed.
+        max_attempts (int): Claims after which an item is no longer handed out.
+    """
+
+    def __init__(self, path, lease=1800, max_attempts=3):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        # used by the prediction loop, its writer thread and the heartbeat, serialised by self.lock
+        self.conn = sqlite3.connect(path, timeout=120, check_same_thread=False, isolation_level=None)
+        self.lock = threading.RLock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def add(self, records, shards, chunksize=10000):
+        """Enqueue SeqRecords; IDs already queued are left as they are. Returns the number added."""
+        added, rows = 0, []
+        with self.lock:
+            for record in records:
+                rows.append((record.id, str(record.seq), shard_of(record.id, shards)))
+                if len(rows) >= chunksize:
+                    added += self._insert(rows)
+                    rows = []
+            added += self._insert(rows)
+        return added
+
+    def _insert(self, rows):
+        self.conn.execute("BEGIN IMMEDIATE")
+        before = self.conn.total_changes
+        self.conn.executemany("INSERT OR IGNORE INTO items (id, seq, shard) VALUES (?, ?, ?)", rows)
+        self.conn.execute("COMMIT")
+        return self.conn.total_changes - before
+
+    def claim(self, worker_id, shard, n):
+        """
+        Lease up to ``n`` items to ``worker_id``: pending or expired items of ``shard``
+        first, then of whichever other shard has the most left.
+
+        Returns:
+            list: (id, seq) tuples.
+        """
+        now = time.time()
+        available = "(state = 'pending' OR (state = 'leased' AND lease_expires < ?)) AND attempts < ?"
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.conn.execute(
+                    f"SELECT id, seq FROM items WHERE shard = ? AND {available} LIMIT ?",
+                    (shard, now, self.max_attempts, n),
+                ).fetchall()
+                if not rows:
+                    victim = self.conn.execute(
+                        f"SELECT shard FROM items WHERE {available} GROUP BY shard ORDER BY COUNT(*) DESC LIMIT 1",
+                        (now, self.max_attempts),
+                    ).fetchone()
+                    if victim is not None:
+                        rows = self.conn.execute(
+                            f"SELECT id, seq FROM items WHERE shard = ? AND {available} LIMIT ?",
+                            (victim[0], now, self.max_attempts, n),
+                        ).fetchall()
+                self.conn.executemany(
+                    "UPDATE items SET state = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                    [(worker_id, now + self.lease, acc_id) for acc_id, _ in rows],
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return rows
+
+    def renew(self, worker_id):
+        """Extend every lease ``worker_id`` holds; the heartbeat of a live worker."""
+        with self.lock:
+            self.conn.execute("UPDATE items SET lease_expires = ? WHERE owner = ? AND state = 'leased'",
+                              (time.time() + self.lease, worker_id))
+
+    def complete(self, acc_id):
+        with self.lock:
+            self.conn.execute("UPDATE items SET state = 'done', lease_expires = NULL WHERE id = ?", (acc_id,))
+
+    def held_by_others(self, worker_id):
+        """Number of live leases held by other workers."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM items WHERE state = 'leased' AND owner != ? AND lease_expires >= ?",
+                (worker_id, time.time()),
+            ).fetchone()[0]
+
+    def remaining(self):
+        """Items not done and still eligible to be handed out."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM items WHERE state != 'done' AND attempts < ?", (self.max_attempts,)
+            ).fetchone()[0]
+
+    def stats(self):
+        with self.lock:
+            by_state = dict(self.conn.execute("SELECT state, COUNT(*) FROM items GROUP BY state").fetchall())
+            by_shard = self.conn.execute(
+                "SELECT shard, SUM(state = 'done'), COUNT(*) FROM items GROUP BY shard ORDER BY shard"
+            ).fetchall()
+            by_owner = self.conn.execute(
+                "SELECT owner, COUNT(*) FROM items WHERE state = 'done' GROUP BY owner ORDER BY owner"
+            ).fetchall()
+            given_up = self.conn.execute(
+                "SELECT COUNT(*) FROM items WHERE state != 'done' AND attempts >= ?", (self.max_attempts,)
+            ).fetchone()[0]
+        return by_state, by_shard, by_owner, given_up
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def claimed_records(queue, worker_id, shard, claim_size, log=print):
+    """Yield SeqRecords claimed from ``queue`` until nothing is left to claim."""
+    while True:
+        rows = queue.claim(worker_id, shard, claim_size)
+        if not rows:
+            return
+        log(f"Worker {worker_id} claimed {len(rows)} items ({queue.remaining()} not done yet)")
+        for acc_id, seq in rows:
+            yield SeqRecord(Seq(seq), id=acc_id, description="")
+
+
+class Heartbeat:
+    """Renews a worker's leases every lease/3 seconds on a daemon thread."""
+
+    def __init__(self, queue, worker_id):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.queue.lease / 3):
+            self.queue.renew(self.worker_id)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+# =====================
+# Merging the summary parts
+# =====================
+
+def merge_summaries(outdir, log=print):
+    """
+    Combine the existing prediction_summary.csv and every worker part into one
+    prediction_summary.csv with a single row per ID: a row with a structure wins over
+    a failed attempt, otherwise the last row seen wins. The parts are removed afterwards.
+
+    Returns:
+        int: Rows in the merged summary.
+    """
+    import pandas as pd
+
+    summary = os.path.join(outdir, SUMMARY_NAME)
+    parts = sorted(glob.glob(os.path.join(outdir, PART_PATTERN)))
+    frames = [pd.read_csv(path) for path in ([summary] if os.path.exists(summary) else []) + parts]
+    if not frames:
+        log("Nothing to merge")
+        return 0
+    merged = pd.concat(frames, ignore_index=True)
+    folded = merged["pdb model"].notna()
+    merged = (merged.assign(_folded=folded)
+                    .sort_values("_folded", kind="stable")
+                    .drop_duplicates("IDs", keep="last")
+                    .sort_index()
+                    .drop(columns="_folded"))
+    tmp = summary + ".tmp"
+    merged.to_csv(tmp, index=False)
+    os.replace(tmp, summary)
+    for path in parts:
+        os.remove(path)
+    log(f"Merged {len(parts)} worker summaries into {summary} ({len(merged)} IDs)")
+    return len(merged)
+
+
+# =====================
+# Commands
+# =====================
+
+def init_queue(input_fasta, outdir, shards, lease, log=print):
+    from esm_manifest import open_manifest
+
+    os.makedirs(outdir, exist_ok=True)
+    # import an existing prediction_summary.csv once, before workers share the manifest
+    open_manifest(outdir, os.path.join(outdir, SUMMARY_NAME), log).close()
+    queue = WorkQueue(os.path.join(outdir, QUEUE_NAME), lease)
+    added = queue.add(SeqIO.parse(input_fasta, "fasta"), shards)
+    log(f"Queued {added} new IDs from {input_fasta} in {shards} shards ({queue.remaining()} not done)")
+    queue.close()
+
+
+def work(args, log=print):
+    """Run one worker: claim, fold and record until the queue is drained."""
+    from esm_inference import run, recycling_policy, TIMEOUT
+    from esm_worker import PredictionWorker
+
+    queue = WorkQueue(os.path.join(args.outdir, QUEUE_NAME), args.lease)
+    args.summary = args.summary or os.path.join(args.outdir, f"prediction_summary.worker{args.worker_id}.csv")
+    args.metrics = args.metrics or os.path.join(args.outdir, f"esm_metrics.worker{args.worker_id}.jsonl")
+    # pack each claim on its own, so claimed items are not held back while others idle
+    args.buffer_size = min(args.buffer_size, args.claim_size)
+    worker = PredictionWorker(args.stand_in, args.device, TIMEOUT, log, recycling_policy(args), args.precision)
+    heartbeat = Heartbeat(queue, args.worker_id)
+    try:
+        while True:
+            run(args, records=claimed_records(queue, args.worker_id, args.worker_id % args.shards, args.claim_size, log),
+                worker=worker, on_done=queue.complete)
+            if not queue.remaining():
+                break
+            # the rest is leased to other workers: wait for them to finish, or for their leases to lapse
+            log(f"Worker {args.worker_id}: {queue.held_by_others(args.worker_id)} items leased to other workers; "
+                f"checking again in {args.poll} s")
+            time.sleep(args.poll)
+    finally:
+        heartbeat.stop()
+        worker.close()
+        queue.close()
+    log(f"Worker {args.worker_id} finished")
+
+
+def launch(args, passthrough, log=print):
+    """Start one local worker process per device, wait for them and merge their summaries."""
+    devices = args.devices.split(",")
+    workers = args.workers or len(devices)
+    init_queue(args.input, args.outdir, workers, args.lease, log)
+    procs = []
+    for worker_id in range(workers):
+        cmd = [sys.executable, os.path.abspath(__file__), "work", "--input", args.input, "--outdir", args.outdir,
+               "--worker-id", str(worker_id), "--shards", str(workers), "--device", devices[worker_id % len(devices)],
+               "--lease", str(args.lease)] + passthrough
+        procs.append(subprocess.Popen(cmd))
+        log(f"Started worker {worker_id} (pid {procs[-1].pid}) on {devices[worker_id % len(devices)]}")
+    codes = [proc.wait() for proc in procs]
+    log(f"Workers exited with codes {codes}")
+    merge_summaries(args.outdir, log)
+    return max(codes)
+
+
+def status(outdir):
+    queue = WorkQueue(os.path.join(outdir, QUEUE_NAME))
+    by_state, by_shard, by_owner, given_up = queue.stats()
+    print(f"Items: {sum(by_state.values())} ({', '.join(f'{k}: {v}' for k, v in sorted(by_state.items()))})")
+    print(f"Given up after repeated claims: {given_up}")
+    for shard, done, total in by_shard:
+        print(f"  shard {shard}: {done}/{total} done")
+    for owner, done in by_owner:
+        print(f"  worker {owner}: {done} done")
+    queue.close()
+
+
+def main(argv):
+    from esm_inference import build_parser, log
+
+    if len(argv) < 2 or argv[1] not in ("init", "work", "launch", "merge", "status"):
+        print("Usage: python esm_shards.py {init,work,launch,merge,status} [options]")
+        sys.exit(1)
+    command = argv[1]
+
+    if command in ("merge", "status"):
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--outdir", default="/home/anirudh/genomes/predicted/")
+        args = parser.parse_args(argv[2:])
+        merge_summaries(args.outdir) if command == "merge" else status(args.outdir)
+        return
+
+    parser = build_parser(f"ESMFold sharded runner: {command}")
+    parser.add_argument("--shards", type=int, default=1, help="Number of shards the input is split into")
+    parser.add_argument("--lease", type=float, default=1800, help="Seconds before an unrenewed claim is handed out again")
+    if command == "init":
+        args = parser.parse_args(argv[2:])
+        init_queue(args.input, args.outdir, args.shards, args.lease, log)
+    elif command == "work":
+        parser.add_argument("--worker-id", type=int, default=0)
+        parser.add_argument("--claim-size", type=int, default=256, help="Items leased per claim")
+        parser.add_argument("--poll", type=float, default=60, help="Seconds between queue checks while others finish")
+        work(parser.parse_args(argv[2:]), log)
+    else:
+        launcher = argparse.ArgumentParser(add_help=False)
+        launcher.add_argument("--input", default=parser.get_default("input"))
+        launcher.add_argument("--outdir", default=parser.get_default("outdir"))
+        launcher.add_argument("--devices", default="cuda:0", help="Comma-separated devices, one worker each")
+        launcher.add_argument("--workers", type=int, default=0, help="Workers to start; 0 = one per device")
+        launcher.add_argument("--lease", type=float, default=1800)
+        args, passthrough = launcher.parse_known_args(argv[2:])
+        sys.exit(launch(args, passthrough, log))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,149 @@
+# Small stand-in for the ESMFold model so the prediction loop can be exercised on CPU
+#
+# It mimics the parts of the esm.esmfold.v1 interface that esm_inference.py relies on
+# (infer / output_to_pdb / infer_pdbs / set_chunk_size) and returns tensors with the
+# same names and shapes, so batching, timeouts and bookkeeping run unchanged.
+
+import os
+
+import torch
+import torch.nn as nn
+
+
+AMINO_ACIDS = "ARNDCQEGHILKMFPSTWYV"
+THREE_LETTER = [
+    "ALA", "ARG", "ASN", "ASP", "CYS", "GLN", "GLU", "GLY", "HIS", "ILE",
+    "LEU", "LYS", "MET", "PHE", "PRO", "SER", "THR", "TRP", "TYR", "VAL",
+]
+
+
+class StandInFold(nn.Module):
+    """Tiny pair-representation model with ESMFold-shaped outputs."""
+
+    def __init__(self, dim=32, seed=0, memory_limit_mb=None):
+        super().__init__()
+        # simulated device memory: pair blocks larger than this raise an OOM error
+        self.memory_limit_mb = memory_limit_mb
+        torch.manual_seed(seed)
+        self.embed = nn.Embedding(len(AMINO_ACIDS) + 1, dim)
+        self.pair = nn.Linear(dim, dim)
+        self.to_xyz = nn.Linear(dim, 3)
+        self.to_plddt = nn.Linear(dim, 1)
+        self.chunk_size = None
+        self.recycling = None  # RecyclingPolicy set by esm_recycling.enable_adaptive_recycling
+        self.recycles_used = None
+
+    @property
+    def device(self):
+        return self.embed.weight.device
+
+    def set_chunk_size(self, chunk_size):
+        self.chunk_size = chunk_size
+
+    def encode(self, sequences):
+        longest = max(len(s) for s in sequences)
+        aatype = torch.full((len(sequences), longest), len(AMINO_ACIDS), dtype=torch.long)
+        mask = torch.zeros((len(sequences), longest))
+        for i, seq in enumerate(sequences):
+            aatype[i, :len(seq)] = torch.tensor([AMINO_ACIDS.find(a) % len(AMINO_ACIDS) for a in seq])
+            mask[i, :len(seq)] = 1
+        return aatype.to(self.device), mask.to(self.device)
+
+    def recycle(self, s, mask, step=0):
+        # O(L^2) pair update, so runtime grows with length like the real trunk; the
+        # update shrinks with every pass so the structure settles like ESMFold's does.
+        # With a chunk size the pair block is built that many rows at a time.
+        rows = self.chunk_size or s.shape[1]
+        if self.memory_limit_mb and s.shape[0] * rows * s.shape[1] * 4 / 1024**2 > self.memory_limit_mb:
+            raise torch.cuda.OutOfMemoryError("CUDA out of memory (stand-in memory limit)")
+        update = []
+        for start in range(0, s.shape[1], rows):
+            z = torch.einsum("bid,bjd->bij", s[:, start:start + rows], s) / s.shape[-1]
+            z = z.masked_fill(mask[:, None, :] == 0, -1e4).softmax(-1)
+            update.append(torch.einsum("bij,bjd->bid", z, s))
+        return s + 0.6 ** step * torch.tanh(self.pair(torch.cat(update, dim=1)))
+
+    def trace(self, s):
+        return torch.cumsum(torch.tanh(self.to_xyz(s)) * 3.8, dim=1)
+
+    @torch.no_grad()
+    def infer(self, sequences, num_recycles=None, **kwargs):
+        from esm_recycling import converged, masked_mean
+
+        if isinstance(sequences, str):
+            sequences = [sequences]
+        aatype, mask = self.encode(sequences)
+        s = self.embed(aatype)
+        policy = self.recycling
+        if policy is not None:
+            num_recycles = policy.max_recycles
+        prev = None
+        for step in range((num_recycles if num_recycles is not None else 3) + 1):
+            s = self.recycle(s, mask, step)
+            if policy is not None:
+                current = (self.trace(s), masked_mean(100 * torch.sigmoid(self.to_plddt(s))[..., 0], mask))
+                self.recycles_used = step
+                if step >= policy.min_recycles and converged(policy, prev, current, mask):
+                    break
+                prev = current
+
+        batch, length = aatype.shape
+        ca = self.trace(s)
+        positions = torch.zeros((1, batch, length, 14, 3), device=self.device)
+        positions[0, :, :, 1] = ca
+        atom37_exists = torch.zeros((batch, length, 37), device=self.device)
+        atom37_exists[:, :, 1] = mask
+        plddt = 100 * torch.sigmoid(self.to_plddt(s)).expand(-1, -1, 37) * atom37_exists
+        mean_plddt = plddt.sum(dim=(1, 2)) / atom37_exists.sum(dim=(1, 2))
+
+        return {
+            "positions": positions,
+            "aatype": aatype.clamp(max=len(AMINO_ACIDS) - 1),
+            "atom37_atom_exists": atom37_exists,
+            "residx_atom37_to_atom14": torch.zeros((batch, length, 37), dtype=torch.long, device=self.device),
+            "residue_index": torch.arange(length, device=self.device).expand(batch, -1),
+            "chain_index": torch.zeros((batch, length), dtype=torch.long, device=self.device),
+            "plddt": plddt,
+            "mean_plddt": mean_plddt,
+        }
+
+    def output_to_pdb(self, output):
+        return output_to_pdb(output)
+
+    def infer_pdbs(self, sequences, *args, **kwargs):
+        return self.output_to_pdb(self.infer(sequences, *args, **kwargs))
+
+    def infer_pdb(self, sequence, *args, **kwargs):
+        return self.infer_pdbs([sequence], *args, **kwargs)[0]
+
+
+def output_to_pdb(output):
+    """CA-only PDB text for every sequence in a stand-in output batch."""
+    positions = output["positions"][-1][:, :, 1].cpu()
+    exists = output["atom37_atom_exists"][:, :, 1].cpu()
+    plddt = output["plddt"][:, :, 1].cpu()
+    aatype = output["aatype"].cpu()
+
+    pdbs = []
+    for i in range(aatype.shape[0]):
+        lines = []
+        for j in range(aatype.shape[1]):
+            if exists[i, j] < 0.5:
+                continue
+            x, y, z = positions[i, j].tolist()
+            lines.append(
+                f"ATOM  {len(lines) + 1:>5}  CA  {THREE_LETTER[aatype[i, j]]} A{j + 1:>4}    "
+                f"{x:>8.3f}{y:>8.3f}{z:>8.3f}{1.0:>6.2f}{plddt[i, j].item():>6.2f}           C"
+            )
+        lines.append("END")
+        pdbs.append("\n".join(lines) + "\n")
+    return pdbs
+
+
+def esmfold_standin(dim=32):
+    """
+    Drop-in replacement for esm.pretrained.esmfold_v1() in CPU runs. Setting
+    ESM_STANDIN_MEMORY_MB simulates a device of that size for the OOM backoff path.
+    """
+    limit = os.environ.get("ESM_STANDIN_MEMORY_MB")
+    return StandInFold(dim=dim, memory_limit_mb=float(limit) if limit else None)
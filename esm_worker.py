@@ -0,0 +1,252 @@
+# Long-lived ESMFold worker process and the supervisor-side handle that drives it
+#
+# The worker loads the model once and folds batches it receives over a queue. The
+# supervisor (esm_inference.py) enforces the per-batch deadline: a stuck or crashed
+# worker is killed and respawned, so only the model load is repeated, not the run.
+# The worker only returns output arrays and pLDDT; PDB text is built by the supervisor
+# while the worker is already folding the next batch.
+
+import gc
+import time
+import contextlib
+import queue
+import resource
+import multiprocessing as mp
+
+import torch
+
+from esm_memory import is_oom
+
+
+# seconds allowed for the model to load in a fresh worker
+STARTUP_TIMEOUT = 1800
+# how often the supervisor checks that the worker is still alive while waiting
+POLL_INTERVAL = 5
+
+# model outputs needed to write PDBs; everything else stays in the worker
+STRUCTURE_KEYS = ("positions", "aatype", "atom37_atom_exists", "residx_atom37_to_atom14",
+                  "residue_index", "chain_index", "plddt")
+
+# --precision choices; anything but fp32 runs the forward pass under torch.autocast
+PRECISIONS = {"fp32": None, "fp16": torch.float16, "bf16": torch.bfloat16}
+
+
+class WorkerCrashed(RuntimeError):
+    """The worker process died while holding a batch."""
+
+
+class OutOfMemory(RuntimeError):
+    """The batch ran out of memory; the worker freed it and is still running."""
+
+
+def free_memory():
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def load_model(stand_in=False, device="cuda"):
+    """Load ESMFold (or the small CPU stand-in from esm_standin.py) in eval mode."""
+    if stand_in:
+        from esm_standin import esmfold_standin
+        model = esmfold_standin()
+    else:
+        import esm
+        model = esm.pretrained.esmfold_v1()
+    return model.eval().to(device)
+
+
+def move_model(model, device):
+    """Move the model; the ESM-2 language model runs in fp16 on the GPU and fp32 on the CPU."""
+    model.to(device)
+    if hasattr(model, "esm"):
+        model.esm.half() if on_cuda(device) else model.esm.float()
+    return model
+
+
+def on_cuda(device):
+    return torch.cuda.is_available() and torch.device(device).type == "cuda"
+
+
+def peak_memory_mb(device):
+    """Peak CUDA memory allocated since the last reset, or the process's peak RSS on CPU."""
+    if on_cuda(device):
+        return torch.cuda.max_memory_allocated(device) / 1024**2
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def autocast(device, precision):
+    dtype = PRECISIONS[precision]
+    device_type = torch.device(device).type
+    # the CPU autocast only supports bf16
+    if dtype is None or (device_type == "cpu" and dtype != torch.bfloat16):
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=device_type, dtype=dtype)
+
+
+def predict_batch(model, seqs, num_recycles, precision="fp32"):
+    """
+    Fold a list of sequences in one forward pass (under autocast for fp16/bf16).
+
+    Returns:
+        tuple: Compact output arrays (the inputs of output_to_pdb, with only the final
+        structure-module positions), the mean pLDDT of each sequence taken straight
+        from the model output, and a dict of batch stats (inference time, peak memory,
+        recycles actually run).
+    """
+    device = model.device
+    if on_cuda(device):
+        torch.cuda.reset_peak_memory_stats(device)
+    start = time.time()
+    with torch.no_grad(), autocast(device, precision):
+        output = model.infer(seqs, num_recycles=num_recycles)
+    output = {k: v.float() if torch.is_tensor(v) and v.is_floating_point() else v for k, v in output.items()}
+    structure = {k: output[k].cpu().numpy() for k in STRUCTURE_KEYS if k in output}
+    structure["positions"] = output["positions"][-1:].cpu().numpy()
+    stats = {
+        "infer_s": time.time() - start,
+        "peak_mem_mb": peak_memory_mb(device),
+        # adaptive recycling (esm_recycling.py) leaves the count it actually used on the model
+        "recycles": model.recycles_used if getattr(model, "recycling", None) else num_recycles,
+    }
+    return structure, output["mean_plddt"].tolist(), stats
+
+
+def structure_to_pdbs(structure, stand_in=False):
+    """PDB text for every sequence of a predict_batch() output; runs in the supervisor."""
+    if stand_in:
+        from esm_standin import output_to_pdb
+    else:
+        from esm.esmfold.v1.misc import output_to_pdb
+    return output_to_pdb({k: torch.from_numpy(v) for k, v in structure.items()})
+
+
+def worker_loop(tasks, results, stand_in, device, recycling=None, precision="fp32"):
+    """Child process: load the model once, then fold batches until a None task arrives."""
+    model = load_model(stand_in, device)
+    if recycling is not None:
+        from esm_recycling import enable_adaptive_recycling
+        enable_adaptive_recycling(model, recycling)
+    results.put(("ready", None, None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        batch_id, seqs, num_recycles, chunk_size, offload = task
+        results.put(("started", batch_id, None))
+        model.set_chunk_size(chunk_size)
+        if offload:
+            move_model(model, "cpu")
+        try:
+            structure, plddts, stats = predict_batch(model, seqs, num_recycles, precision)
+            stats.update(chunk_size=chunk_size, offload=offload)
+            results.put(("done", batch_id, (structure, plddts, stats)))
+        except Exception as e:
+            free_memory()  # only after a failure, e.g. to release memory after an OOM
+            results.put(("oom" if is_oom(e) else "error", batch_id, f"{type(e).__name__}: {e}"))
+        finally:
+            if offload:
+                move_model(model, device)
+
+
+class PredictionWorker:
+    """
+    Supervisor-side handle on one worker process.
+
+    Parameters:
+        stand_in (bool): Load the CPU stand-in model instead of ESMFold.
+        device (str): Torch device the worker places the model on.
+        timeout (int): Seconds a single batch may run before the worker is replaced.
+        log (callable): Message sink, e.g. esm_inference.log.
+        recycling (RecyclingPolicy, optional): Adaptive recycling bounds (esm_recycling.py);
+            None keeps the fixed count passed to predict().
+        precision (str): "fp32", or "fp16"/"bf16" to fold under torch.autocast.
+    """
+
+    def __init__(self, stand_in=False, device="cuda", timeout=420, log=print, recycling=None, precision="fp32"):
+        self.ctx = mp.get_context("spawn")  # CUDA cannot be re-initialised in a forked child
+        self.stand_in = stand_in
+        self.device = device
+        self.timeout = timeout
+        self.log = log
+        self.recycling = recycling
+        self.precision = precision
+        self.process = None
+        self.restarts = 0
+        self.batch_id = 0
+        self.started_at = None
+        self.start()
+
+    def start(self):
+        # fresh queues: a killed worker can leave the old ones in an unusable state
+        self.tasks = self.ctx.Queue()
+        self.results = self.ctx.Queue()
+        self.process = self.ctx.Process(
+            target=worker_loop,
+            args=(self.tasks, self.results, self.stand_in, self.device, self.recycling, self.precision),
+            daemon=True,
+        )
+        self.process.start()
+        self.log(f"Worker {self.process.pid} started, loading model...")
+        self._wait_for("ready", None, time.time() + STARTUP_TIMEOUT)
+        self.log(f"Worker {self.process.pid} ready.")
+
+    def restart(self):
+        self.log(f"Killing worker {self.process.pid} and starting a new one")
+        self.process.kill()
+        self.process.join()
+        self.restarts += 1
+        self.start()
+
+    def close(self):
+        if self.process is not None and self.process.is_alive():
+            self.tasks.put(None)
+            self.process.join(timeout=30)
+            if self.process.is_alive():
+                self.process.kill()
+        self.process = None
+
+    def _wait_for(self, kind, batch_id, deadline):
+        while True:
+            remaining = deadline - time.time() if deadline is not None else POLL_INTERVAL
+            if remaining <= 0:
+                raise TimeoutError(f"Took too long! (>{self.timeout} s)")
+            try:
+                msg_kind, msg_id, payload = self.results.get(timeout=min(remaining, POLL_INTERVAL))
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise WorkerCrashed(f"worker exited with code {self.process.exitcode}")
+                continue
+            if msg_id != batch_id:
+                continue  # stale message from an earlier batch
+            if msg_kind == "error":
+                raise RuntimeError(payload)
+            if msg_kind == "oom":
+                raise OutOfMemory(payload)
+            if msg_kind == kind:
+                return payload
+
+    def predict(self, seqs, num_recycles, chunk_size=None, offload=False, timeout=None):
+        """
+        Fold ``seqs`` in the worker and return predict_batch()'s (structure, plddts, stats).
+        ``started_at`` is set to the time the worker picked the batch up.
+
+        ``chunk_size`` sets the trunk's chunked attention for this batch, ``offload`` folds
+        it on the CPU and ``timeout`` overrides the worker's deadline (CPU folds are slow).
+
+        Raises TimeoutError if the batch runs past the deadline and WorkerCrashed if the
+        worker dies; in both cases a fresh worker is started before raising. Running out
+        of memory raises OutOfMemory, other model errors RuntimeError; both leave the
+        worker running.
+        """
+        self.batch_id += 1
+        self.tasks.put((self.batch_id, list(seqs), num_recycles, chunk_size, offload))
+        try:
+            # the deadline starts once the worker actually picks the batch up
+            self._wait_for("started", self.batch_id, None)
+            self.started_at = time.time()
+            return self._wait_for("done", self.batch_id, time.time() + (timeout or self.timeout))
+        except (TimeoutError, WorkerCrashed):
+            self.restart()
+            raise
@@ -0,0 +1,195 @@
+# One-pass assigned / unassigned split of the query proteins
+#
+# Replaces steps 3-4 of asgard_cluster_pipeline.sh (seqkit grep -v, the grep -c
+# counts, the sort -u duplicate check, the awk rename and seqkit seq -m 60): the
+# query FASTA is read once, every record is looked up in a hash set of the assigned
+# IDs and written to unassigned.faa and, if long enough, unassigned_60aa.faa.
+#
+# The assigned IDs come from the reference search result DB (query keys with at
+# least one hit, named through the query DB .lookup) so convertalis is not needed,
+# or from a file whose first column holds them (assigned.tsv / assigned_ids.txt).
+#
+# IDs are the first word of the header, as for seqkit grep and mmseqs createdb. A
+# repeated ID is renamed to <id>_dup<n> (the first occurrence keeps its ID) and the
+# rename is recorded in header_renames.tsv, instead of renaming every header to
+# unassigned_seq_N. All counts are written to partition_counts.tsv.
+#
+# Usage:
+#   python fasta_partition.py <query.faa> <output_dir> --ref-search <ref_search> --query-db <query_db> [--min-length 60]
+#   python fasta_partition.py <query.faa> <output_dir> --assigned-ids assigned_ids.txt [--min-length 60]
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from mmseqs_db import MMseqsDB, SequenceDB
+
+
+BUFFER = 1 << 24
+GAPS = b"- \t."  # seqkit's default --gap-letters
+COUNTS_NAME = "partition_counts.tsv"
+RENAMES_NAME = "header_renames.tsv"
+
+
+# =====================
+# Assigned IDs
+# =====================
+
+def assigned_from_result_db(ref_search, query_db):
+    """IDs of the queries with at least one hit in an MMseqs2 result database."""
+    with MMseqsDB(ref_search) as hits:
+        keys = hits.keys[hits.lengths > 1]  # entries that are more than their NUL
+    with SequenceDB(query_db) as queries:
+        return {queries.name(int(k)).encode() for k in keys}
+
+
+def assigned_from_file(path):
+    """IDs in the first column of a text / TSV file."""
+    ids = set()
+    with open(path, "rb") as f:
+        for line in f:
+            ident = line.split(b"\t", 1)[0].strip()
+            if ident:
+                ids.add(ident)
+    return ids
+
+
+def write_ids(ids, path):
+    with open(path, "wb") as f:
+        for ident in sorted(ids):
+            f.write(ident + b"\n")
+
+
+# =====================
+# Partitioning
+# =====================
+
+def iter_fasta(path):
+    """(header line, [sequence lines]) of each record, as bytes with their newlines."""
+    header, lines = None, []
+    with open(path, "rb", buffering=BUFFER) as f:
+        for line in f:
+            if line.startswith(b">"):
+                if header is not None:
+                    yield header, lines
+                header, lines = line, []
+            elif header is not None:
+                lines.append(line)
+    if header is not None:
+        yield header, lines
+
+
+def partition(query_faa, assigned, unassigned_faa, filtered_faa, renames_tsv, min_length=60):
+    """
+    Split ``query_faa`` by the ``assigned`` ID set in one pass.
+
+    Parameters:
+        query_faa (str): Query proteins.
+        assigned (set): Assigned IDs as bytes.
+        unassigned_faa (str): All unassigned records (original line layout).
+        filtered_faa (str): Unassigned records of at least ``min_length`` residues after
+            removing gap characters, with gaps removed and one sequence line.
+        renames_tsv (str): new_id / original_id / original_header of renamed records.
+        min_length (int): Length filter for ``filtered_faa``.
+
+    Returns:
+        dict: counts (total, assigned, unassigned, filtered, duplicate_ids, ...).
+    """
+    counts = dict(total=0, assigned=0, unassigned=0, filtered=0, duplicate_ids=0,
+                  assigned_ids=len(assigned), assigned_ids_not_in_fasta=0)
+    seen, found = set(), set()
+    with open(unassigned_faa, "wb", buffering=BUFFER) as unassigned, \
+            open(filtered_faa, "wb", buffering=BUFFER) as filtered, \
+            open(renames_tsv, "wb") as renames:
+        renames.write(b"new_id\toriginal_id\toriginal_header\n")
+        for header, lines in iter_fasta(query_faa):
+            counts["total"] += 1
+            fields = header[1:].rstrip(b"\r\n").split(None, 1)
+            ident = fields[0] if fields else b""
+            if ident in assigned:
+                counts["assigned"] += 1
+                found.add(ident)
+                continue
+
+            counts["unassigned"] += 1
+            if ident in seen:
+                counts["duplicate_ids"] += 1
+                n = 1
+                while ident + b"_dup%d" % n in seen:
+                    n += 1
+                new_id = ident + b"_dup%d" % n
+                renames.write(b"%s\t%s\t%s\n" % (new_id, ident, header[1:].rstrip(b"\r\n")))
+                header = b">" + new_id + (b" " + fields[1] if len(fields) > 1 else b"") + b"\n"
+                ident = new_id
+            seen.add(ident)
+
+            unassigned.write(header)
+            unassigned.writelines(lines)
+            sequence = b"".join(line.rstrip(b"\r\n") for line in lines).translate(None, GAPS)
+            if len(sequence) >= min_length:
+                counts["filtered"] += 1
+                filtered.write(header)
+                filtered.write(sequence + b"\n")
+    counts["assigned_ids_not_in_fasta"] = len(assigned) - len(found)
+    return counts
+
+
+def write_counts(counts, path):
+    pd.DataFrame(list(counts.items()), columns=["Count", "Value"]).to_csv(path, sep="\t", index=False)
+
+
+def read_counts(path):
+    """partition_counts.tsv as a dict."""
+    table = pd.read_csv(path, sep="\t")
+    return dict(zip(table["Count"], table["Value"].astype(np.int64)))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Split the query proteins into assigned and unassigned in one pass.")
+    parser.add_argument("query_faa")
+    parser.add_argument("outdir", help="Pipeline output directory (assigned/ and unassigned/ are written there)")
+    parser.add_argument("--ref-search", help="Reference search result DB")
+    parser.add_argument("--query-db", help="Query sequence DB of the search (for the .lookup names)")
+    parser.add_argument("--assigned-ids", help="File with the assigned IDs in its first column")
+    parser.add_argument("--min-length", type=int, default=60)
+    args = parser.parse_args(argv[1:])
+
+    assigned_dir = os.path.join(args.outdir, "assigned")
+    unassigned_dir = os.path.join(args.outdir, "unassigned")
+    os.makedirs(assigned_dir, exist_ok=True)
+    os.makedirs(unassigned_dir, exist_ok=True)
+
+    start = time.time()
+    if args.ref_search and args.query_db:
+        assigned = assigned_from_result_db(args.ref_search, args.query_db)
+        write_ids(assigned, os.path.join(assigned_dir, "assigned_ids.txt"))
+    elif args.assigned_ids:
+        assigned = assigned_from_file(args.assigned_ids)
+    else:
+        parser.error("give --ref-search and --query-db, or --assigned-ids")
+    print(f"[DEBUG] Assigned IDs: {len(assigned)}")
+
+    counts = partition(args.query_faa, assigned,
+                       os.path.join(unassigned_dir, "unassigned.faa"),
+                       os.path.join(unassigned_dir, f"unassigned_{args.min_length}aa.faa"),
+                       os.path.join(unassigned_dir, RENAMES_NAME),
+                       args.min_length)
+    write_counts(counts, os.path.join(unassigned_dir, COUNTS_NAME))
+
+    print(f"[DEBUG] Query proteins: {counts['total']}")
+    print(f"[DEBUG] Assigned proteins: {counts['assigned']}")
+    print(f"[DEBUG] Unassigned proteins: {counts['unassigned']}")
+    print(f"[DEBUG] Filtered unassigned sequences (>= {args.min_length} aa): {counts['filtered']}")
+    if counts["duplicate_ids"]:
+        print(f"[WARNING] {counts['duplicate_ids']} duplicate IDs renamed; see {os.path.join(unassigned_dir, RENAMES_NAME)}")
+    if counts["assigned_ids_not_in_fasta"]:
+        print(f"[WARNING] {counts['assigned_ids_not_in_fasta']} assigned IDs not found in {args.query_faa}")
+    print(f"[DEBUG] Partitioned in {time.time() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -11,7 +11,7 @@ import os
 import shutil
 
 
-def filter_genomes(file, level):
+def filter_genomes(file, level, max_contamination=10, plot=True):
     """Filter genomes analyzed using CheckM2 based on completeness and contamination."""
 
     print(f"\n[DEBUG] Reading CheckM2 results from: {file}")
@@ -30,7 +30,7 @@ def filter_genomes(file, level):
     quality['Contamination'] = quality['Contamination'].astype(float)
 
     # Filtering flags
-    quality['Contaminated'] = quality['Contamination'] > 10
+    quality['Contaminated'] = quality['Contamination'] > max_contamination
     quality['Incomplete'] = quality['Completeness'] < int(level)
     quality['Selected'] = (~quality['Contaminated']) & (~quality['Incomplete'])
 
@@ -38,7 +38,7 @@ def filter_genomes(file, level):
     quality['GQS'] = quality['Completeness'] - 5 * quality['Contamination']
 
     filtered = quality[quality['Selected']]
-    print(f"[DEBUG] Number of genomes passing filter (Completeness ≥ {level}, Contamination ≤ 10): {len(filtered)}")
+    print(f"[DEBUG] Number of genomes passing filter (Completeness ≥ {level}, Contamination ≤ {max_contamination}): {len(filtered)}")
 
     # Plot bar chart summary
     counts = {
@@ -47,11 +47,12 @@ def filter_genomes(file, level):
         'Incomplete': quality['Incomplete'].sum()
     }
 
-    plt.figure(figsize=(8, 6))
-    plt.bar(counts.keys(), counts.values(), color=['blue', 'red', 'green'])
-    plt.ylabel('Count')
-    plt.title('Genome Quality Categories')
-    plt.show()
+    if plot:
+        plt.figure(figsize=(8, 6))
+        plt.bar(counts.keys(), counts.values(), color=['blue', 'red', 'green'])
+        plt.ylabel('Count')
+        plt.title('Genome Quality Categories')
+        plt.show()
 
     return filtered
 
@@ -1,127 +1,280 @@
 #!/usr/bin/env python3
-import sys
+# Summary statistics of an asgard_cluster_pipeline.sh run
+#
+# Every metric is computed in one streaming pass over its input, or read straight
+# from an MMseqs2 .index file (one line per database entry) when the database is
+# there. Distinct IDs are counted from 64-bit hashes, so memory stays at 8 bytes per
+# ID however long the names are. Each metric reports the file it came from and how
+# long it took; a metric whose inputs are missing or unreadable is reported as n/a
+# with the reason, never as 0.
+#
+# Usage:
+#   python mmseqs_clustering_summary.py <output_dir> [--strict]
+
 import os
+import sys
+import time
+import argparse
+
+import numpy as np
 import pandas as pd
 
-if len(sys.argv) < 2:
-    print("Usage: python generate_summary.py <output_dir>")
-    sys.exit(1)
+from mmseqs_db import read_dbtype, data_files
+from fasta_partition import read_counts, COUNTS_NAME
 
-outdir = sys.argv[1]
-assigned_dir = os.path.join(outdir, "assigned")
-unassigned_dir = os.path.join(outdir, "unassigned")
-denovo_dir = os.path.join(outdir, "denovo")
-searches_dir = os.path.join(outdir, "searches")
 
-print("[8] Generating summary statistics...")
+BLOCK = 1 << 24
+CHUNK_ROWS = 2_000_000
 
-def count_lines(filepath, grep_fasta=False):
-    """Count lines in file, optionally counting only FASTA headers."""
-    if not os.path.isfile(filepath):
-        return 0
-    if grep_fasta:
-        return sum(1 for line in open(filepath, "r", encoding="utf-8", errors='ignore') if line.startswith(">"))
-    return sum(1 for _ in open(filepath, "r", encoding="utf-8", errors='ignore'))
 
-def count_unique_headers(fasta_file):
-    """Count unique headers in FASTA file."""
-    if not os.path.isfile(fasta_file):
+class Unavailable(Exception):
+    """A metric could not be computed from any of its inputs."""
+
+
+# =====================
+# Streaming counters
+# =====================
+
+def count_lines(path):
+    """Lines in a text file, counting a last line without a newline."""
+    lines, last = 0, b"\n"
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK), b""):
+            lines += block.count(b"\n")
+            last = block[-1:]
+    return lines + (last != b"\n")
+
+
+def count_fasta_headers(path):
+    """Number of '>' header lines in a FASTA file."""
+    headers, previous = 0, b"\n"
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK), b""):
+            headers += (previous + block).count(b"\n>")
+            previous = block[-1:]
+    return headers
+
+
+def index_entries(db):
+    """Entries of an MMseqs2 database, from its .index file."""
+    return count_lines(db + ".index")
+
+
+def nonempty_index_entries(db):
+    """Entries of an MMseqs2 result database that hold at least one hit (length > 1: not just the NUL)."""
+    n = 0
+    for chunk in pd.read_csv(db + ".index", sep="\t", header=None, usecols=[2], chunksize=CHUNK_ROWS):
+        n += int((chunk[2] > 1).sum())
+    return n
+
+
+def distinct(hash_chunks):
+    """Number of distinct values over chunks of 64-bit hashes."""
+    uniques = [np.unique(h) for h in hash_chunks]
+    return len(np.unique(np.concatenate(uniques))) if uniques else 0
+
+
+def distinct_in_columns(tsv, columns):
+    """
+    Distinct values of each of ``columns`` (0-based) of a headerless TSV, in one pass.
+
+    Returns:
+        list: one count per column.
+    """
+    if os.path.getsize(tsv) == 0:  # the pipeline touches an empty TSV when there is nothing to cluster
+        return [0 for _ in columns]
+    hashes = [[] for _ in columns]
+    for chunk in pd.read_csv(tsv, sep="\t", header=None, usecols=columns, dtype=str, chunksize=CHUNK_ROWS):
+        for i, col in enumerate(columns):
+            hashes[i].append(np.unique(pd.util.hash_array(chunk[col].to_numpy())))
+    return [distinct(h) for h in hashes]
+
+
+class NulStripped:
+    """Binary file wrapper that drops the NUL entry separators of an MMseqs2 data file."""
+
+    def __init__(self, f):
+        self.f = f
+
+    def read(self, size=-1):
+        return self.f.read(size).replace(b"\0", b"")
+
+    def __iter__(self):
+        return iter(lambda: self.read(BLOCK), b"")
+
+
+def partition_count(name):
+    """Counter reading one value of fasta_partition.py's partition_counts.tsv."""
+    def count(path):
+        counts = read_counts(path)
+        if name not in counts:
+            raise Unavailable(f"no '{name}' in {path}")
+        return int(counts[name])
+    return count
+
+
+def result_db_targets(db):
+    """Distinct target keys (first field of every hit) in an MMseqs2 result database."""
+    if read_dbtype(db)[1]:
+        raise Unavailable(f"{db} is compressed")
+    parts = data_files(db)
+    if sum(os.path.getsize(p) for p in parts) == count_lines(db + ".index"):  # nothing but NUL separators
         return 0
-    headers = set()
-    with open(fasta_file, "r", encoding="utf-8", errors='ignore') as f:
-        for line in f:
-            if line.startswith(">"):
-                headers.add(line.strip())
-    return len(headers)
-
-# --- Basic counts ---
-# Total query proteins from original FASTA or query DB
-query_fasta = os.path.join(searches_dir, "query_db")
-if os.path.exists(query_fasta):
-    # Try to get sequence count from MMseqs2 DB
-    try:
-        result = os.popen(f"mmseqs stats {query_fasta} 2>/dev/null | grep 'Entries:'").read()
-        total_query = int(result.split(":")[1].strip()) if "Entries:" in result else 0
-    except:
-        total_query = 0
-else:
-    # Fallback: count from assigned and unassigned
-    assigned_count = count_lines(os.path.join(assigned_dir, "assigned_ids.txt"))
-    unassigned_count = count_lines(os.path.join(unassigned_dir, "unassigned_headers.txt"))
-    total_query = assigned_count + unassigned_count
-
-# Assigned proteins
-assigned_count = count_lines(os.path.join(assigned_dir, "assigned_ids.txt"))
-
-# Unassigned proteins
-unassigned_headers_file = os.path.join(unassigned_dir, "unassigned_headers.txt")
-if os.path.exists(unassigned_headers_file):
-    unassigned_count = count_lines(unassigned_headers_file)
-else:
-    unassigned_count = count_lines(os.path.join(unassigned_dir, "unassigned.faa"), grep_fasta=True)
-
-# Filtered unassigned
-filtered_unassigned_count = count_lines(os.path.join(unassigned_dir, "unassigned_60aa.faa"), grep_fasta=True)
-
-# --- Assigned clusters ---
-assigned_tsv = os.path.join(searches_dir, "ref_search.tsv")
-if os.path.isfile(assigned_tsv):
-    try:
-        df_assigned = pd.read_csv(assigned_tsv, sep="\t", header=None, usecols=[1])
-        assigned_clusters = df_assigned[1].nunique()
-    except:
-        assigned_clusters = 0
-else:
-    assigned_clusters = 0
-
-# --- De novo clusters ---
-denovo_tsv = os.path.join(denovo_dir, "denovo_clu.tsv")
-if os.path.isfile(denovo_tsv):
-    try:
-        df_denovo = pd.read_csv(denovo_tsv, sep="\t", header=None, names=["cluster", "protein"])
-        denovo_clusters = df_denovo["cluster"].nunique()
-        denovo_proteins_clustered = df_denovo["protein"].nunique()
-    except:
-        denovo_clusters = 0
-        denovo_proteins_clustered = 0
-else:
-    denovo_clusters = 0
-    denovo_proteins_clustered = 0
-
-# --- Percentages ---
-assigned_pct = (assigned_count / total_query * 100) if total_query > 0 else 0
-unassigned_pct = (unassigned_count / total_query * 100) if total_query > 0 else 0
-
-# --- Print formatted summary ---
-print("\n========================================")
-print("📊 Asgard Clustering Summary Statistics")
-print("========================================")
-print(f"{'Category':<50}{'Count':>15}{'%':>10}")
-print("-" * 75)
-print(f"{'Total query proteins':<50}{total_query:>15}{'-':>10}")
-print(f"{'Proteins assigned to reference clusters':<50}{assigned_count:>15}{assigned_pct:>10.2f}")
-print(f"{'Unique reference clusters hit (assigned)':<50}{assigned_clusters:>15}{'-':>10}")
-print(f"{'Unassigned proteins (no reference hit)':<50}{unassigned_count:>15}{unassigned_pct:>10.2f}")
-print(f"{'Filtered unassigned proteins (≥60 aa)':<50}{filtered_unassigned_count:>15}{'-':>10}")
-print(f"{'De novo clusters formed (unassigned)':<50}{denovo_clusters:>15}{'-':>10}")
-print(f"{'Proteins in de novo clusters':<50}{denovo_proteins_clustered:>15}{'-':>10}")
-print("========================================\n")
-
-# --- Export TSV ---
-summary_tsv = os.path.join(outdir, "asgard_clustering_summary.tsv")
-summary_data = [
-    ["Total_query_proteins", total_query, "-"],
-    ["Proteins_assigned_to_reference_clusters", assigned_count, f"{assigned_pct:.2f}"],
-    ["Unique_reference_clusters_hit", assigned_clusters, "-"],
-    ["Unassigned_proteins", unassigned_count, f"{unassigned_pct:.2f}"],
-    ["Filtered_unassigned_proteins_60aa", filtered_unassigned_count, "-"],
-    ["De_novo_clusters_formed", denovo_clusters, "-"],
-    ["Proteins_in_de_novo_clusters", denovo_proteins_clustered, "-"],
-]
-
-pd.DataFrame(summary_data, columns=["Category", "Count", "Percent"]).to_csv(
-    summary_tsv, sep="\t", index=False
-)
-
-print(f"[DEBUG] Summary table saved to: {summary_tsv}")
-print(f"✅ Done! All results and statistics are available in: {outdir}")
\ No newline at end of file
+    keys = []
+    for part in parts:
+        if not os.path.getsize(part):
+            continue
+        with open(part, "rb") as f:
+            for chunk in pd.read_csv(NulStripped(f), sep="\t", header=None, usecols=[0], chunksize=CHUNK_ROWS):
+                keys.append(np.unique(chunk[0].to_numpy()))
+    return len(np.unique(np.concatenate(keys))) if keys else 0
+
+
+# =====================
+# Metrics
+# =====================
+
+class Metric:
+    def __init__(self, key, label, value=None, source=None, seconds=0.0, reason=None):
+        self.key, self.label, self.value = key, label, value
+        self.source, self.seconds, self.reason = source, seconds, reason
+
+
+def measure(key, label, candidates):
+    """
+    Compute a metric from the first candidate (path, function) whose path exists.
+    Unreadable inputs are reported, not turned into zeros.
+    """
+    reasons = []
+    for path, func in candidates:
+        if not os.path.exists(path):
+            reasons.append(f"{path} not found")
+            continue
+        start = time.time()
+        try:
+            value = func(path)
+        except (OSError, ValueError, Unavailable, pd.errors.ParserError) as e:
+            reasons.append(f"{path}: {e}")
+            continue
+        return Metric(key, label, value, path, time.time() - start)
+    return Metric(key, label, reason="; ".join(reasons))
+
+
+def summarise(outdir):
+    assigned_dir = os.path.join(outdir, "assigned")
+    unassigned_dir = os.path.join(outdir, "unassigned")
+    denovo_dir = os.path.join(outdir, "denovo")
+    searches_dir = os.path.join(outdir, "searches")
+
+    query_db = os.path.join(searches_dir, "query_db")
+    ref_search = os.path.join(searches_dir, "ref_search")
+    unassigned_60aa_db = os.path.join(unassigned_dir, "unassigned_60aa_db")
+    denovo_clu = os.path.join(denovo_dir, "denovo_clu")
+    denovo_tsv = os.path.join(denovo_dir, "denovo_clu.tsv")
+
+    metrics = [
+        measure("assigned", "Proteins assigned to reference clusters", [
+            # records, like "unassigned" below; assigned_ids.txt holds distinct IDs
+            (os.path.join(unassigned_dir, COUNTS_NAME), partition_count("assigned")),
+            (os.path.join(assigned_dir, "assigned_ids.txt"), count_lines),
+            (ref_search + ".index", lambda p: nonempty_index_entries(ref_search)),
+        ]),
+        measure("assigned_clusters", "Unique reference clusters hit (assigned)", [
+            (ref_search + ".tsv", lambda p: distinct_in_columns(p, [1])[0]),
+            (ref_search + ".index", lambda p: result_db_targets(ref_search)),
+        ]),
+        measure("unassigned", "Unassigned proteins (no reference hit)", [
+            (os.path.join(unassigned_dir, COUNTS_NAME), partition_count("unassigned")),
+            (os.path.join(unassigned_dir, "unassigned_headers.txt"), count_lines),
+            (os.path.join(unassigned_dir, "unassigned.faa"), count_fasta_headers),
+        ]),
+        measure("filtered_unassigned", "Filtered unassigned proteins (≥60 aa)", [
+            (unassigned_60aa_db + ".index", lambda p: index_entries(unassigned_60aa_db)),
+            (os.path.join(unassigned_dir, COUNTS_NAME), partition_count("filtered")),
+            (os.path.join(unassigned_dir, "unassigned_60aa.faa"), count_fasta_headers),
+        ]),
+        measure("denovo_clusters", "De novo clusters formed (unassigned)", [
+            (denovo_clu + ".index", lambda p: index_entries(denovo_clu)),
+            (denovo_tsv, lambda p: distinct_in_columns(p, [0])[0]),
+        ]),
+        measure("denovo_proteins", "Proteins in de novo clusters", [
+            (denovo_tsv, lambda p: distinct_in_columns(p, [1])[0]),
+        ]),
+    ]
+    by_key = {m.key: m for m in metrics}
+
+    total = measure("total_query", "Total query proteins", [
+        (query_db + ".index", lambda p: index_entries(query_db)),
+    ])
+    if total.value is None and by_key["assigned"].value is not None and by_key["unassigned"].value is not None:
+        # no query DB: assigned + unassigned
+        total = Metric("total_query", total.label, by_key["assigned"].value + by_key["unassigned"].value,
+                       "assigned + unassigned", by_key["assigned"].seconds + by_key["unassigned"].seconds)
+    return [total] + metrics
+
+
+def percent(metric, total):
+    if metric.key not in ("assigned", "unassigned") or metric.value is None or not total.value:
+        return None
+    return metric.value / total.value * 100
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Summary statistics of an Asgard clustering run.")
+    parser.add_argument("outdir")
+    parser.add_argument("--strict", action="store_true", help="Exit with an error if any metric is unavailable")
+    args = parser.parse_args(argv[1:])
+
+    print("[8] Generating summary statistics...")
+    start = time.time()
+    metrics = summarise(args.outdir)
+    total = metrics[0]
+
+    print("\n========================================")
+    print("📊 Asgard Clustering Summary Statistics")
+    print("========================================")
+    print(f"{'Category':<50}{'Count':>15}{'%':>10}")
+    print("-" * 75)
+    for m in metrics:
+        pct = percent(m, total)
+        value = "n/a" if m.value is None else m.value
+        print(f"{m.label:<50}{value:>15}{'-' if pct is None else f'{pct:.2f}':>10}")
+    print("========================================\n")
+
+    print(f"{'Metric':<50}{'Source':<45}{'s':>8}")
+    for m in metrics:
+        source = "n/a" if m.source is None else os.path.relpath(m.source, args.outdir) if os.path.exists(m.source) else m.source
+        print(f"{m.key:<50}{source:<45}{m.seconds:>8.2f}")
+    missing = [m for m in metrics if m.value is None]
+    for m in missing:
+        print(f"[WARNING] {m.label}: unavailable ({m.reason})", file=sys.stderr)
+    print(f"Summary computed in {time.time() - start:.2f} s")
+
+    # --- Export TSV ---
+    summary_tsv = os.path.join(args.outdir, "asgard_clustering_summary.tsv")
+    keys = {
+        "total_query": "Total_query_proteins",
+        "assigned": "Proteins_assigned_to_reference_clusters",
+        "assigned_clusters": "Unique_reference_clusters_hit",
+        "unassigned": "Unassigned_proteins",
+        "filtered_unassigned": "Filtered_unassigned_proteins_60aa",
+        "denovo_clusters": "De_novo_clusters_formed",
+        "denovo_proteins": "Proteins_in_de_novo_clusters",
+    }
+    summary_data = []
+    for m in metrics:
+        pct = percent(m, total)
+        summary_data.append([keys[m.key], "NA" if m.value is None else m.value,
+                             "-" if pct is None else f"{pct:.2f}", m.source or "NA", round(m.seconds, 3)])
+    pd.DataFrame(summary_data, columns=["Category", "Count", "Percent", "Source", "Seconds"]).to_csv(
+        summary_tsv, sep="\t", index=False
+    )
+
+    print(f"[DEBUG] Summary table saved to: {summary_tsv}")
+    print(f"✅ Done! All results and statistics are available in: {args.outdir}")
+    if args.strict and missing:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,399 @@
+# Memory-mapped reader for MMseqs2 databases
+#
+# An MMseqs2 database is a data file of NUL-terminated entries plus a .index file
+# ("key<TAB>offset<TAB>length", length counting the NUL) and a 4-byte .dbtype.
+# Sequence databases from createdb also have headers in <db>_h and accessions in
+# <db>.lookup. This module maps the data files and looks entries up by key, so
+# sequences, headers, cluster members and alignments are read straight from the
+# files asgard_cluster_pipeline.sh already has, without convertalis / createtsv /
+# result2repseq / convert2fasta round trips. Databases split into <db>.0, <db>.1, ...
+# are read as one. Compressed databases (createdb --compressed 1) are not supported:
+# run `mmseqs decompress` first.
+#
+# write_db() / write_sequence_db() create small databases in the same format.
+#
+# Usage:
+#   python mmseqs_db.py info <db>
+#   python mmseqs_db.py get <db> <key> [<key> ...]
+#   python mmseqs_db.py select-clusters <seq_db> <cluster_db> <out_dir> [--min-size 5]
+#   python mmseqs_db.py reps <seq_db> <cluster_db> <out.faa> [--append]
+#   python mmseqs_db.py selftest
+
+import os
+import sys
+import mmap
+import shutil
+import argparse
+import tempfile
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+
+# Parameters::DBTYPE_* in MMseqs2
+DBTYPES = {
+    0: "amino acids", 1: "nucleotides", 2: "HMM profile", 5: "alignment result", 6: "cluster result",
+    7: "prefilter result", 8: "taxonomy result", 9: "index", 10: "CA3M", 11: "MSA", 12: "generic",
+    13: "omit", 14: "prefilter reverse result", 15: "offset", 16: "directional",
+}
+DBTYPE_AMINO_ACIDS = 0
+DBTYPE_ALIGNMENT_RES = 5
+DBTYPE_CLUSTER_RES = 6
+DBTYPE_GENERIC = 12
+EXTENDED_COMPRESSED = 1  # in the upper 16 bits of the dbtype
+
+# one line of an alignment result (convertalis columns target, bits, fident, evalue, ...)
+Alignment = namedtuple("Alignment", ["target", "score", "seq_id", "evalue", "q_start", "q_end", "q_len",
+                                     "t_start", "t_end", "t_len", "backtrace"])
+
+
+def read_dbtype(path):
+    """(base dbtype, compressed) of a database."""
+    with open(path + ".dbtype", "rb") as f:
+        dbtype = int.from_bytes(f.read(4), "little")
+    return dbtype & 0xFFFF, bool((dbtype >> 16) & EXTENDED_COMPRESSED)
+
+
+def data_files(path):
+    """The data file of a database, or its numbered parts <db>.0, <db>.1, ..."""
+    if os.path.exists(path):
+        return [path]
+    parts, i = [], 0
+    while os.path.exists(f"{path}.{i}"):
+        parts.append(f"{path}.{i}")
+        i += 1
+    if not parts:
+        raise FileNotFoundError(f"No data file for MMseqs2 database {path}")
+    return parts
+
+
+class MMseqsDB:
+    """
+    Read-only, memory-mapped MMseqs2 database.
+
+    Parameters:
+        path (str): Database path as given to mmseqs (without .index/.dbtype).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.dbtype, compressed = read_dbtype(path) if os.path.exists(path + ".dbtype") else (DBTYPE_GENERIC, False)
+        if compressed:
+            raise ValueError(f"{path} is compressed; run `mmseqs decompress {path} <out>` first")
+
+        index = pd.read_csv(path + ".index", sep="\t", header=None, names=["key", "offset", "length"],
+                            dtype=np.int64) if os.path.getsize(path + ".index") else None
+        if index is None:
+            self.keys = self.offsets = self.lengths = np.zeros(0, dtype=np.int64)
+        else:
+            index = index.sort_values("key", kind="stable")
+            self.keys, self.offsets, self.lengths = (index[c].to_numpy() for c in ("key", "offset", "length"))
+
+        self._files, self._maps, starts = [], [], [0]
+        for name in data_files(path):
+            f = open(name, "rb")
+            self._files.append(f)
+            size = os.path.getsize(name)
+            self._maps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b"")
+            starts.append(starts[-1] + size)
+        # offsets of split databases run on across the parts
+        self._starts = np.array(starts, dtype=np.int64)
+
+    @property
+    def type_name(self):
+        return DBTYPES.get(self.dbtype, str(self.dbtype))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        i = np.searchsorted(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def _position(self, key):
+        i = int(np.searchsorted(self.keys, key))
+        if i >= len(self.keys) or self.keys[i] != key:
+            raise KeyError(key)
+        return i
+
+    def raw(self, key):
+        """Entry ``key`` without its NUL terminator, as a zero-copy memoryview of the data file."""
+        i = self._position(key)
+        offset, length = int(self.offsets[i]), int(self.lengths[i])
+        part = int(np.searchsorted(self._starts, offset, side="right")) - 1
+        offset -= int(self._starts[part])
+        return memoryview(self._maps[part])[offset:offset + max(length - 1, 0)]
+
+    def get(self, key):
+        return bytes(self.raw(key)).decode()
+
+    def lines(self, key):
+        return [line for line in self.get(key).split("\n") if line]
+
+    def __iter__(self):
+        return iter(int(k) for k in self.keys)
+
+    def items(self):
+        for key in self:
+            yield key, self.raw(key)
+
+    def entry_sizes(self):
+        """key -> entry length in bytes (NUL excluded), from the index alone."""
+        return pd.Series(self.lengths - 1, index=self.keys)
+
+    def close(self):
+        for m in self._maps:
+            if isinstance(m, mmap.mmap):
+                m.close()
+        for f in self._files:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SequenceDB(MMseqsDB):
+    """
+    Sequence database from createdb, with its headers (<db>_h) and accessions (<db>.lookup).
+
+    Parameters:
+        path (str): Database path.
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.headers = MMseqsDB(path + "_h") if os.path.exists(path + "_h.index") else None
+        self._names = None
+
+    def sequence(self, key):
+        return self.get(key).rstrip("\n")
+
+    def header(self, key):
+        if self.headers is None:
+            raise KeyError(f"{self.path} has no header database")
+        return self.headers.get(key).rstrip("\n")
+
+    def name(self, key):
+        """Accession of an entry: from the .lookup file, else the first word of its header."""
+        names = self.names()
+        if key in names:
+            return names[key]
+        return self.header(key).split()[0]
+
+    def names(self):
+        """key -> accession from the .lookup file (empty if there is none)."""
+        if self._names is None:
+            self._names = {}
+            lookup = self.path + ".lookup"
+            if os.path.exists(lookup) and os.path.getsize(lookup):
+                table = pd.read_csv(lookup, sep="\t", header=None, usecols=[0, 1], names=["key", "name"],
+                                    dtype={"key": np.int64, "name": str}, quoting=3)
+                self._names = dict(zip(table["key"], table["name"]))
+        return self._names
+
+    def key_of(self, name):
+        """Key of an accession (builds the reverse lookup on first use)."""
+        if not hasattr(self, "_keys_by_name"):
+            self._keys_by_name = {v: k for k, v in self.names().items()}
+        return self._keys_by_name[name]
+
+    def close(self):
+        super().close()
+        if self.headers is not None:
+            self.headers.close()
+
+
+# =====================
+# Result entries
+# =====================
+
+def cluster_members(db, key):
+    """Member keys of the cluster represented by ``key`` in a cluster result database."""
+    return [int(line) for line in db.lines(key)]
+
+
+def cluster_sizes(db):
+    """representative key -> number of members, without reading the members (one line each)."""
+    sizes = {}
+    for key, entry in db.items():
+        sizes[key] = bytes(entry).count(b"\n")
+    return pd.Series(sizes, dtype="int64")
+
+
+def alignments(db, key):
+    """Alignment result lines of query ``key`` as Alignment tuples (backtrace None if absent)."""
+    hits = []
+    for line in db.lines(key):
+        f = line.split("\t")
+        hits.append(Alignment(int(f[0]), int(f[1]), float(f[2]), float(f[3]),
+                              *(int(v) for v in f[4:10]), f[10] if len(f) > 10 else None))
+    return hits
+
+
+# =====================
+# Writing
+# =====================
+
+def write_db(path, entries, dbtype=DBTYPE_GENERIC):
+    """
+    Write a database from (key, text) pairs; each entry gets its NUL terminator.
+    Sequence and header entries are expected to end with a newline, as mmseqs writes them.
+    """
+    with open(path, "wb") as data, open(path + ".index", "w") as index:
+        offset = 0
+        for key, text in entries:
+            payload = (text.encode() if isinstance(text, str) else bytes(text)) + b"\0"
+            data.write(payload)
+            index.write(f"{key}\t{offset}\t{len(payload)}\n")
+            offset += len(payload)
+    with open(path + ".dbtype", "wb") as f:
+        f.write(int(dbtype).to_bytes(4, "little"))
+
+
+def write_sequence_db(path, records, dbtype=DBTYPE_AMINO_ACIDS):
+    """Write a createdb-style sequence database (<db>, <db>_h, <db>.lookup) from (header, sequence) pairs."""
+    records = list(records)
+    write_db(path, ((i, seq + "\n") for i, (_, seq) in enumerate(records)), dbtype)
+    write_db(path + "_h", ((i, header + "\n") for i, (header, _) in enumerate(records)), DBTYPE_GENERIC)
+    with open(path + ".lookup", "w") as f:
+        for i, (header, _) in enumerate(records):
+            f.write(f"{i}\t{header.split()[0]}\t0\n")
+
+
+# =====================
+# Cluster selection
+# =====================
+
+def select_clusters(seq_db, cluster_db, out_dir, min_size=5):
+    """
+    cluster_selection.sh without the text exports: write cluster_sizes.txt
+    ("<size> <representative>"), large_clusters.txt (representatives of clusters with at
+    least ``min_size`` members) and denovo_reps_large.faa straight from the databases.
+
+    Returns:
+        (int, int): number of clusters, number of large clusters.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    with SequenceDB(seq_db) as seqs, MMseqsDB(cluster_db) as clusters:
+        sizes = cluster_sizes(clusters)
+        names = pd.Series([seqs.name(k) for k in sizes.index], index=sizes.index)
+        order = names.sort_values(kind="stable").index
+        with open(os.path.join(out_dir, "cluster_sizes.txt"), "w") as f:
+            for key in order:
+                f.write(f"{sizes[key]} {names[key]}\n")
+        large = [key for key in order if sizes[key] >= min_size]
+        with open(os.path.join(out_dir, "large_clusters.txt"), "w") as f:
+            for key in large:
+                f.write(f"{names[key]}\n")
+        with open(os.path.join(out_dir, "denovo_reps_large.faa"), "w") as f:
+            for key in large:
+                f.write(f">{seqs.header(key)}\n{seqs.sequence(key)}\n")
+    return len(sizes), len(large)
+
+
+def write_representatives(seq_db, cluster_db, out_fasta, append=False):
+    """
+    result2repseq + convert2fasta in one pass: the representative of every cluster as
+    FASTA, in cluster key order, without the intermediate representative database.
+
+    Returns:
+        int: Number of representatives written.
+    """
+    with SequenceDB(seq_db) as seqs, MMseqsDB(cluster_db) as clusters, open(out_fasta, "a" if append else "w") as f:
+        for key in clusters:
+            f.write(f">{seqs.header(key)}\n{seqs.sequence(key)}\n")
+        return len(clusters)
+
+
+def selftest():
+    """Round trip through small databases written by this module; raises AssertionError on a mismatch."""
+    tmp = tempfile.mkdtemp(prefix="mmseqs_db_")
+    try:
+        seq_db, cluster_db, result_db = (os.path.join(tmp, n) for n in ("seqs", "clu", "aln"))
+        records = [(f"p{i} protein {i}", "M" + "K" * i) for i in range(7)]
+        write_sequence_db(seq_db, records)
+        # clusters: rep 0 -> 0,1,2,3,4 ; rep 5 -> 5,6 (members start with the representative)
+        write_db(cluster_db, [(0, "0\n1\n2\n3\n4\n"), (5, "5\n6\n")], DBTYPE_CLUSTER_RES)
+        write_db(result_db, [(0, "5\t40\t0.900\t1.0E-05\t1\t1\t1\t1\t1\t6\t1M\n"), (1, "")], DBTYPE_ALIGNMENT_RES)
+
+        with SequenceDB(seq_db) as seqs:
+            assert len(seqs) == 7 and seqs.sequence(3) == "MKKK" and seqs.header(3) == "p3 protein 3"
+            assert seqs.name(6) == "p6" and seqs.key_of("p4") == 4
+        with MMseqsDB(cluster_db) as clusters:
+            assert cluster_members(clusters, 5) == [5, 6]
+            assert cluster_sizes(clusters).to_dict() == {0: 5, 5: 2}
+        with MMseqsDB(result_db) as results:
+            hit, = alignments(results, 0)
+            assert hit.target == 5 and hit.evalue == 1e-5 and hit.backtrace == "1M"
+            assert alignments(results, 1) == []
+
+        assert select_clusters(seq_db, cluster_db, tmp, min_size=5) == (2, 1)
+        with open(os.path.join(tmp, "cluster_sizes.txt")) as f:
+            assert f.read() == "5 p0\n2 p5\n"
+        with open(os.path.join(tmp, "denovo_reps_large.faa")) as f:
+            assert f.read() == ">p0 protein 0\nM\n"
+        out = os.path.join(tmp, "reps.faa")
+        assert write_representatives(seq_db, cluster_db, out) == 2
+        with open(out) as f:
+            assert f.read() == ">p0 protein 0\nM\n>p5 protein 5\nMKKKKK\n"
+
+        # a database split into .0 / .1 reads as one
+        os.rename(cluster_db, cluster_db + ".0")
+        open(cluster_db + ".1", "wb").close()
+        with MMseqsDB(cluster_db) as clusters:
+            assert cluster_members(clusters, 0) == [0, 1, 2, 3, 4]
+    finally:
+        shutil.rmtree(tmp)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Read MMseqs2 databases without converting them to text.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    info = sub.add_parser("info")
+    info.add_argument("db")
+    get = sub.add_parser("get")
+    get.add_argument("db")
+    get.add_argument("keys", nargs="+", type=int)
+    select = sub.add_parser("select-clusters")
+    select.add_argument("seq_db")
+    select.add_argument("cluster_db")
+    select.add_argument("out_dir")
+    select.add_argument("--min-size", type=int, default=5)
+    reps = sub.add_parser("reps", help="Cluster representatives as FASTA (result2repseq + convert2fasta)")
+    reps.add_argument("seq_db")
+    reps.add_argument("cluster_db")
+    reps.add_argument("out_fasta")
+    reps.add_argument("--append", action="store_true")
+    sub.add_parser("selftest", help="Check the reader on small databases written by this module")
+    args = parser.parse_args(argv[1:])
+
+    if args.command == "select-clusters":
+        total, large = select_clusters(args.seq_db, args.cluster_db, args.out_dir, args.min_size)
+        print(f"{total} clusters, {large} with >= {args.min_size} members; written to {args.out_dir}")
+        return
+    if args.command == "reps":
+        n = write_representatives(args.seq_db, args.cluster_db, args.out_fasta, args.append)
+        print(f"{n} representatives written to {args.out_fasta}")
+        return
+    if args.command == "selftest":
+        selftest()
+        print("mmseqs_db selftest passed")
+        return
+
+    with MMseqsDB(args.db) as db:
+        if args.command == "info":
+            sizes = db.entry_sizes()
+            print(f"{args.db}: {db.type_name}, {len(db)} entries, {int(sizes.sum())} bytes "
+                  f"in {len(db._maps)} data file(s)")
+            return
+        for key in args.keys:
+            print(f"# {key}")
+            print(db.get(key).rstrip("\n"))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,281 @@
+# Size-aware parallel Prokka runs with resume
+#
+# run_prokka_all.sh annotates one genome at a time with 12 CPUs and re-annotates
+# everything on every run. This driver sizes each .fna, gives it a CPU count that
+# grows with the genome (Prokka gains little from many CPUs on a small MAG) and runs
+# several genomes at once within a total core budget: jobs are started longest first
+# and, when the next one does not fit into the free cores, the largest job that does
+# fit is started instead.
+#
+# A genome is skipped when its output is complete and verified: .faa, .gff and .txt
+# present, the .faa holding as many proteins as the .txt reports CDS, and the .fna
+# unchanged since the recorded run. Every run's wall time is recorded in
+# prokka_runs.sqlite in the output folder, and the expected time of the next jobs is
+# taken from it (the genome's own last run, else its size times the median
+# seconds per byte of earlier runs) so the longest jobs really go first.
+#
+# Usage:
+#   python prokka_scheduler.py <genomes folder> [<output folder>] [--cores 48] [--max-cpus 12]
+#   python prokka_scheduler.py <genomes folder> <output folder> --runner local --prokka /path/to/prokka
+#   python prokka_scheduler.py <genomes folder> <output folder> --dry-run
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import threading
+import subprocess
+
+
+RUNS_NAME = "prokka_runs.sqlite"
+DOCKER_IMAGE = "staphb/prokka:latest"
+BYTES_PER_CPU = 1_000_000    # about one CPU per Mb of sequence
+SECONDS_PER_BYTE = 1e-4      # time estimate before any run has been recorded
+POLL = 0.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    genome TEXT PRIMARY KEY,
+    fna_size INTEGER NOT NULL,
+    fna_mtime REAL NOT NULL,
+    cpus INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    status TEXT NOT NULL,
+    cds INTEGER,
+    finished REAL NOT NULL
+);
+"""
+
+
+class RunRecord:
+    """
+    SQLite record of the Prokka runs of an output folder.
+
+    Parameters:
+        path (str): Record file, created if missing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def get(self, genome):
+        with self.lock:
+            cur = self.conn.execute("SELECT * FROM runs WHERE genome = ?", (genome,))
+            row = cur.fetchone()
+        return None if row is None else dict(zip([c[0] for c in cur.description], row))
+
+    def record(self, genome, fna_size, fna_mtime, cpus, seconds, status, cds=None):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO runs (genome, fna_size, fna_mtime, cpus, seconds, status, cds, finished) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (genome, fna_size, fna_mtime, cpus, seconds, status, cds, time.time()))
+            self.conn.commit()
+
+    def seconds_per_byte(self):
+        """Median wall seconds per input byte over the successful runs (None if there are none)."""
+        with self.lock:
+            rates = sorted(s / n for s, n in self.conn.execute(
+                "SELECT seconds, fna_size FROM runs WHERE status = 'ok' AND fna_size > 0"))
+        return rates[len(rates) // 2] if rates else None
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# =====================
+# Genomes and outputs
+# =====================
+
+def list_genomes(input_dir):
+    """(genome, .fna path, size, mtime) of every .fna file, sorted by name."""
+    genomes = []
+    for name in sorted(os.listdir(input_dir)):
+        if name.endswith(".fna"):
+            path = os.path.join(input_dir, name)
+            st = os.stat(path)
+            genomes.append((name[:-len(".fna")], path, st.st_size, st.st_mtime))
+    return genomes
+
+
+def cds_count(txt_file):
+    """CDS count from Prokka's <prefix>.txt summary; None if it is not there."""
+    with open(txt_file) as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key.strip() == "CDS":
+                return int(value)
+    return None
+
+
+def verify_output(output_dir, genome):
+    """
+    Number of proteins if the Prokka output of ``genome`` is complete, else None.
+    Complete means .faa, .gff and .txt exist and the .faa has the CDS count of the .txt.
+    """
+    prefix = os.path.join(output_dir, genome, genome)
+    if not all(os.path.exists(prefix + ext) for ext in (".faa", ".gff", ".txt")):
+        return None
+    if os.path.getsize(prefix + ".gff") == 0:
+        return None
+    try:
+        cds = cds_count(prefix + ".txt")
+    except (OSError, ValueError):
+        return None
+    with open(prefix + ".faa", "rb") as f:
+        proteins = sum(line.startswith(b">") for line in f)
+    if cds is None or proteins != cds:
+        return None
+    return proteins
+
+
+def job_cpus(size, max_cpus, min_cpus=1):
+    return max(min_cpus, min(max_cpus, -(-size // BYTES_PER_CPU)))
+
+
+def expected_seconds(genome, size, runs):
+    """Expected wall time: the genome's last successful run, else size x the median rate."""
+    last = runs.get(genome)
+    if last is not None and last["status"] == "ok" and last["fna_size"] == size:
+        return last["seconds"]
+    return size * (runs.seconds_per_byte() or SECONDS_PER_BYTE)
+
+
+def prokka_command(runner, prokka, fna, input_dir, output_dir, genome, cpus):
+    args = ["--outdir", None, "--prefix", genome, "--cpus", str(cpus), "--metagenome", "--kingdom", "Archaea",
+            "--force"]
+    if runner == "docker":
+        args[1] = f"/data/output/{genome}"
+        return ["sudo", "docker", "run", "--rm",
+                "-v", f"{os.path.abspath(input_dir)}:/data/input",
+                "-v", f"{os.path.abspath(output_dir)}:/data/output",
+                DOCKER_IMAGE, "prokka", f"/data/input/{os.path.basename(fna)}"] + args
+    args[1] = os.path.join(output_dir, genome)
+    return prokka.split() + [fna] + args
+
+
+# =====================
+# Scheduling
+# =====================
+
+def plan_jobs(genomes, output_dir, runs, max_cpus, force=False):
+    """
+    Jobs still to run, longest expected first.
+
+    Returns:
+        (list, list): jobs as dicts, names of the genomes skipped as complete.
+    """
+    jobs, skipped = [], []
+    for genome, fna, size, mtime in genomes:
+        last = runs.get(genome)
+        unchanged = last is not None and last["fna_size"] == size and last["fna_mtime"] == mtime
+        if not force and (unchanged or last is None) and verify_output(output_dir, genome) is not None:
+            # complete output: made by a recorded run of this same .fna, or by a run before the record existed
+            skipped.append(genome)
+            continue
+        jobs.append(dict(genome=genome, fna=fna, size=size, mtime=mtime, cpus=job_cpus(size, max_cpus),
+                         expected=expected_seconds(genome, size, runs)))
+    jobs.sort(key=lambda j: j["expected"], reverse=True)
+    return jobs, skipped
+
+
+def next_job(jobs, free):
+    """Index of the longest job that fits into ``free`` cores (None if none does)."""
+    for i, job in enumerate(jobs):
+        if job["cpus"] <= free:
+            return i
+    return None
+
+
+def run_jobs(jobs, input_dir, output_dir, runs, cores, runner="docker", prokka="prokka", log=print):
+    """
+    Run ``jobs`` with at most ``cores`` CPUs in use and record each result.
+
+    Returns:
+        dict: genome -> "ok" / "failed".
+    """
+    pending, running, results = list(jobs), [], {}
+    while pending or running:
+        free = cores - sum(job["cpus"] for job, _, _, _ in running)
+        i = next_job(pending, free)
+        if i is None and not running and pending:
+            # nothing fits and nothing runs: start the longest job on all the cores there are
+            i = 0
+            pending[0]["cpus"] = min(pending[0]["cpus"], cores)
+        if i is not None:
+            job = pending.pop(i)
+            logfile = open(os.path.join(output_dir, f"{job['genome']}.prokka.log"), "w")
+            cmd = prokka_command(runner, prokka, job["fna"], input_dir, output_dir, job["genome"], job["cpus"])
+            proc = subprocess.Popen(cmd, stdout=logfile, stderr=subprocess.STDOUT)
+            running.append((job, proc, logfile, time.time()))
+            log(f"[START] {job['genome']} ({job['size'] / 1e6:.1f} MB, {job['cpus']} CPUs, "
+                f"~{job['expected']:.0f} s expected)")
+            continue
+
+        time.sleep(POLL)
+        for entry in list(running):
+            job, proc, logfile, start = entry
+            if proc.poll() is None:
+                continue
+            running.remove(entry)
+            logfile.close()
+            seconds = time.time() - start
+            proteins = verify_output(output_dir, job["genome"]) if proc.returncode == 0 else None
+            status = "ok" if proteins is not None else "failed"
+            runs.record(job["genome"], job["size"], job["mtime"], job["cpus"], seconds, status, proteins)
+            results[job["genome"]] = status
+            if status == "ok":
+                log(f"[DONE] {job['genome']}: {proteins} proteins in {seconds:.0f} s")
+            else:
+                log(f"[ERROR] {job['genome']}: exit code {proc.returncode}, "
+                    f"see {os.path.join(output_dir, job['genome'] + '.prokka.log')}")
+    return results
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Run Prokka on all genomes of a folder, several at a time.")
+    parser.add_argument("input_dir")
+    parser.add_argument("output_dir", nargs="?", default="/home/anirudh/genomes/selected_genomes/prokka_results")
+    parser.add_argument("--cores", type=int, default=os.cpu_count(), help="CPUs all running jobs may use together")
+    parser.add_argument("--max-cpus", type=int, default=12, help="CPUs of the largest genomes' jobs")
+    parser.add_argument("--runner", choices=["docker", "local"], default="docker",
+                        help="Prokka in the staphb/prokka container, or a local command")
+    parser.add_argument("--prokka", default="prokka", help="Local Prokka command (--runner local)")
+    parser.add_argument("--force", action="store_true", help="Re-annotate genomes with complete output too")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the plan")
+    args = parser.parse_args(argv[1:])
+
+    genomes = list_genomes(args.input_dir)
+    if not genomes:
+        print(f"No .fna files found in {args.input_dir}")
+        sys.exit(1)
+    os.makedirs(args.output_dir, exist_ok=True)
+    runs = RunRecord(os.path.join(args.output_dir, RUNS_NAME))
+
+    jobs, skipped = plan_jobs(genomes, args.output_dir, runs, min(args.max_cpus, args.cores), args.force)
+    print(f"{len(genomes)} genomes: {len(skipped)} already annotated, {len(jobs)} to run on {args.cores} cores")
+    if args.dry_run:
+        for job in jobs:
+            print(f"  {job['genome']}\t{job['size'] / 1e6:.1f} MB\t{job['cpus']} CPUs\t~{job['expected']:.0f} s")
+        runs.close()
+        return
+
+    start = time.time()
+    results = run_jobs(jobs, args.input_dir, args.output_dir, runs, args.cores, args.runner, args.prokka)
+    runs.close()
+    failed = [genome for genome, status in results.items() if status != "ok"]
+    print(f"All annotations completed in {time.time() - start:.0f} s. Results saved in: {args.output_dir}")
+    if failed:
+        print(f"{len(failed)} genomes failed: {', '.join(sorted(failed))}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
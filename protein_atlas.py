@@ -0,0 +1,674 @@
+# Protein atlas: genome, cluster, annotation and structure of every protein in one SQLite file
+#
+# The outputs of the pipeline stages are loaded into integer-keyed, indexed tables so a
+# question like "pLDDT, COG category and genomes of every de novo cluster with >= 5
+# members" is one indexed query instead of a join of several multi-GB CSVs:
+#
+#   genomes          genome_id, genome_file, organism_name, strain, breed
+#   proteins         protein_id, cds_id, genome_id, product, length, seq_hash
+#   clusters         cluster_id, kind ('reference' / 'denovo'), name, rep_name, rep_protein_id
+#   cluster_members  cluster_id, protein_id
+#   annotations      protein_id, COG category, preferred name, description, KEGG KO, eggNOG OGs
+#   structures       protein_id, status, pLDDT, PDB path
+#
+# cluster_summary is precomputed per cluster (representative, members, genomes,
+# representative pLDDT / mean member pLDDT, representative annotation) and the
+# protein_atlas view joins everything per protein.
+#
+# Stages are loaded from:
+#   proteome      Proteins_genomes_cpNN.csv (compile_cds_info.py)
+#   faa_ids       all_faa_ids.csv (merge_faa.sh): genome of proteins not in the proteome table
+#   reference     searches/ref_search result DB (asgard_cluster_pipeline.sh), read through
+#                 mmseqs_db.py with the query DB and the reference DB for the names; a
+#                 convertalis TSV (query,target,...) also works. Best hit per query; the
+#                 reference representative is only a name (clusters.rep_name), not a protein
+#   denovo        denovo_clu.tsv (mmseqs createtsv)
+#   annotations   prokka_eggnog_combined.csv (Analyse_eggnog.py)
+#   structures    prediction_manifest.sqlite or prediction_summary.csv (esm_inference.py)
+#
+# The size and mtime of every source are recorded; `update` reloads only the stages
+# whose source changed, each in its own transaction, and then refreshes cluster_summary.
+# Protein and genome rows are upserted by name, never renumbered, so their keys stay
+# valid across updates. Proteins a reloaded proteome / faa_ids source no longer lists are
+# deleted, or kept as bare placeholders while other stages still reference them, and
+# genomes left without proteins go with them.
+#
+# Usage:
+#   python protein_atlas.py update [--atlas protein_atlas.sqlite] [--proteome ...] [--denovo ...] [--force]
+#   python protein_atlas.py update --reference results/searches/ref_search --reference-target-db asgard_db
+#   python protein_atlas.py protein <cds_id>
+#   python protein_atlas.py cluster <cluster name>
+#   python protein_atlas.py clusters [--kind denovo] [--min-members 5] [--order rep_plddt] [--limit 20]
+#   python protein_atlas.py sql "SELECT ..."
+#   python protein_atlas.py stats
+#   python protein_atlas.py selftest
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import threading
+
+import pandas as pd
+
+from esm_manifest import sequence_hash
+
+
+ATLAS_NAME = "protein_atlas.sqlite"
+CHUNK_ROWS = 200000
+
+DEFAULT_ATLAS = "/home/anirudh/genomes/scripts/data/" + ATLAS_NAME
+DEFAULT_SOURCES = {
+    "proteome": "/home/anirudh/genomes/scripts/data/Proteins_genomes_cp50.csv",
+    "faa_ids": "/home/anirudh/genomes/selected_genomes/all_faa_ids.csv",
+    "reference": "/home/anirudh/genomes/asCOGs/results/searches/ref_search",
+    "denovo": "/home/anirudh/genomes/asCOGs/results/denovo/denovo_clu.tsv",
+    "annotations": "/home/anirudh/genomes/prokka_eggnog_combined.csv",
+    "structures": "/home/anirudh/genomes/predicted/prediction_manifest.sqlite",
+}
+# extra inputs of a stage, passed to its loader as keyword arguments
+DEFAULT_OPTIONS = {
+    "reference": {
+        "query_db": None,  # default: query_db next to the result DB
+        "target_db": "/home/anirudh/genomes/asCOGs/asgard_db",
+    },
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS genomes (
+    genome_id INTEGER PRIMARY KEY,
+    genome_file TEXT NOT NULL UNIQUE,
+    organism_name TEXT,
+    strain TEXT,
+    breed TEXT
+);
+CREATE TABLE IF NOT EXISTS proteins (
+    protein_id INTEGER PRIMARY KEY,
+    cds_id TEXT NOT NULL UNIQUE,
+    genome_id INTEGER REFERENCES genomes (genome_id),
+    product TEXT,
+    length INTEGER,
+    seq_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS proteins_genome ON proteins (genome_id);
+CREATE INDEX IF NOT EXISTS proteins_seq_hash ON proteins (seq_hash);
+CREATE TABLE IF NOT EXISTS clusters (
+    cluster_id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    rep_name TEXT,
+    rep_protein_id INTEGER REFERENCES proteins (protein_id),
+    UNIQUE (kind, name)
+);
+CREATE INDEX IF NOT EXISTS clusters_rep ON clusters (rep_protein_id);
+CREATE TABLE IF NOT EXISTS cluster_members (
+    cluster_id INTEGER NOT NULL REFERENCES clusters (cluster_id),
+    protein_id INTEGER NOT NULL REFERENCES proteins (protein_id),
+    PRIMARY KEY (cluster_id, protein_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS cluster_members_protein ON cluster_members (protein_id);
+CREATE TABLE IF NOT EXISTS annotations (
+    protein_id INTEGER PRIMARY KEY REFERENCES proteins (protein_id),
+    annotation_found INTEGER,
+    cog_category TEXT,
+    preferred_name TEXT,
+    description TEXT,
+    kegg_ko TEXT,
+    eggnog_ogs TEXT
+);
+CREATE INDEX IF NOT EXISTS annotations_cog ON annotations (cog_category);
+CREATE TABLE IF NOT EXISTS structures (
+    protein_id INTEGER PRIMARY KEY REFERENCES proteins (protein_id),
+    status TEXT,
+    plddt REAL,
+    pdb_path TEXT
+);
+CREATE INDEX IF NOT EXISTS structures_plddt ON structures (plddt);
+CREATE TABLE IF NOT EXISTS cluster_summary (
+    cluster_id INTEGER PRIMARY KEY REFERENCES clusters (cluster_id),
+    kind TEXT,
+    name TEXT,
+    rep_cds_id TEXT,
+    members INTEGER,
+    genomes INTEGER,
+    predicted INTEGER,
+    rep_plddt REAL,
+    mean_plddt REAL,
+    rep_cog_category TEXT,
+    rep_preferred_name TEXT,
+    rep_description TEXT
+);
+CREATE INDEX IF NOT EXISTS cluster_summary_name ON cluster_summary (name);
+CREATE INDEX IF NOT EXISTS cluster_summary_members ON cluster_summary (kind, members);
+CREATE TABLE IF NOT EXISTS stages (
+    stage TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    rows INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE VIEW IF NOT EXISTS protein_atlas AS
+SELECT p.protein_id, p.cds_id, g.genome_file, g.organism_name, p.product, p.length,
+       c.kind AS cluster_kind, c.name AS cluster, a.cog_category, a.preferred_name, a.description,
+       a.kegg_ko, s.status AS structure_status, s.plddt, s.pdb_path
+FROM proteins p
+LEFT JOIN genomes g ON g.genome_id = p.genome_id
+LEFT JOIN cluster_members m ON m.protein_id = p.protein_id
+LEFT JOIN clusters c ON c.cluster_id = m.cluster_id
+LEFT JOIN annotations a ON a.protein_id = p.protein_id
+LEFT JOIN structures s ON s.protein_id = p.protein_id;
+"""
+
+SUMMARY_SQL = """
+INSERT INTO cluster_summary
+SELECT c.cluster_id, c.kind, c.name, COALESCE(rp.cds_id, c.rep_name),
+       COUNT(*), COUNT(DISTINCT p.genome_id), COUNT(s.plddt), rs.plddt, AVG(s.plddt),
+       ra.cog_category, ra.preferred_name, ra.description
+FROM clusters c
+JOIN cluster_members m ON m.cluster_id = c.cluster_id
+JOIN proteins p ON p.protein_id = m.protein_id
+LEFT JOIN structures s ON s.protein_id = m.protein_id
+LEFT JOIN proteins rp ON rp.protein_id = c.rep_protein_id
+LEFT JOIN structures rs ON rs.protein_id = c.rep_protein_id
+LEFT JOIN annotations ra ON ra.protein_id = c.rep_protein_id
+GROUP BY c.cluster_id
+"""
+
+
+def source_exists(path):
+    """A file, or an MMseqs2 database (which may only exist as <db>.index plus <db>.0, <db>.1, ...)."""
+    return os.path.exists(path) or os.path.exists(path + ".index")
+
+
+def source_state(path):
+    """
+    (size, mtime) of a source; a SQLite source includes its WAL file (readers leave an
+    empty one behind) and an MMseqs2 database is represented by its .index.
+    """
+    if os.path.exists(path + ".index"):
+        path = path + ".index"
+    size, mtime = os.path.getsize(path), os.path.getmtime(path)
+    if os.path.exists(path + "-wal") and os.path.getsize(path + "-wal"):
+        size += os.path.getsize(path + "-wal")
+        mtime = max(mtime, os.path.getmtime(path + "-wal"))
+    return size, mtime
+
+
+# a protein row that clusters, annotations or structures still point to
+REFERENCED = """
+protein_id IN (SELECT protein_id FROM cluster_members)
+OR protein_id IN (SELECT protein_id FROM annotations)
+OR protein_id IN (SELECT protein_id FROM structures)
+OR protein_id IN (SELECT rep_protein_id FROM clusters WHERE rep_protein_id IS NOT NULL)
+"""
+
+
+def clean(value):
+    """NaN and eggNOG-mapper's '-' placeholder as NULL."""
+    if value is None or value != value or value == "-" or value == "":
+        return None
+    return value
+
+
+def genome_of_file(source_file):
+    """Genome name of a Prokka .faa file name, as compile_cds_info.py writes it."""
+    return source_file.split("_genomic")[0].rsplit(".faa", 1)[0]
+
+
+# =====================
+# Stage loaders
+# =====================
+
+def _start_listing(conn):
+    """Empty the temporary table of the cds_ids the source being loaded lists."""
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS listed (cds_id TEXT PRIMARY KEY) WITHOUT ROWID")
+    conn.execute("DELETE FROM temp.listed")
+
+
+def _drop_unlisted(conn, owned, detach):
+    """
+    Remove the proteins of a stage (``owned``, a WHERE clause) that its new source no longer
+    lists: they are deleted, or, while other stages reference them, ``detach`` (a SET clause)
+    turns them into placeholders. Genomes left without proteins are deleted.
+    """
+    stale = f"({owned}) AND cds_id NOT IN (SELECT cds_id FROM temp.listed)"
+    conn.execute(f"DELETE FROM proteins WHERE {stale} AND NOT ({REFERENCED})")
+    conn.execute(f"UPDATE proteins SET {detach} WHERE {stale}")
+    conn.execute("DELETE FROM genomes WHERE genome_id NOT IN "
+                 "(SELECT genome_id FROM proteins WHERE genome_id IS NOT NULL)")
+
+
+def load_proteome(conn, path, chunksize=CHUNK_ROWS):
+    _start_listing(conn)
+    rows = 0
+    for chunk in pd.read_csv(path, index_col=0, chunksize=chunksize,
+                             usecols=lambda c: c in ("Unnamed: 0", "organism_name", "breed", "strain", "cds_id",
+                                                     "header", "genome_file", "sequence")):
+        genomes = chunk[["genome_file", "organism_name", "strain", "breed"]].drop_duplicates("genome_file")
+        conn.executemany(
+            "INSERT INTO genomes (genome_file, organism_name, strain, breed) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (genome_file) DO UPDATE SET organism_name = excluded.organism_name, "
+            "strain = excluded.strain, breed = excluded.breed",
+            [tuple(clean(v) for v in row) for row in genomes.itertuples(index=False)])
+        records = []
+        for cds_id, header, genome_file, seq in chunk[["cds_id", "header", "genome_file", "sequence"]].itertuples(index=False):
+            seq = "" if clean(seq) is None else str(seq)
+            parts = str(header).split(None, 1) if clean(header) is not None else []
+            records.append((str(cds_id), parts[1] if len(parts) > 1 else None, len(seq.rstrip("*")),
+                            sequence_hash(seq), genome_file))
+        conn.executemany(
+            "INSERT INTO proteins (cds_id, genome_id, product, length, seq_hash) "
+            "SELECT ?1, genome_id, ?2, ?3, ?4 FROM genomes WHERE genome_file = ?5 "
+            "ON CONFLICT (cds_id) DO UPDATE SET genome_id = excluded.genome_id, product = excluded.product, "
+            "length = excluded.length, seq_hash = excluded.seq_hash",
+            records)
+        conn.executemany("INSERT OR IGNORE INTO temp.listed (cds_id) VALUES (?)", [(r[0],) for r in records])
+        rows += len(chunk)
+    # proteome rows are the ones with a sequence hash
+    _drop_unlisted(conn, "seq_hash IS NOT NULL", "genome_id = NULL, product = NULL, length = NULL, seq_hash = NULL")
+    return rows
+
+
+def load_faa_ids(conn, path, chunksize=CHUNK_ROWS):
+    _start_listing(conn)
+    rows = 0
+    for chunk in pd.read_csv(path, chunksize=chunksize, dtype=str):
+        chunk["genome_file"] = chunk["source_file"].map(genome_of_file)
+        conn.executemany("INSERT OR IGNORE INTO genomes (genome_file) VALUES (?)",
+                         [(g,) for g in chunk["genome_file"].unique()])
+        conn.executemany(
+            "INSERT INTO proteins (cds_id, genome_id) SELECT ?1, genome_id FROM genomes WHERE genome_file = ?2 "
+            "ON CONFLICT (cds_id) DO UPDATE SET genome_id = COALESCE(proteins.genome_id, excluded.genome_id)",
+            chunk[["cds_id", "genome_file"]].itertuples(index=False, name=None))
+        conn.executemany("INSERT OR IGNORE INTO temp.listed (cds_id) VALUES (?)", [(c,) for c in chunk["cds_id"]])
+        rows += len(chunk)
+    # faa_ids rows have a genome but no sequence hash (that would make them proteome rows)
+    _drop_unlisted(conn, "seq_hash IS NULL AND genome_id IS NOT NULL", "genome_id = NULL")
+    return rows
+
+
+def _clear_clusters(conn, kind):
+    conn.execute("DELETE FROM cluster_members WHERE cluster_id IN (SELECT cluster_id FROM clusters WHERE kind = ?)",
+                 (kind,))
+    conn.execute("DELETE FROM clusters WHERE kind = ?", (kind,))
+
+
+def _load_membership(conn, kind, pairs, rep_is_protein=True):
+    """
+    (cluster name, representative name, member cds_id) rows. With ``rep_is_protein``
+    the representative is one of our proteins; otherwise it is only stored as a name.
+    """
+    names = {cds for _, rep, cds in pairs for cds in ((rep, cds) if rep_is_protein else (cds,))}
+    conn.executemany("INSERT OR IGNORE INTO proteins (cds_id) VALUES (?)", [(n,) for n in names])
+    conn.executemany(
+        "INSERT OR IGNORE INTO clusters (kind, name, rep_name, rep_protein_id) "
+        "SELECT ?1, ?2, ?3, (SELECT protein_id FROM proteins WHERE cds_id = ?3 AND ?4)",
+        {(kind, name, rep, int(rep_is_protein)) for name, rep, _ in pairs})
+    conn.executemany(
+        "INSERT OR IGNORE INTO cluster_members (cluster_id, protein_id) "
+        "SELECT c.cluster_id, p.protein_id FROM clusters c, proteins p WHERE c.kind = ?1 AND c.name = ?2 AND p.cds_id = ?3",
+        [(kind, name, member) for name, _, member in pairs])
+
+
+def reference_hits(path, query_db=None, target_db=None, chunksize=CHUNK_ROWS):
+    """
+    Chunks of (query, target) names of the best (first) hit of every query, read from the
+    search result DB (names from the query and target DB .lookup files) or from a
+    convertalis TSV.
+    """
+    if not os.path.exists(path + ".index"):
+        if not os.path.getsize(path):
+            return
+        last = None
+        for chunk in pd.read_csv(path, sep="\t", header=None, usecols=[0, 1], dtype=str, chunksize=chunksize,
+                                 quoting=3, na_filter=False):
+            best = chunk.drop_duplicates(0)
+            best = best[best[0] != last]  # hits of a query are contiguous in convertalis output
+            last = chunk[0].iloc[-1]
+            yield list(best.itertuples(index=False, name=None))
+        return
+
+    from mmseqs_db import MMseqsDB, SequenceDB
+    query_db = query_db or os.path.join(os.path.dirname(path), "query_db")
+    if target_db is None:
+        raise ValueError("Reading a search result DB needs the target DB (--reference-target-db) for the names")
+    with MMseqsDB(path) as hits, SequenceDB(query_db) as queries, SequenceDB(target_db) as targets:
+        chunk = []
+        for key, length in zip(hits.keys.tolist(), hits.lengths.tolist()):
+            if length <= 1:  # no hits: only the NUL terminator
+                continue
+            first = bytes(hits.raw(key)[:64]).split(b"\t", 1)[0]  # target key of the best hit
+            chunk.append((queries.name(key), targets.name(int(first))))
+            if len(chunk) >= chunksize:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def load_reference(conn, path, query_db=None, target_db=None, chunksize=CHUNK_ROWS):
+    """Best reference hit of every query; the target names the cluster and is its representative."""
+    _clear_clusters(conn, "reference")
+    # earlier versions stored reference targets as proteins: drop such unreferenced placeholders
+    conn.execute("DELETE FROM proteins WHERE genome_id IS NULL AND product IS NULL AND seq_hash IS NULL "
+                 f"AND NOT ({REFERENCED})")
+    rows = 0
+    for chunk in reference_hits(path, query_db, target_db, chunksize):
+        _load_membership(conn, "reference", [(t, t, q) for q, t in chunk], rep_is_protein=False)
+        rows += len(chunk)
+    return rows
+
+
+def load_denovo(conn, path, chunksize=CHUNK_ROWS):
+    _clear_clusters(conn, "denovo")
+    rows = 0
+    if not os.path.getsize(path):
+        return 0
+    for chunk in pd.read_csv(path, sep="\t", header=None, usecols=[0, 1], dtype=str, chunksize=chunksize,
+                             quoting=3, na_filter=False):
+        _load_membership(conn, "denovo", [(r, r, m) for r, m in chunk.itertuples(index=False)])
+        rows += len(chunk)
+    return rows
+
+
+def load_annotations(conn, path, chunksize=CHUNK_ROWS):
+    conn.execute("DELETE FROM annotations")
+    columns = ["#query", "annotation_found", "COG_category", "Preferred_name", "Description", "KEGG_ko", "eggNOG_OGs"]
+    rows = 0
+    for chunk in pd.read_csv(path, chunksize=chunksize, usecols=lambda c: c in columns, low_memory=False):
+        chunk = chunk.reindex(columns=columns)
+        conn.executemany("INSERT OR IGNORE INTO proteins (cds_id) VALUES (?)", [(q,) for q in chunk["#query"]])
+        records = []
+        for query, found, *values in chunk.itertuples(index=False):
+            found = None if clean(found) is None else int(str(found) in ("True", "1"))
+            records.append((*(clean(v) for v in values), found, query))
+        conn.executemany(
+            "INSERT OR REPLACE INTO annotations (protein_id, cog_category, preferred_name, description, kegg_ko, "
+            "eggnog_ogs, annotation_found) SELECT protein_id, ?1, ?2, ?3, ?4, ?5, ?6 FROM proteins WHERE cds_id = ?7",
+            records)
+        rows += len(chunk)
+    return rows
+
+
+def load_structures(conn, path, chunksize=CHUNK_ROWS):
+    """ESMFold results from the prediction manifest, or from prediction_summary.csv (later rows win)."""
+    conn.execute("DELETE FROM structures")
+    if path.endswith(".sqlite"):
+        source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        chunks = pd.read_sql_query("SELECT id, status, plddt, pdb_path FROM predictions", source, chunksize=chunksize)
+    else:
+        source = None
+        chunks = (pd.DataFrame({
+            "id": c["IDs"].astype(str),
+            "status": c["pdb model"].map(lambda p: "ok" if isinstance(p, str) and p else "failed"),
+            "plddt": c["confidence"],
+            "pdb_path": c["pdb model"],
+        }) for c in pd.read_csv(path, chunksize=chunksize, usecols=["IDs", "pdb model", "confidence"]))
+    rows = 0
+    try:
+        for chunk in chunks:
+            conn.executemany("INSERT OR IGNORE INTO proteins (cds_id) VALUES (?)", [(i,) for i in chunk["id"]])
+            conn.executemany(
+                "INSERT OR REPLACE INTO structures (protein_id, status, plddt, pdb_path) "
+                "SELECT protein_id, ?2, ?3, ?4 FROM proteins WHERE cds_id = ?1",
+                [tuple(clean(v) for v in row) for row in chunk.itertuples(index=False)])
+            rows += len(chunk)
+    finally:
+        if source is not None:
+            source.close()
+    return rows
+
+
+# in load order: the proteome first, so proteins get their genome before placeholders are made
+STAGES = {
+    "proteome": load_proteome,
+    "faa_ids": load_faa_ids,
+    "reference": load_reference,
+    "denovo": load_denovo,
+    "annotations": load_annotations,
+    "structures": load_structures,
+}
+
+
+class ProteinAtlas:
+    """
+    SQLite protein atlas.
+
+    Parameters:
+        path (str): Atlas file, created if missing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA cache_size=-200000")
+        self.conn.executescript(SCHEMA)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(clusters)")]
+        if "rep_name" not in columns:
+            # atlases from before clusters.rep_name
+            self.conn.execute("ALTER TABLE clusters ADD COLUMN rep_name TEXT")
+            self.conn.execute("UPDATE clusters SET rep_name = (SELECT cds_id FROM proteins "
+                              "WHERE protein_id = clusters.rep_protein_id)")
+        self.conn.commit()
+
+    def stage_state(self, stage):
+        with self.lock:
+            row = self.conn.execute("SELECT source, size, mtime FROM stages WHERE stage = ?", (stage,)).fetchone()
+        return row
+
+    def update(self, sources, force=False, log=print, options=None):
+        """
+        Load the stages whose source changed since they were last loaded.
+
+        Parameters:
+            sources (dict): stage -> source path; missing files are skipped.
+            force (bool): Reload every given stage.
+            options (dict, optional): stage -> keyword arguments of its loader (DEFAULT_OPTIONS).
+
+        Returns:
+            list: Stages loaded.
+        """
+        loaded = []
+        for stage, loader in STAGES.items():
+            path = sources.get(stage)
+            if path is None:
+                continue
+            if not source_exists(path):
+                log(f"[{stage}] {path} not found, skipped")
+                continue
+            path = os.path.abspath(path)
+            size, mtime = source_state(path)
+            # faa_ids gives genomes to the proteins the proteome does not list, so a proteome reload
+            # (which drops the genomes it no longer lists) is followed by an faa_ids reload
+            refill = stage == "faa_ids" and "proteome" in loaded
+            if not force and not refill and self.stage_state(stage) == (path, size, mtime):
+                log(f"[{stage}] unchanged")
+                continue
+            start = time.time()
+            with self.lock:
+                try:
+                    rows = loader(self.conn, path, **(options or {}).get(stage, {}))
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO stages (stage, source, size, mtime, rows, seconds, updated) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (stage, path, size, mtime, rows, time.time() - start, time.time()))
+                    self.conn.commit()
+                except BaseException:
+                    self.conn.rollback()
+                    raise
+            log(f"[{stage}] loaded {rows} rows from {path} in {time.time() - start:.1f} s")
+            loaded.append(stage)
+        if loaded:
+            self.refresh_summary(log)
+        return loaded
+
+    def refresh_summary(self, log=print):
+        start = time.time()
+        with self.lock:
+            self.conn.execute("DELETE FROM cluster_summary")
+            self.conn.execute(SUMMARY_SQL)
+            self.conn.execute("ANALYZE")
+            self.conn.commit()
+        log(f"cluster_summary refreshed in {time.time() - start:.1f} s")
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return pd.read_sql_query(sql, self.conn, params=params)
+
+    def protein(self, cds_id):
+        """Everything known about one protein (one row per cluster it is in)."""
+        return self.query("SELECT * FROM protein_atlas WHERE cds_id = ?", (cds_id,))
+
+    def cluster(self, name, kind=None):
+        """cluster_summary rows of a cluster name (de novo and reference names may coincide)."""
+        if kind is None:
+            return self.query("SELECT * FROM cluster_summary WHERE name = ?", (name,))
+        return self.query("SELECT * FROM cluster_summary WHERE name = ? AND kind = ?", (name, kind))
+
+    def members(self, name, kind="denovo"):
+        return self.query(
+            "SELECT a.* FROM clusters c JOIN cluster_members m ON m.cluster_id = c.cluster_id "
+            "JOIN protein_atlas a ON a.protein_id = m.protein_id AND a.cluster_kind = c.kind "
+            "WHERE c.kind = ? AND c.name = ?", (kind, name))
+
+    def clusters(self, kind=None, min_members=1, order="members", limit=None):
+        """
+        cluster_summary rows with at least ``min_members`` members, largest ``order`` first.
+        """
+        if order not in ("members", "genomes", "predicted", "rep_plddt", "mean_plddt"):
+            raise ValueError(f"Cannot order clusters by {order}")
+        sql, params = "SELECT * FROM cluster_summary WHERE members >= ?", [min_members]
+        if kind is not None:
+            sql += " AND kind = ?"
+            params.append(kind)
+        sql += f" ORDER BY {order} DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self.query(sql, params)
+
+    def stats(self):
+        counts = {}
+        with self.lock:
+            for table in ("genomes", "proteins", "clusters", "cluster_members", "annotations", "structures"):
+                counts[table] = self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        return counts
+
+    def stages(self):
+        return self.query("SELECT stage, source, rows, seconds, datetime(updated, 'unixepoch') AS updated FROM stages")
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+def selftest():
+    """
+    Load a small proteome and de novo clustering, then drop a genome from the proteome and
+    update; raises AssertionError if any of its rows still feed the atlas.
+    """
+    import shutil
+    import tempfile
+
+    tmp = tempfile.mkdtemp(prefix="protein_atlas_")
+    try:
+        proteome, denovo = os.path.join(tmp, "proteome.csv"), os.path.join(tmp, "denovo_clu.tsv")
+        rows = [("Org A", "gA.faa", "a1", "MKV"), ("Org A", "gA.faa", "a2", "MKL"),
+                ("Org B", "gB.faa", "b1", "MKVV"), ("Org B", "gB.faa", "b2", "MKLL"), ("Org B", "gB.faa", "b3", "MA")]
+
+        def write_proteome(rows):
+            pd.DataFrame([(org, None, None, cds, f"{cds} protein {cds}", genome, seq) for org, genome, cds, seq in rows],
+                         columns=["organism_name", "breed", "strain", "cds_id", "header", "genome_file", "sequence"]
+                         ).to_csv(proteome)
+
+        write_proteome(rows)
+        with open(denovo, "w") as f:
+            f.write("a1\ta1\na1\tb1\na2\ta2\nb2\tb2\n")
+        atlas = ProteinAtlas(os.path.join(tmp, ATLAS_NAME))
+        log = lambda message: None
+        atlas.update({"proteome": proteome, "denovo": denovo}, log=log)
+        assert atlas.cluster("a1")["genomes"].tolist() == [2]
+
+        write_proteome([row for row in rows if row[1] != "gB.faa"])
+        assert atlas.update({"proteome": proteome, "denovo": denovo}, log=log) == ["proteome"]
+        assert atlas.query("SELECT genome_file FROM genomes")["genome_file"].tolist() == ["gA.faa"]
+        assert atlas.cluster("a1")["genomes"].tolist() == [1]
+        assert atlas.query("SELECT COUNT(*) AS n FROM protein_atlas WHERE genome_file = 'gB.faa'")["n"][0] == 0
+        # clustered proteins stay as bare placeholders, the unclustered one is gone
+        left = atlas.query("SELECT cds_id, genome_id, product, seq_hash FROM proteins WHERE cds_id LIKE 'b%' ORDER BY cds_id")
+        assert left["cds_id"].tolist() == ["b1", "b2"], left
+        assert left[["genome_id", "product", "seq_hash"]].isna().all().all(), left
+        atlas.close()
+    finally:
+        shutil.rmtree(tmp)
+    print("protein_atlas selftest passed")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Build and query the protein atlas.")
+    parser.add_argument("--atlas", default=DEFAULT_ATLAS)
+    sub = parser.add_subparsers(dest="command", required=True)
+    update = sub.add_parser("update", help="Load new or changed stage outputs")
+    for stage, path in DEFAULT_SOURCES.items():
+        update.add_argument(f"--{stage.replace('_', '-')}", dest=stage, default=path)
+    for stage, stage_options in DEFAULT_OPTIONS.items():
+        for name, default in stage_options.items():
+            update.add_argument(f"--{stage}-{name.replace('_', '-')}", dest=f"{stage}_{name}", default=default)
+    update.add_argument("--force", action="store_true", help="Reload every stage")
+    protein = sub.add_parser("protein")
+    protein.add_argument("cds_id")
+    cluster = sub.add_parser("cluster")
+    cluster.add_argument("name")
+    cluster.add_argument("--members", action="store_true", help="List the members too")
+    clusters = sub.add_parser("clusters")
+    clusters.add_argument("--kind", choices=["denovo", "reference"], default=None)
+    clusters.add_argument("--min-members", type=int, default=5)
+    clusters.add_argument("--order", default="members")
+    clusters.add_argument("--limit", type=int, default=20)
+    sql = sub.add_parser("sql")
+    sql.add_argument("query")
+    sub.add_parser("stats")
+    sub.add_parser("selftest", help="Check that updates drop genomes removed from the proteome")
+    args = parser.parse_args(argv[1:])
+
+    if args.command == "selftest":
+        selftest()
+        return
+
+    atlas = ProteinAtlas(args.atlas)
+    start = time.time()
+    with pd.option_context("display.max_columns", 30, "display.width", 200, "display.max_colwidth", 60):
+        if args.command == "update":
+            options = {stage: {name: getattr(args, f"{stage}_{name}") for name in stage_options}
+                       for stage, stage_options in DEFAULT_OPTIONS.items()}
+            loaded = atlas.update({stage: getattr(args, stage) for stage in STAGES}, args.force, options=options)
+            print(f"Updated {', '.join(loaded) or 'nothing'} in {time.time() - start:.1f} s")
+        elif args.command == "protein":
+            print(atlas.protein(args.cds_id).T.to_string())
+        elif args.command == "cluster":
+            print(atlas.cluster(args.name).T.to_string())
+            if args.members:
+                for kind in atlas.cluster(args.name)["kind"]:
+                    print(atlas.members(args.name, kind).to_string(index=False))
+        elif args.command == "clusters":
+            print(atlas.clusters(args.kind, args.min_members, args.order, args.limit).to_string(index=False))
+        elif args.command == "sql":
+            print(atlas.query(args.query).to_string(index=False))
+        else:
+            for table, n in atlas.stats().items():
+                print(f"{table:<16}{n:>12}")
+            print(atlas.stages().to_string(index=False))
+        if args.command != "update":
+            print(f"({(time.time() - start) * 1000:.1f} ms)", file=sys.stderr)
+    atlas.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
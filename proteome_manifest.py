@@ -0,0 +1,187 @@
+# Manifest of the .faa files already compiled into the proteome table
+#
+# compile_cds_info.py --incremental records every Prokka .faa it has parsed (path,
+# size, mtime, content hash, the organism metadata it was joined with and its protein
+# count) so the next run parses only new or changed genomes and drops the rows of
+# removed ones. Size and mtime are checked first; the file is hashed only when they
+# differ, so an unchanged file costs one stat(). The CSV it was written to is recorded
+# too (size and inode) so an append interrupted by a crash can be rolled back.
+#
+# Usage:
+#   python proteome_manifest.py status <Proteins_genomes_cpNN.manifest.sqlite> <prokka folder> <ncbi_dataset.tsv>
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    genome_file TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha256 TEXT NOT NULL,
+    organism TEXT,
+    proteins INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def file_hash(path, block=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(block), b""):
+            sha.update(data)
+    return sha.hexdigest()
+
+
+def genome_name(faa):
+    """Genome name of a Prokka .faa file, as compile_cds_info.py writes it in genome_file."""
+    return os.path.basename(faa).split('_genomic')[0]
+
+
+def organism_key(organism_info):
+    """JSON form of the (organism name, strain, breed) metadata of a genome, NaN as null."""
+    if organism_info is None:
+        return None
+    return json.dumps([None if v is None or v != v else str(v) for v in organism_info])
+
+
+class ProteomeManifest:
+    """
+    SQLite record of the compiled .faa files.
+
+    Parameters:
+        path (str): Manifest file, created if missing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def files(self):
+        """path -> row dict of every recorded file."""
+        with self.lock:
+            cur = self.conn.execute("SELECT * FROM files")
+            names = [c[0] for c in cur.description]
+            return {row[0]: dict(zip(names, row)) for row in cur.fetchall()}
+
+    def proteins(self):
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(SUM(proteins), 0) FROM files").fetchone()[0]
+
+    def plan(self, faabasepath, meta):
+        """
+        Compare the .faa files in ``faabasepath`` with the manifest.
+
+        Parameters:
+            faabasepath (str): Prokka .faa folder.
+            meta (dict): load_metadata() lookup; a genome whose metadata changed is re-parsed.
+
+        Returns:
+            dict: 'parse' - [(path, size, mtime, sha256)] of new or changed files,
+                  'changed' / 'removed' - manifest rows of changed / removed files,
+                  'unchanged' - number of files left as they are.
+        """
+        known = self.files()
+        parse, changed, unchanged = [], [], 0
+        for faa in sorted(os.listdir(faabasepath)):
+            path = os.path.abspath(os.path.join(faabasepath, faa))
+            st = os.stat(path)
+            row = known.pop(path, None)
+            if row is not None and organism_key(meta.get(genome_name(faa))) == row['organism']:
+                if row['size'] == st.st_size and row['mtime'] == st.st_mtime:
+                    unchanged += 1
+                    continue
+                sha = file_hash(path)
+                if sha == row['sha256']:
+                    # touched but identical: just refresh the stat
+                    self.touch(path, st.st_size, st.st_mtime)
+                    unchanged += 1
+                    continue
+            else:
+                sha = file_hash(path)
+            if row is not None:
+                changed.append(row)
+            parse.append((path, st.st_size, st.st_mtime, sha))
+        return {"parse": parse, "changed": changed, "removed": list(known.values()), "unchanged": unchanged}
+
+    def record(self, path, size, mtime, sha, organism_info, proteins, commit=False):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files (path, genome_file, size, mtime, sha256, organism, proteins, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, genome_name(path), size, mtime, sha, organism_key(organism_info), int(proteins), time.time()))
+            if commit:
+                self.conn.commit()
+
+    def touch(self, path, size, mtime):
+        with self.lock:
+            self.conn.execute("UPDATE files SET size = ?, mtime = ? WHERE path = ?", (size, mtime, path))
+
+    def remove(self, path):
+        with self.lock:
+            self.conn.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM files")
+            self.conn.execute("DELETE FROM state")
+
+    def get_state(self, key, default=None):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set_state(self, key, value):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+def main(argv):
+    if len(argv) < 5 or argv[1] != "status":
+        print("Usage: python proteome_manifest.py status <manifest.sqlite> <prokka folder> <ncbi_dataset.tsv>")
+        sys.exit(1)
+
+    from compile_cds_info import load_metadata
+
+    manifest = ProteomeManifest(argv[2])
+    plan = manifest.plan(argv[3], load_metadata(argv[4]))
+    print(f"Recorded files: {len(manifest)} ({manifest.proteins()} proteins)")
+    print(f"  unchanged: {plan['unchanged']}")
+    print(f"  new: {len(plan['parse']) - len(plan['changed'])}")
+    print(f"  changed: {len(plan['changed'])}")
+    print(f"  removed: {len(plan['removed'])}")
+    for row in plan['removed']:
+        print(f"    {row['path']}")
+    # status only: leave refreshed stats uncommitted
+    manifest.conn.rollback()
+    manifest.conn.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,187 @@
+# Columnar proteome store: the Proteins_genomes_cpNN table as Parquet, one partition per genome
+#
+# Layout: <store>/genome_file=<assembly>/part-0.parquet (hive partitioning). Every
+# partition is written with the same fixed schema (STORE_SCHEMA), so a genome without
+# NCBI metadata does not turn the organism columns into nulls for the whole store. The
+# organism and genome names are dictionary-encoded, so they cost a few bytes per row
+# instead of the full strings, and every row also carries the Prokka product (the header without
+# its CDS ID, as search_cds.ipynb used to split it) and the protein length. Readers
+# load only the columns and genomes they ask for; metadata without sequences is a
+# small fraction of the CSV.
+#
+# Needs pyarrow (preinstalled on Colab; `pip install pyarrow` elsewhere).
+#
+# Usage:
+#   python proteome_store.py convert Proteins_genomes_cp50.csv Proteins_genomes_cp50.parquet
+#   python proteome_store.py info Proteins_genomes_cp50.parquet
+
+import os
+import sys
+
+import pandas as pd
+
+
+# every column except the sequences
+METADATA_COLUMNS = ['organism_name', 'breed', 'strain', 'cds_id', 'header', 'product', 'length', 'genome_file']
+STRING_COLUMNS = ['breed', 'strain', 'cds_id', 'header', 'sequence', 'product']
+
+
+def _arrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("The proteome store needs pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def store_schema():
+    """Schema of every partition file (genome_file comes from the partition folder)."""
+    pa = _arrow()
+    return pa.schema([
+        ("organism_name", pa.dictionary(pa.int32(), pa.string())),
+        ("breed", pa.string()),
+        ("strain", pa.string()),
+        ("cds_id", pa.string()),
+        ("header", pa.string()),
+        ("sequence", pa.string()),
+        ("product", pa.string()),
+        ("length", pa.int32()),
+    ])
+
+
+def genome_field():
+    pa = _arrow()
+    return pa.field("genome_file", pa.dictionary(pa.int32(), pa.string()))
+
+
+def product_names(headers):
+    """Prokka product of each '>CDS_ID product words' header."""
+    return headers.str.split(n=1).str[1].fillna("").str.strip()
+
+
+def store_columns(table):
+    """Add the product and length columns and cast everything to the store types."""
+    table = table.assign(
+        product=product_names(table['header']),
+        length=table['sequence'].str.len().astype('int32'),
+    )
+    # missing metadata stays a null string, never a column of type null
+    for col in STRING_COLUMNS + ['organism_name']:
+        table[col] = table[col].astype(object).where(table[col].notna(), None)
+    return table
+
+
+def write_genome_partition(store, genome_file, table):
+    """Write (or replace) the partition of one genome; ``table`` has the compile_cds_info columns."""
+    pa = _arrow()
+    part_dir = os.path.join(store, f"genome_file={genome_file}")
+    os.makedirs(part_dir, exist_ok=True)
+    table = store_columns(table.drop(columns=['genome_file']).reset_index(drop=True))
+    schema = store_schema()
+    arrow_table = pa.Table.from_pandas(table[schema.names], schema=schema, preserve_index=False)
+    pa.parquet.write_table(arrow_table, os.path.join(part_dir, "part-0.parquet"), compression="zstd")
+
+
+def dataset(store):
+    pa = _arrow()
+    # the genome name comes from the partition folder; its dictionary is the folder list
+    partitioning = pa.dataset.partitioning(pa.schema([genome_field()]), flavor="hive",
+                                           dictionaries={"genome_file": pa.array(genomes(store), pa.string())})
+    return pa.dataset.dataset(store, format="parquet", schema=store_schema().append(genome_field()),
+                              partitioning=partitioning)
+
+
+def genomes(store):
+    """Genome names in the store, read from the partition folders."""
+    return sorted(d.split("=", 1)[1] for d in os.listdir(store) if d.startswith("genome_file="))
+
+
+def load_proteome(store, columns=METADATA_COLUMNS, genomes=None, organism=None, cds_ids=None):
+    """
+    Load part of the store into pandas.
+
+    Parameters:
+        store (str): Store folder.
+        columns (list): Columns to read; add 'sequence' to get the sequences too.
+        genomes (list, optional): Only these genome partitions.
+        organism (str, optional): Only rows whose organism name equals this.
+        cds_ids (list, optional): Only these CDS IDs.
+
+    Returns:
+        pd.DataFrame
+    """
+    pa = _arrow()
+    ds = pa.dataset
+    conditions = []
+    if genomes is not None:
+        conditions.append(ds.field("genome_file").isin(list(genomes)))
+    if organism is not None:
+        conditions.append(ds.field("organism_name") == organism)
+    if cds_ids is not None:
+        conditions.append(ds.field("cds_id").isin(list(cds_ids)))
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return dataset(store).to_table(columns=list(columns), filter=expression).to_pandas()
+
+
+def load_sequences(store, cds_ids, genomes=None):
+    """Series cds_id -> sequence for the given IDs, reading only ``genomes`` if known."""
+    df = load_proteome(store, ['cds_id', 'sequence'], genomes=genomes, cds_ids=cds_ids)
+    return df.set_index('cds_id')['sequence']
+
+
+def load_csv_sequences(csv_file, cds_ids, chunksize=200000):
+    """Series cds_id -> sequence for the given IDs from a Proteins_genomes_cpNN.csv, read in chunks."""
+    wanted = set(cds_ids)
+    found = [chunk[chunk['cds_id'].isin(wanted)]
+             for chunk in pd.read_csv(csv_file, usecols=['cds_id', 'sequence'], chunksize=chunksize)]
+    return pd.concat(found).set_index('cds_id')['sequence']
+
+
+def convert_csv(csv_file, store, chunksize=200000):
+    """
+    Build a store from an existing Proteins_genomes_cpNN.csv without loading it whole.
+    Rows of one genome are expected to be contiguous, as compile_cds_info.py writes them.
+
+    Returns:
+        int: Number of proteins converted.
+    """
+    converted, carry = 0, None
+    for chunk in pd.read_csv(csv_file, index_col=0, chunksize=chunksize):
+        if carry is not None:
+            chunk = pd.concat([carry, chunk])
+        # the last genome of the chunk may continue in the next one
+        last = chunk['genome_file'].iloc[-1]
+        carry = chunk[chunk['genome_file'] == last]
+        for genome_file, table in chunk[chunk['genome_file'] != last].groupby('genome_file', sort=False):
+            write_genome_partition(store, genome_file, table)
+            converted += len(table)
+    if carry is not None and len(carry):
+        write_genome_partition(store, carry['genome_file'].iloc[0], carry)
+        converted += len(carry)
+    return converted
+
+
+def main(argv):
+    if len(argv) < 3 or argv[1] not in ("convert", "info"):
+        print("Usage: python proteome_store.py convert <Proteins_genomes_cpNN.csv> <store>")
+        print("       python proteome_store.py info <store>")
+        sys.exit(1)
+
+    if argv[1] == "convert":
+        print(f"Converted {convert_csv(argv[2], argv[3])} proteins from {argv[2]} into {argv[3]}")
+        store = argv[3]
+    else:
+        store = argv[2]
+
+    meta = load_proteome(store, ['organism_name', 'length'])
+    print(f"Genomes: {len(genomes(store))}")
+    print(f"Proteins: {len(meta)} ({meta['length'].sum()} residues)")
+    print(f"Unique species: {meta['organism_name'].nunique()}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
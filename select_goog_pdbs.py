@@ -5,25 +5,28 @@ import sys
 
 
 
-def main(file):
+def main(file, output="/home/anirudh/genomes/predicted/good_pdbs.txt", min_plddt=80):
     data = pd.read_csv(file)
     print(f"Total number of sequences: {len(data)}")
 
-    filtered_data = data[data["confidence"] >= 80]
+    filtered_data = data[data["confidence"] >= min_plddt]
 
-    print(f"Number of sequences with confidence >= 80: {len(filtered_data)}")
+    print(f"Number of sequences with confidence >= {min_plddt}: {len(filtered_data)}")
 
     selected_ids = filtered_data["IDs"].tolist()
-    with open("/home/anirudh/genomes/predicted/good_pdbs.txt", "w") as f:
+    with open(output, "w") as f:
         for id in selected_ids:
             f.write(f"{id}\n")
     print("Good pdb IDs written to good_pdbs.txt")
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python create_good_pdbs_list.py <input_csv_file>")
+    if len(sys.argv) < 2:
+        print("Usage: python create_good_pdbs_list.py <input_csv_file> [good_pdbs.txt] [min pLDDT]")
         sys.exit(1)
 
     input_file = sys.argv[1]
-    main(input_file)
\ No newline at end of file
+    if len(sys.argv) > 2:
+        main(input_file, sys.argv[2], float(sys.argv[3]) if len(sys.argv) > 3 else 80)
+    else:
+        main(input_file)
\ No newline at end of file
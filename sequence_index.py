@@ -0,0 +1,384 @@
+# Exact and substring sequence lookup over the compiled proteome
+#
+# Finds which proteins (CDS ID, genome, organism) contain a sequence or a motif without
+# scanning the sequence column or re-running seqkit/mmseqs. The index is a folder of
+# flat files that are memory-mapped at query time, so opening it costs almost nothing
+# and only the pages a query touches are read:
+#
+#   residues.bin      all sequences, one per line (the newline keeps matches inside a protein)
+#   offsets.npy       start of every sequence in residues.bin (n + 1 entries)
+#   hashes.npy        sorted 64-bit sequence hashes, and hash_order.npy the protein of each
+#   kmer_ptr.npy      CSR index: proteins containing k-mer c are kmer_proteins[ptr[c]:ptr[c + 1]]
+#   kmer_proteins.npy
+#   proteins.tsv      cds_id, genome_file and organism_name per protein, with
+#   proteins_offsets.npy  the byte offset of every line
+#
+# Exact lookups hash the query and check the few proteins with that hash. Substring and
+# motif searches intersect the posting lists of the query's k-mers (rarest first) and
+# confirm each candidate against its sequence. Motifs use residues, X or . for any
+# residue and [..] for a residue class, e.g. "C..C[ST]"; a motif without k residues in
+# a row falls back to a regex scan of residues.bin.
+#
+# Usage:
+#   python sequence_index.py build Proteins_genomes_cp50.csv Proteins_genomes_cp50.seqidx
+#   python sequence_index.py build combined_proteins.faa combined.seqidx [--id-map all_faa_ids.csv]
+#   python sequence_index.py lookup Proteins_genomes_cp50.seqidx MKVLAAGIVG...
+#   python sequence_index.py search Proteins_genomes_cp50.seqidx GGGTGSG [--limit 50]
+
+import os
+import re
+import sys
+import json
+import mmap
+import time
+import hashlib
+import argparse
+
+import numpy as np
+import pandas as pd
+
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+DEFAULT_K = 5
+INDEX_INFO = "index.json"
+
+# residue byte -> 0..19, everything else (X, *, newline, ...) -> 255
+CODES = np.full(256, 255, dtype=np.uint8)
+for _i, _aa in enumerate(AMINO_ACIDS):
+    CODES[ord(_aa)] = _i
+
+
+def sequence_hash(seq):
+    return int.from_bytes(hashlib.blake2b(seq.encode(), digest_size=8).digest(), "little")
+
+
+def clean_sequence(seq):
+    return seq.strip().upper().rstrip("*")
+
+
+def kmer_codes(residues, k):
+    """
+    Integer code of every k-mer window of a residue byte array; windows with a
+    non-standard residue or a newline get -1.
+    """
+    codes = CODES[residues]
+    n = len(codes) - k + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.int64)
+    kmers = np.zeros(n, dtype=np.int64)
+    invalid = np.zeros(n, dtype=bool)
+    for j in range(k):
+        window = codes[j:j + n]
+        kmers = kmers * len(AMINO_ACIDS) + window
+        invalid |= window == 255
+    kmers[invalid] = -1
+    return kmers
+
+
+# =====================
+# Sources
+# =====================
+
+def table_proteins(tables):
+    """(cds_id, genome_file, organism_name, sequence) rows from compile_cds_info.py tables."""
+    for table in tables:
+        yield from table[['cds_id', 'genome_file', 'organism_name', 'sequence']].itertuples(index=False, name=None)
+
+
+def fasta_proteins(fasta, id_map=None):
+    """
+    (cds_id, genome_file, organism_name, sequence) rows of a FASTA file such as
+    combined_proteins.faa. Genomes come from the merge_faa.sh ID table (cds_id,source_file)
+    if given; organisms are not known.
+    """
+    genome_of = {}
+    if id_map is not None:
+        ids = pd.read_csv(id_map)
+        genome_of = dict(zip(ids['cds_id'], ids['source_file'].str.replace(r"(_genomic)?\.faa$", "", regex=True)))
+    with open(fasta) as f:
+        cds_id, seq = None, []
+        for line in f:
+            if line.startswith(">"):
+                if cds_id is not None:
+                    yield cds_id, genome_of.get(cds_id), None, "".join(seq)
+                cds_id, seq = line[1:].split()[0], []
+            else:
+                seq.append(line.strip())
+        if cds_id is not None:
+            yield cds_id, genome_of.get(cds_id), None, "".join(seq)
+
+
+def open_source(source, id_map=None, chunksize=200000):
+    """Protein rows of a compiled CSV, a proteome store folder or a FASTA file."""
+    if os.path.isdir(source):
+        from proteome_store import load_proteome, genomes
+        return table_proteins(load_proteome(source, ['cds_id', 'genome_file', 'organism_name', 'sequence'],
+                                            genomes=[g]) for g in genomes(source))
+    if source.endswith(".csv"):
+        return table_proteins(pd.read_csv(source, index_col=0, chunksize=chunksize))
+    return fasta_proteins(source, id_map)
+
+
+# =====================
+# Building
+# =====================
+
+def build_index(proteins, path, k=DEFAULT_K, chunk_residues=50_000_000, log=print):
+    """
+    Write an index of ``proteins`` ((cds_id, genome_file, organism_name, sequence) rows) to ``path``.
+
+    Returns:
+        int: Number of proteins indexed.
+    """
+    os.makedirs(path, exist_ok=True)
+    offsets, line_offsets, hashes = [0], [0], []
+    with open(os.path.join(path, "residues.bin"), "wb") as res, \
+            open(os.path.join(path, "proteins.tsv"), "wb") as meta:
+        for cds_id, genome, organism, seq in proteins:
+            seq = clean_sequence(seq if isinstance(seq, str) else "")
+            res.write(seq.encode() + b"\n")
+            offsets.append(offsets[-1] + len(seq) + 1)
+            hashes.append(sequence_hash(seq))
+            fields = [cds_id, genome, organism]
+            line = "\t".join("" if v is None or v != v else str(v) for v in fields).encode() + b"\n"
+            meta.write(line)
+            line_offsets.append(line_offsets[-1] + len(line))
+    n = len(hashes)
+    np.save(os.path.join(path, "offsets.npy"), np.array(offsets, dtype=np.int64))
+    np.save(os.path.join(path, "proteins_offsets.npy"), np.array(line_offsets, dtype=np.int64))
+    hashes = np.array(hashes, dtype=np.uint64)
+    order = np.argsort(hashes, kind="stable")
+    np.save(os.path.join(path, "hashes.npy"), hashes[order])
+    np.save(os.path.join(path, "hash_order.npy"), order.astype(np.int32))
+    log(f"Wrote {n} sequences ({offsets[-1] - n} residues)")
+
+    build_kmer_index(path, k, chunk_residues, log)
+    with open(os.path.join(path, INDEX_INFO), "w") as f:
+        json.dump({"proteins": n, "residues": int(offsets[-1] - n), "k": k}, f, indent=1)
+    return n
+
+
+def _kmer_chunks(residues, offsets, k, chunk_residues):
+    """(kmer, protein) pairs, unique per protein, for consecutive slices of proteins."""
+    n = len(offsets) - 1
+    first = 0
+    while first < n:
+        last = int(np.searchsorted(offsets, offsets[first] + chunk_residues, side="right")) - 1
+        last = min(max(last, first + 1), n)
+        start, end = int(offsets[first]), int(offsets[last])
+        kmers = kmer_codes(np.asarray(residues[start:end]), k)
+        protein = np.searchsorted(offsets[first:last + 1], np.arange(start, start + len(kmers)), side="right") - 1 + first
+        valid = kmers >= 0
+        # one key per (kmer, protein), so sorting orders by k-mer, then protein
+        keys = np.sort(kmers[valid] * n + protein[valid])
+        if len(keys):
+            keys = keys[np.r_[True, keys[1:] != keys[:-1]]]
+            yield keys // n, (keys % n).astype(np.int32)
+        first = last
+
+
+def build_kmer_index(path, k=DEFAULT_K, chunk_residues=50_000_000, log=print):
+    """
+    Build the k-mer posting lists in two passes over residues.bin: count the proteins
+    per k-mer, then fill the lists in protein order so each one comes out sorted.
+    """
+    offsets = np.load(os.path.join(path, "offsets.npy"))
+    residues = np.memmap(os.path.join(path, "residues.bin"), dtype=np.uint8, mode="r") \
+        if offsets[-1] else np.zeros(0, dtype=np.uint8)
+    size = len(AMINO_ACIDS) ** k
+
+    counts = np.zeros(size, dtype=np.int64)
+    for kmers, _ in _kmer_chunks(residues, offsets, k, chunk_residues):
+        counts += np.bincount(kmers, minlength=size)
+    ptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(counts, out=ptr[1:])
+    np.save(os.path.join(path, "kmer_ptr.npy"), ptr)
+
+    postings = np.lib.format.open_memmap(os.path.join(path, "kmer_proteins.npy"), mode="w+",
+                                         dtype=np.int32, shape=(int(ptr[-1]),))
+    cursor = ptr[:-1].copy()
+    for kmers, proteins in _kmer_chunks(residues, offsets, k, chunk_residues):
+        starts = np.flatnonzero(np.r_[True, kmers[1:] != kmers[:-1]])
+        unique, group = kmers[starts], np.diff(np.r_[starts, len(kmers)])
+        rank = np.arange(len(kmers)) - np.repeat(starts, group)
+        postings[cursor[kmers] + rank] = proteins
+        cursor[unique] += group
+    postings.flush()
+    log(f"Indexed {int(ptr[-1])} protein k-mers (k={k})")
+
+
+# =====================
+# Queries
+# =====================
+
+def parse_motif(motif):
+    """
+    Split a motif into a regex and its literal residue runs.
+
+    Returns:
+        (str, list): regex pattern, runs of plain residues.
+    """
+    motif = clean_sequence(motif)
+    pattern, runs, run = [], [], []
+    for token in re.findall(r"\[[A-Z]+\]|.", motif):
+        if token in AMINO_ACIDS:
+            run.append(token)
+            pattern.append(token)
+            continue
+        if run:
+            runs.append("".join(run))
+            run = []
+        if token in ("X", "."):
+            pattern.append("[^\\n]")
+        elif token.startswith("["):
+            pattern.append(token)
+        else:
+            raise ValueError(f"Unsupported motif character '{token}' in {motif}")
+    if run:
+        runs.append("".join(run))
+    return "".join(pattern), runs
+
+
+class SequenceIndex:
+    """
+    Memory-mapped handle on an index written by build_index().
+
+    Parameters:
+        path (str): Index folder.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_INFO)) as f:
+            info = json.load(f)
+        self.k = info["k"]
+        self.n = info["proteins"]
+
+        def load(name):
+            return np.load(os.path.join(path, name), mmap_mode="r")
+
+        self.offsets = load("offsets.npy")
+        self.hashes = load("hashes.npy")
+        self.hash_order = load("hash_order.npy")
+        self.kmer_ptr = load("kmer_ptr.npy")
+        self.kmer_proteins = load("kmer_proteins.npy")
+        self.line_offsets = load("proteins_offsets.npy")
+        self._files = [open(os.path.join(path, name), "rb") for name in ("residues.bin", "proteins.tsv")]
+        self.residues, self.meta = [mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                                    if os.path.getsize(f.name) else b"" for f in self._files]
+
+    def sequence(self, i):
+        return self.residues[int(self.offsets[i]):int(self.offsets[i + 1]) - 1].decode()
+
+    def proteins(self, ids):
+        """cds_id, genome_file and organism_name of protein numbers ``ids``."""
+        rows = []
+        for i in ids:
+            line = self.meta[int(self.line_offsets[i]):int(self.line_offsets[i + 1]) - 1].decode()
+            rows.append([v or None for v in line.split("\t")])
+        return pd.DataFrame(rows, columns=['cds_id', 'genome_file', 'organism_name'])
+
+    def lookup(self, seq):
+        """
+        Proteins whose sequence is exactly ``seq``.
+
+        Returns:
+            pd.DataFrame: cds_id, genome_file, organism_name.
+        """
+        seq = clean_sequence(seq)
+        h = np.uint64(sequence_hash(seq))
+        lo = np.searchsorted(self.hashes, h, side="left")
+        hi = np.searchsorted(self.hashes, h, side="right")
+        ids = [int(i) for i in sorted(self.hash_order[lo:hi]) if self.sequence(int(i)) == seq]
+        return self.proteins(ids)
+
+    def candidates(self, run):
+        """Proteins that contain every k-mer of the residue run, or None if it is shorter than k."""
+        kmers = np.unique(kmer_codes(np.frombuffer(run.encode(), dtype=np.uint8), self.k))
+        if len(kmers) == 0:
+            return None
+        sizes = self.kmer_ptr[kmers + 1] - self.kmer_ptr[kmers]
+        found = None
+        for kmer in kmers[np.argsort(sizes)]:
+            postings = self.kmer_proteins[self.kmer_ptr[kmer]:self.kmer_ptr[kmer + 1]]
+            found = np.asarray(postings) if found is None else np.intersect1d(found, postings, assume_unique=True)
+            if len(found) == 0:
+                break
+        return found
+
+    def search(self, motif, limit=None):
+        """
+        Proteins containing a substring or motif, with the 0-based start of the first match.
+
+        Returns:
+            pd.DataFrame: cds_id, genome_file, organism_name, start.
+        """
+        pattern, runs = parse_motif(motif)
+        regex = re.compile(pattern.encode())
+        found = None
+        for run in runs:
+            ids = self.candidates(run)
+            if ids is not None:
+                found = ids if found is None else np.intersect1d(found, ids, assume_unique=True)
+
+        hits = []
+        if found is None:
+            # no k residues in a row: scan the whole file
+            for m in regex.finditer(self.residues):
+                i = int(np.searchsorted(self.offsets, m.start(), side="right")) - 1
+                if not hits or hits[-1][0] != i:
+                    hits.append((i, m.start() - int(self.offsets[i])))
+                if limit and len(hits) >= limit:
+                    break
+        else:
+            for i in found:
+                i = int(i)
+                m = regex.search(self.residues, int(self.offsets[i]), int(self.offsets[i + 1]))
+                if m is not None:
+                    hits.append((i, m.start() - int(self.offsets[i])))
+                    if limit and len(hits) >= limit:
+                        break
+        result = self.proteins([i for i, _ in hits])
+        result['start'] = [start for _, start in hits]
+        return result
+
+    def close(self):
+        for m in (self.residues, self.meta):
+            if isinstance(m, mmap.mmap):
+                m.close()
+        for f in self._files:
+            f.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Build or query the protein sequence index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build")
+    build.add_argument("source", help="Proteins_genomes_cpNN.csv, its Parquet store, or a FASTA file")
+    build.add_argument("index")
+    build.add_argument("--id-map", default=None, help="cds_id,source_file table for FASTA input (merge_faa.sh)")
+    build.add_argument("-k", type=int, default=DEFAULT_K, help="k-mer length of the substring index")
+    lookup = sub.add_parser("lookup")
+    lookup.add_argument("index")
+    lookup.add_argument("sequence")
+    search = sub.add_parser("search")
+    search.add_argument("index")
+    search.add_argument("motif")
+    search.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args(argv[1:])
+
+    start = time.time()
+    if args.command == "build":
+        n = build_index(open_source(args.source, args.id_map), args.index, args.k)
+        print(f"Indexed {n} proteins into {args.index} in {time.time() - start:.0f} s")
+        return
+
+    index = SequenceIndex(args.index)
+    results = index.lookup(args.sequence) if args.command == "lookup" else index.search(args.motif, args.limit)
+    print(f"Found {len(results)} proteins in {(time.time() - start) * 1000:.1f} ms")
+    print(results.to_string(index=False))
+    index.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv)